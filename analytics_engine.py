@@ -0,0 +1,325 @@
+# analytics_engine.py - Векторизованная аналитика по колоночному снимку activities
+#
+# Снимок хранит события в NumPy-массивах (int32 id, float32 длительность/оценка,
+# коды действий) и периодически дочитывает новые строки. Прогресс пользователя,
+# статистика курса и когорты считаются group-by операциями над массивами.
+#
+# Дочитывание видит только id > last_id. Если число строк с id <= last_id изменилось (импорт
+# истории с явными id, перенос в архив), снимок строится заново рядом с текущим и подменяет его.
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import Integer, cast, func, select
+
+import retention
+from db import ReadSessionLocal, Activity, Course, Material
+
+ANALYTICS_BACKEND = os.getenv("ANALYTICS_BACKEND", "sql")  # sql | snapshot
+ANALYTICS_SNAPSHOT_INTERVAL = float(os.getenv("ANALYTICS_SNAPSHOT_INTERVAL", "60"))
+SNAPSHOT_FETCH_SIZE = 100_000
+
+COLUMNS = ("user_id", "material_id", "course_id", "action", "timestamp", "duration", "score")
+
+COMPLETE = "complete"
+
+logger = logging.getLogger(__name__)
+
+
+class ActivitySnapshot:
+    """Колоночный снимок таблицы activities"""
+
+    def __init__(self, session_factory=ReadSessionLocal):
+        self.session_factory = session_factory
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._reset()
+
+    def _reset(self):
+        self.last_id = 0
+        # Строк activities с id <= last_id на момент загрузки (без учета join с materials)
+        self.loaded_rows = 0
+        self.refreshed_at: Optional[datetime] = None
+        self.actions: List[str] = []
+        self._action_codes: Dict[str, int] = {}
+        self.user_id = np.empty(0, np.int32)
+        self.material_id = np.empty(0, np.int32)
+        self.course_id = np.empty(0, np.int32)
+        self.action = np.empty(0, np.int16)
+        self.timestamp = np.empty(0, np.int64)  # секунды UNIX
+        self.duration = np.empty(0, np.float32)  # NaN = нет значения
+        self.score = np.empty(0, np.float32)
+        self.course_titles: Dict[int, str] = {}
+        self.course_material_count = np.zeros(1, np.int32)
+        self._material_course = np.zeros(0, np.int32)
+        self._user_order = np.empty(0, np.int64)
+        self._user_keys = np.empty(0, np.int32)
+        self._course_order = np.empty(0, np.int64)
+        self._course_keys = np.empty(0, np.int32)
+
+    def __len__(self) -> int:
+        return len(self.user_id)
+
+    def _action_code(self, action: Optional[str]) -> int:
+        action = action or ""
+        code = self._action_codes.get(action)
+        if code is None:
+            code = self._action_codes[action] = len(self.actions)
+            self.actions.append(action)
+        return code
+
+    async def refresh(self, full: bool = False):
+        """Дочитывает события с id > last_id; перечитывает все при full=True или если изменились
+        строки, которые уже в снимке"""
+        async with self._lock:
+            # Одна транзакция чтения: проверка, загрузка и подсчет видят одно состояние базы
+            async with self.session_factory() as session:
+                if not full and self.refreshed_at is not None:
+                    full = await self._count_loaded(session) != self.loaded_rows
+                    if full:
+                        logger.info("Activities up to id %d changed, reloading the snapshot", self.last_id)
+                if full:
+                    # Новый снимок строится отдельно: до подмены запросы отвечают по текущему
+                    fresh = ActivitySnapshot(self.session_factory)
+                    await fresh._load(session)
+                    for name, value in vars(fresh).items():
+                        if name not in ("session_factory", "_lock", "_task"):
+                            setattr(self, name, value)
+                else:
+                    await self._load(session)
+
+    async def _load(self, session):
+        await self._load_catalog(session)
+        # Архив (см. retention.py) читается один раз, при первой загрузке снимка
+        if self.refreshed_at is None:
+            await self._load_archive()
+        await self._load_activities(session)
+        self.loaded_rows = await self._count_loaded(session)
+        self.refreshed_at = datetime.utcnow()
+
+    async def _count_loaded(self, session) -> int:
+        return (await session.execute(
+            select(func.count()).select_from(Activity).where(Activity.id <= self.last_id)
+        )).scalar()
+
+    async def _load_catalog(self, session):
+        courses = await session.execute(select(Course.id, Course.title))
+        self.course_titles = dict(courses.all())
+        counts = await session.execute(
+            select(Material.course_id, func.count(Material.id)).group_by(Material.course_id)
+        )
+        counts = [(course_id, count) for course_id, count in counts.all() if course_id is not None]
+        size = max([course_id for course_id, _ in counts] + list(self.course_titles) + [0]) + 1
+        self.course_material_count = np.zeros(size, np.int32)
+        for course_id, count in counts:
+            self.course_material_count[course_id] = count
+
+        materials = (await session.execute(select(Material.id, func.coalesce(Material.course_id, -1)))).all()
+        # -2: материала нет в каталоге (такие события не попадают и в join по activities)
+        self._material_course = np.full(max([m for m, _ in materials] + [0]) + 1, -2, np.int32)
+        for material_id, course_id in materials:
+            self._material_course[material_id] = course_id
+
+    async def _load_archive(self):
+        chunks = []
+        for columns in retention.iter_archived():
+            material_id = columns["material_id"]
+            course_id = np.full(len(material_id), -2, np.int32)
+            known = (material_id >= 0) & (material_id < len(self._material_course))
+            course_id[known] = self._material_course[material_id[known]]
+            keep = course_id != -2
+            actions, codes = np.unique(columns["action"][keep], return_inverse=True)
+            action_codes = np.array([self._action_code(a) for a in actions.tolist()], np.int16)
+            chunks.append((
+                columns["user_id"][keep].astype(np.int32), material_id[keep].astype(np.int32), course_id[keep],
+                action_codes[codes].astype(np.int16),
+                columns["timestamp"][keep].astype("datetime64[s]").astype(np.int64),
+                columns["duration"][keep].astype(np.float32), columns["score"][keep].astype(np.float32),
+            ))
+        await self._append(chunks)
+
+    async def _load_activities(self, session):
+        stmt = select(
+            Activity.id, func.coalesce(Activity.user_id, -1), Activity.material_id,
+            func.coalesce(Material.course_id, -1), Activity.action,
+            cast(func.strftime("%s", Activity.timestamp), Integer), Activity.duration, Activity.score,
+        ).join(
+            Material, Activity.material_id == Material.id
+        ).where(
+            Activity.id > self.last_id
+        ).order_by(Activity.id).execution_options(yield_per=SNAPSHOT_FETCH_SIZE)
+
+        chunks = []
+        result = await session.stream(stmt)
+        async for rows in result.partitions():
+            ids, users, materials, courses, actions, timestamps, durations, scores = zip(*rows)
+            chunks.append((
+                np.array(users, np.int32), np.array(materials, np.int32), np.array(courses, np.int32),
+                np.array([self._action_code(a) for a in actions], np.int16),
+                np.array(timestamps, np.int64),
+                np.array(durations, np.float32), np.array(scores, np.float32),
+            ))
+            last_id = ids[-1]
+        await self._append(chunks)
+        # После подмены массивов: last_id не опережает данные снимка (см. progress_snapshot в main.py)
+        if chunks:
+            self.last_id = last_id
+
+    async def _append(self, chunks):
+        if not chunks:
+            return
+        # Массивы собираются в пуле потоков (NumPy отпускает GIL), а подменяются разом в event loop:
+        # запросы видят либо прежний снимок, либо новый целиком
+        merged = await asyncio.get_running_loop().run_in_executor(None, self._merged, chunks)
+        for name, value in merged.items():
+            setattr(self, name, value)
+
+    def _merged(self, chunks) -> Dict[str, np.ndarray]:
+        start = len(self)
+        merged = {
+            name: np.concatenate([getattr(self, name), *parts]) for name, parts in zip(COLUMNS, zip(*chunks))
+        }
+        # Перестановки, отсортированные по пользователю и курсу: выборка по ключу - searchsorted.
+        # Сортируются только новые строки и вливаются в готовый порядок; side="right" ставит их после
+        # прежних строк с тем же ключом, как стабильная сортировка всего снимка
+        for column, order_name, keys_name in (("user_id", "_user_order", "_user_keys"),
+                                              ("course_id", "_course_order", "_course_keys")):
+            keys = merged[column][start:]
+            order = np.argsort(keys, kind="stable")
+            keys = keys[order]
+            at = np.searchsorted(getattr(self, keys_name), keys, side="right")
+            merged[order_name] = np.insert(getattr(self, order_name), at, order + start)
+            merged[keys_name] = np.insert(getattr(self, keys_name), at, keys)
+        return merged
+
+    @staticmethod
+    def _rows_for(sorted_keys: np.ndarray, order: np.ndarray, key: int) -> np.ndarray:
+        start, end = np.searchsorted(sorted_keys, [key, key + 1])
+        return order[start:end]
+
+    def _complete_mask(self, rows: np.ndarray) -> np.ndarray:
+        code = self._action_codes.get(COMPLETE)
+        if code is None:
+            return np.zeros(len(rows), bool)
+        return self.action[rows] == code
+
+    def user_progress(self, user_id: int) -> Dict[int, Dict[str, Any]]:
+        rows = self._rows_for(self._user_keys, self._user_order, user_id)
+        # Материалы без курса (course_id = -1) в прогресс не входят, как и в SQL-версии
+        rows = rows[self.course_id[rows] >= 0]
+        if not len(rows):
+            return {}
+        course_ids, course_index = np.unique(self.course_id[rows], return_inverse=True)
+        n = len(course_ids)
+
+        duration = self.duration[rows]
+        total_time = np.bincount(course_index, weights=np.nan_to_num(duration), minlength=n)
+        score = self.score[rows]
+        has_score = ~np.isnan(score)
+        score_sum = np.bincount(course_index[has_score], weights=score[has_score], minlength=n)
+        score_count = np.bincount(course_index[has_score], minlength=n)
+
+        # Завершенные материалы без повторов: уникальные пары (курс, материал)
+        complete = self._complete_mask(rows)
+        pairs = np.unique(np.stack([course_index[complete], self.material_id[rows][complete]]), axis=1)
+        completed = np.bincount(pairs[0], minlength=n) if pairs.size else np.zeros(n, np.int64)
+
+        totals = self.course_material_count[np.minimum(course_ids, len(self.course_material_count) - 1)]
+        progress = {}
+        for i, course_id in enumerate(course_ids.tolist()):
+            total = int(totals[i])
+            progress[course_id] = {
+                "course_title": self.course_titles.get(course_id),
+                "total_materials": total,
+                "completed_materials": int(completed[i]),
+                "total_time": float(total_time[i]),
+                "avg_score": float(score_sum[i] / score_count[i]) if score_count[i] else 0,
+                "score_count": int(score_count[i]),
+                "completion_percentage": float(completed[i] / total * 100) if total else 0,
+            }
+        return progress
+
+    def course_statistics(self, course_id: int) -> Dict[str, Any]:
+        rows = self._rows_for(self._course_keys, self._course_order, course_id)
+        users = self.user_id[rows]
+        students = len(np.unique(users[users >= 0]))
+        score = self.score[rows]
+        scored = score[~np.isnan(score)]
+        completions = int(self._complete_mask(rows).sum())
+        return {
+            "total_students": students,
+            "total_time_spent": float(np.nansum(self.duration[rows])),
+            "average_score": float(scored.mean()) if len(scored) else 0,
+            "total_completions": completions,
+            "engagement_rate": completions / students if students else 0,
+        }
+
+    def cohorts(self, course_id: Optional[int] = None, period_days: int = 7, periods: int = 12) -> List[Dict[str, Any]]:
+        """Когорты по периоду первой активности: сколько пользователей активны через 0..periods периодов"""
+        if course_id is None:
+            rows = np.arange(len(self))
+        else:
+            rows = self._rows_for(self._course_keys, self._course_order, course_id)
+        rows = rows[self.user_id[rows] >= 0]
+        if not len(rows):
+            return []
+        period = self.timestamp[rows] // (period_days * 86400)
+        users, user_index = np.unique(self.user_id[rows], return_inverse=True)
+        first_period = np.full(len(users), np.iinfo(np.int64).max)
+        np.minimum.at(first_period, user_index, period)
+
+        cohort = first_period[user_index]
+        offset = period - cohort
+        keep = offset < periods
+        # Уникальные тройки (когорта, смещение, пользователь) -> число активных в ячейке
+        cells = np.unique(np.stack([cohort[keep], offset[keep], user_index[keep]]), axis=1)
+        cohort_ids, cohort_index = np.unique(cells[0], return_inverse=True)
+        matrix = np.zeros((len(cohort_ids), periods), np.int64)
+        np.add.at(matrix, (cohort_index, cells[1]), 1)
+
+        epoch = datetime(1970, 1, 1)
+        return [
+            {
+                "cohort_start": epoch + timedelta(days=int(cohort_id) * period_days),
+                "size": int(matrix[i, 0]),
+                "active": matrix[i].tolist(),
+            }
+            for i, cohort_id in enumerate(cohort_ids.tolist())
+        ]
+
+    async def start(self, interval: float = ANALYTICS_SNAPSHOT_INTERVAL):
+        if self._task and not self._task.done():
+            return
+        await self.refresh()
+        self._task = asyncio.create_task(self._refresh_loop(interval))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _refresh_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Activity snapshot refresh failed")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "events": len(self),
+            "last_id": self.last_id,
+            "refreshed_at": self.refreshed_at,
+            "memory_bytes": sum(getattr(self, name).nbytes for name in COLUMNS),
+        }
+
+
+snapshot = ActivitySnapshot()
@@ -0,0 +1 @@
+# benchmarks - Скрипты для замеров производительности
@@ -0,0 +1,142 @@
+# benchmarks/analytics_bench.py - ORM-цикл против колоночного снимка на больших объемах
+#
+# Запуск: python -m benchmarks.analytics_bench --events 1000000 10000000
+import argparse
+import asyncio
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from analytics_engine import ActivitySnapshot
+from benchmarks.common import make_temp_database
+from benchmarks.progress_bench import legacy_user_progress
+from db import Activity, Material
+
+ACTIONS = ("view", "start", "complete")
+INSERT_CHUNK = 100_000
+
+
+async def legacy_course_statistics(db, course_id):
+    """Прежняя реализация get_course_statistics: ORM-объект на каждое событие курса"""
+    stmt = select(Activity, Material).join(
+        Material, Activity.material_id == Material.id
+    ).where(Material.course_id == course_id)
+    result = await db.execute(stmt)
+
+    unique_students = set()
+    total_time = 0.0
+    scores = []
+    completions = 0
+    for activity, material in result.all():
+        unique_students.add(activity.user_id)
+        total_time += activity.duration or 0
+        if activity.score is not None:
+            scores.append(activity.score)
+        if activity.action == "complete":
+            completions += 1
+    return {
+        "total_students": len(unique_students),
+        "total_time_spent": total_time,
+        "average_score": sum(scores) / len(scores) if scores else 0,
+        "total_completions": completions,
+        "engagement_rate": completions / len(unique_students) if unique_students else 0
+    }
+
+
+def fill(path: str, events: int, users: int, courses: int, materials_per_course: int, days: int):
+    """Генерирует данные напрямую через sqlite3.executemany (ORM на 10M строк слишком медленный)"""
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.executemany(
+        "INSERT INTO users (id, name, email, role, password_hash, is_active) VALUES (?, ?, ?, 'student', 'x', 1)",
+        ((i, f"user{i}", f"user{i}@example.com") for i in range(1, users + 1))
+    )
+    conn.executemany(
+        "INSERT INTO courses (id, title, category, level, teacher_id) VALUES (?, ?, 'bench', 'beginner', 1)",
+        ((i, f"course{i}") for i in range(1, courses + 1))
+    )
+    materials = courses * materials_per_course
+    conn.executemany(
+        "INSERT INTO materials (id, course_id, title, type, order_index) VALUES (?, ?, ?, 'quiz', ?)",
+        ((m, (m - 1) // materials_per_course + 1, f"m{m}", (m - 1) % materials_per_course)
+         for m in range(1, materials + 1))
+    )
+    start = datetime.utcnow() - timedelta(days=days)
+    span = days * 86400
+    for offset in range(0, events, INSERT_CHUNK):
+        rows = []
+        for _ in range(min(INSERT_CHUNK, events - offset)):
+            score = random.uniform(50, 100) if random.random() < 0.3 else None
+            rows.append((
+                random.randint(1, users), random.randint(1, materials), random.choice(ACTIONS),
+                (start + timedelta(seconds=random.randrange(span))).isoformat(sep=" "),
+                random.uniform(5, 600), score,
+            ))
+        conn.executemany(
+            "INSERT INTO activities (user_id, material_id, action, timestamp, duration, score) "
+            "VALUES (?, ?, ?, ?, ?, ?)", rows
+        )
+        conn.commit()
+    conn.close()
+
+
+async def timed_async(session_factory, fn, key, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        async with session_factory() as db:
+            await fn(db, key)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def timed(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+async def run(events: int, args):
+    engine, session_factory = await make_temp_database()
+    started = time.perf_counter()
+    fill(engine.url.database, events, args.users, args.courses, args.materials, args.days)
+    print(f"\n== {events:,} events (generated in {time.perf_counter() - started:.1f} s)")
+
+    snapshot = ActivitySnapshot(session_factory)
+    started = time.perf_counter()
+    await snapshot.refresh()
+    print(f"snapshot load:       {time.perf_counter() - started:8.2f} s, "
+          f"{snapshot.stats()['memory_bytes'] / 2 ** 20:.1f} MiB")
+
+    user_id, course_id = 1, 1
+    legacy_progress = await timed_async(session_factory, legacy_user_progress, user_id, args.repeat)
+    vector_progress = timed(lambda: snapshot.user_progress(user_id), args.repeat)
+    legacy_stats = await timed_async(session_factory, legacy_course_statistics, course_id, args.legacy_repeat)
+    vector_stats = timed(lambda: snapshot.course_statistics(course_id), args.repeat)
+    vector_cohorts = timed(lambda: snapshot.cohorts(course_id), args.repeat)
+    await engine.dispose()
+
+    print(f"user progress:       ORM loop {legacy_progress:10.2f} ms   snapshot {vector_progress:8.2f} ms")
+    print(f"course statistics:   ORM loop {legacy_stats:10.2f} ms   snapshot {vector_stats:8.2f} ms")
+    print(f"course cohorts:      {'':22}   snapshot {vector_cohorts:8.2f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Columnar analytics benchmark")
+    parser.add_argument("--events", type=int, nargs="+", default=[1_000_000, 10_000_000])
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--courses", type=int, default=50)
+    parser.add_argument("--materials", type=int, default=20, help="materials per course")
+    parser.add_argument("--days", type=int, default=180, help="time span of generated events")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--legacy-repeat", type=int, default=3, help="repeats for the slow course ORM loop")
+    args = parser.parse_args()
+
+    for events in args.events:
+        await run(events, args)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
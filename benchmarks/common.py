@@ -0,0 +1,43 @@
+# benchmarks/common.py - Общие утилиты для бенчмарков
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from db import Base, create_engine_from_settings, make_session_factory
+
+
+async def make_temp_database():
+    """Создает временную SQLite базу со схемой приложения"""
+    path = Path(tempfile.mkdtemp()) / "bench.sqlite3"
+    engine = create_engine_from_settings(f"sqlite+aiosqlite:///{path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    return engine, make_session_factory(engine)
+
+
+def report(name: str, count: int, elapsed: float):
+    print(f"{name:<32} {count:>8} events  {elapsed:8.3f} s  {count / elapsed:10.1f} events/s")
+
+
+def use_app_database(session_factory):
+    """Направляет приложение из main.py на временную базу и возвращает его"""
+    import main
+
+    async def get_db():
+        async with session_factory() as session:
+            yield session
+
+    main.SessionLocal = session_factory
+    main.ReadSessionLocal = session_factory
+    main.ingestor.session_factory = session_factory
+    main.jobs.runner.session_factory = session_factory
+    main.app.dependency_overrides[main.get_db] = get_db
+    main.app.dependency_overrides[main.get_read_db] = get_db
+    return main.app
+
+
+def percentile(values, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
@@ -0,0 +1,220 @@
+# benchmarks/generate.py - Быстрый генератор синтетических данных для планирования нагрузки
+#
+# Запуск: python -m benchmarks.generate --database ./bench.sqlite3 --users 100000 --courses 10000 --activities 50000000
+#
+# Пишет напрямую через sqlite3.executemany пачками (без ORM и без bcrypt на пользователя).
+# Распределения с перекосом: активность пользователей и популярность курсов - степенной закон,
+# внутри курса интерес падает к последним материалам, устройства - desktop/mobile/tablet.
+# Все пользователи получают пароль PASSWORD (один общий хэш), user1 - администратор.
+import argparse
+import asyncio
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.schema import CreateIndex
+
+from db import Base, Activity, create_engine_from_settings
+from hashing import pwd_context
+
+PASSWORD = "password123"
+CHUNK = 200_000
+
+CATEGORIES = ["Программирование", "Аналитика", "Математика", "Гуманитарные науки", "Дизайн", "Менеджмент",
+              "Языки", "Естественные науки"]
+LEVELS = ["beginner", "intermediate", "advanced"]
+MATERIAL_TYPES = ["video", "text", "quiz", "assignment"]
+MATERIAL_TYPE_WEIGHTS = [0.45, 0.3, 0.15, 0.1]
+ACTIONS = ["view", "start", "pause", "complete"]
+ACTION_WEIGHTS = [0.55, 0.2, 0.1, 0.15]
+DEVICES = ['{"device": "desktop"}', '{"device": "mobile"}', '{"device": "tablet"}']
+DEVICE_WEIGHTS = [0.55, 0.35, 0.1]
+WORDS = ("python данные анализ функция переменная цикл класс модуль алгоритм сортировка граф дерево "
+         "матрица вектор производная интеграл история сеть протокол сервер база запрос индекс").split()
+
+
+def power_law(rng, n: int, exponent: float) -> np.ndarray:
+    """Веса 1/rank^exponent в случайном порядке рангов"""
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    return rng.permutation(weights / weights.sum())
+
+
+def timestamps(rng, start: datetime, span_seconds: float, count: int) -> np.ndarray:
+    """Строки времени в формате SQLAlchemy DateTime для SQLite, по возрастанию"""
+    offsets = np.sort(rng.uniform(0, span_seconds, count))
+    values = np.datetime64(start, "us") + (offsets * 1e6).astype("timedelta64[us]")
+    return np.char.replace(np.datetime_as_string(values, unit="us"), "T", " ")
+
+
+async def create_schema(path: str):
+    engine = create_engine_from_settings(f"sqlite+aiosqlite:///{path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    await engine.dispose()
+
+
+def generate_users(conn, count: int, created: str):
+    password_hash = pwd_context.hash(PASSWORD)
+    teachers = max(1, count // 100)
+    roles = np.where(np.arange(1, count + 1) <= teachers + 1, "teacher", "student").astype(object)
+    roles[0] = "admin"
+    for offset in range(0, count, CHUNK):
+        ids = range(offset + 1, min(offset + CHUNK, count) + 1)
+        conn.executemany(
+            "INSERT INTO users (id, name, email, role, password_hash, created_at, is_active) VALUES (?, ?, ?, ?, ?, ?, 1)",
+            ((i, f"user{i}", f"user{i}@example.com", roles[i - 1], password_hash, created) for i in ids)
+        )
+    return teachers
+
+
+def generate_catalog(conn, rng, courses: int, materials_per_course: int, teachers: int, created: str):
+    """Курсы и материалы; возвращает (веса выбора материала, типы материалов)"""
+    conn.executemany(
+        "INSERT INTO courses (id, title, description, category, level, teacher_id, created_at, is_active) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, 1)",
+        ((i, f"{' '.join(rng.choice(WORDS, 3))} {i}", " ".join(rng.choice(WORDS, 20)),
+          CATEGORIES[rng.integers(len(CATEGORIES))], LEVELS[rng.integers(len(LEVELS))],
+          int(rng.integers(2, teachers + 2)), created)
+         for i in range(1, courses + 1))
+    )
+    # Число материалов в курсе варьируется вокруг среднего
+    sizes = np.clip(rng.poisson(materials_per_course, courses), 1, None)
+    material_course = np.repeat(np.arange(1, courses + 1), sizes)
+    order_index = np.concatenate([np.arange(size) for size in sizes])
+    types = rng.choice(MATERIAL_TYPES, len(material_course), p=MATERIAL_TYPE_WEIGHTS)
+    for offset in range(0, len(material_course), CHUNK):
+        conn.executemany(
+            "INSERT INTO materials (id, course_id, title, content, type, order_index, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            ((i + 1, int(material_course[i]), f"{WORDS[i % len(WORDS)]} {i + 1}", None, types[i],
+              int(order_index[i]), created)
+             for i in range(offset, min(offset + CHUNK, len(material_course))))
+        )
+    # Популярность курса (степенной закон) * отток к концу курса
+    weights = power_law(rng, courses, 1.1)[material_course - 1] * 0.85 ** order_index
+    return weights / weights.sum(), types
+
+
+def generate_activities(conn, rng, count: int, users: int, material_weights: np.ndarray, material_types,
+                        start: datetime, days: int):
+    # Вставка без вторичных индексов и построение их в конце в несколько раз быстрее
+    indexes = list(Activity.__table__.indexes)
+    for index in indexes:
+        conn.execute(f"DROP INDEX IF EXISTS {index.name}")
+
+    user_weights = power_law(rng, users, 1.2)
+    span = days * 86400
+    is_quiz = np.isin(material_types, ["quiz", "assignment"])
+    inserted = 0
+    for offset in range(0, count, CHUNK):
+        size = min(CHUNK, count - offset)
+        # Каждая пачка покрывает свой отрезок времени, поэтому id растут вместе с timestamp
+        chunk_start = start + timedelta(seconds=span * offset / count)
+        stamps = timestamps(rng, chunk_start, span * size / count, size)
+        user_ids = rng.choice(users, size, p=user_weights) + 1
+        material_ids = rng.choice(len(material_weights), size, p=material_weights)
+        actions = rng.choice(ACTIONS, size, p=ACTION_WEIGHTS)
+        durations = np.round(rng.lognormal(4.0, 1.0, size), 1)
+        scored = is_quiz[material_ids] & (actions == "complete")
+        scores = np.where(scored, np.round(rng.beta(5, 2, size) * 100, 1), np.nan)
+        devices = rng.choice(DEVICES, size, p=DEVICE_WEIGHTS)
+        conn.executemany(
+            "INSERT INTO activities (user_id, material_id, action, timestamp, duration, score, meta) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            zip(user_ids.tolist(), (material_ids + 1).tolist(), actions.tolist(), stamps.tolist(),
+                durations.tolist(), [None if s != s else s for s in scores.tolist()], devices.tolist())
+        )
+        conn.commit()
+        inserted += size
+        print(f"\r  activities: {inserted:,}/{count:,}", end="", flush=True)
+    print()
+
+    for index in indexes:
+        conn.execute(str(CreateIndex(index).compile(dialect=sqlite.dialect())))
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk synthetic data generator")
+    parser.add_argument("--database", default="./bench.sqlite3", help="SQLite file to fill")
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--courses", type=int, default=10_000)
+    parser.add_argument("--materials", type=int, default=10, help="average materials per course")
+    parser.add_argument("--activities", type=int, default=50_000_000)
+    parser.add_argument("--days", type=int, default=365, help="time span of generated activity")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--reset", action="store_true", help="delete the database file first")
+    parser.add_argument("--aggregates", action="store_true",
+                        help="rebuild course_stats and activity_rollups afterwards (slow for large volumes)")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    if args.reset:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.database + suffix):
+                os.remove(args.database + suffix)
+    asyncio.run(create_schema(args.database))
+
+    conn = sqlite3.connect(args.database)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA cache_size=-262144")
+    start = datetime.utcnow().replace(microsecond=0) - timedelta(days=args.days)
+    created = start.isoformat(sep=" ")
+
+    started = time.perf_counter()
+    teachers = generate_users(conn, args.users, created)
+    conn.commit()
+    print(f"users: {args.users:,} ({time.perf_counter() - started:.1f} s)")
+
+    started = time.perf_counter()
+    material_weights, material_types = generate_catalog(conn, rng, args.courses, args.materials, teachers, created)
+    conn.commit()
+    print(f"courses: {args.courses:,}, materials: {len(material_types):,} ({time.perf_counter() - started:.1f} s)")
+
+    started = time.perf_counter()
+    generate_activities(conn, rng, args.activities, args.users, material_weights, material_types, start, args.days)
+    elapsed = time.perf_counter() - started
+    print(f"activities: {args.activities:,} ({elapsed:.1f} s, {args.activities / elapsed:,.0f} rows/s)")
+    conn.execute("ANALYZE")
+    conn.close()
+    asyncio.run(rebuild_catalog(args.database))
+
+    if args.aggregates:
+        asyncio.run(rebuild_aggregates(args.database))
+    print(f"✅ {args.database}: password for every user is {PASSWORD!r}, user1@example.com is admin")
+
+
+async def rebuild_catalog(path: str):
+    """Сводка каталога для /catalog/summary (дешево: только users, courses, materials)"""
+    from catalog_summary import rebuild_catalog_summary
+    from db import make_session_factory
+
+    engine = create_engine_from_settings(f"sqlite+aiosqlite:///{path}")
+    async with make_session_factory(engine)() as session:
+        await rebuild_catalog_summary(session)
+        await session.commit()
+    await engine.dispose()
+
+
+async def rebuild_aggregates(path: str):
+    from course_stats import rebuild_course_stats
+    from db import make_session_factory
+    from rollups import backfill
+
+    engine = create_engine_from_settings(f"sqlite+aiosqlite:///{path}")
+    session_factory = make_session_factory(engine)
+    started = time.perf_counter()
+    async with session_factory() as session:
+        await rebuild_course_stats(session)
+        await session.commit()
+    processed = await backfill(session_factory)
+    await engine.dispose()
+    print(f"aggregates: {processed:,} events ({time.perf_counter() - started:.1f} s)")
+
+
+if __name__ == "__main__":
+    main()
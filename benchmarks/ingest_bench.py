@@ -0,0 +1,107 @@
+# benchmarks/ingest_bench.py - Сравнение поштучной и пакетной записи активности
+#
+# Запуск: python -m benchmarks.ingest_bench --events 5000 --concurrency 50
+import argparse
+import asyncio
+import time
+from datetime import datetime
+
+from sqlalchemy.exc import OperationalError
+
+from benchmarks.common import make_temp_database, report
+from db import Activity
+from ingest import ActivityIngestor
+
+
+def make_payload(i: int):
+    return {
+        "user_id": i % 100 + 1,
+        "material_id": i % 50 + 1,
+        "action": "view" if i % 3 else "complete",
+        "duration": 30.0,
+        "score": None,
+        "meta": {"device": "desktop"},
+    }
+
+
+async def run_concurrently(count: int, concurrency: int, handler):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            await handler(make_payload(i))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(count)))
+    return time.perf_counter() - start
+
+
+async def bench_per_event(count: int, concurrency: int):
+    """Старый путь create_activity: add + commit + refresh на каждое событие"""
+    engine, session_factory = await make_temp_database()
+    failures = 0
+
+    async def handler(payload):
+        nonlocal failures
+        async with session_factory() as db:
+            activity = Activity(**payload, timestamp=datetime.utcnow())
+            db.add(activity)
+            try:
+                await db.commit()
+                await db.refresh(activity)
+            except OperationalError:
+                # "database is locked" при конкурентных коммитах
+                failures += 1
+
+    elapsed = await run_concurrently(count, concurrency, handler)
+    await engine.dispose()
+    if failures:
+        print(f"per-event commit: {failures} events failed with OperationalError")
+    return elapsed
+
+
+async def bench_ingestor(count: int, concurrency: int, durability: str):
+    engine, session_factory = await make_temp_database()
+    ingestor = ActivityIngestor(session_factory=session_factory, durability=durability)
+    await ingestor.start()
+
+    async def handler(payload):
+        await ingestor.submit([payload])
+
+    start = time.perf_counter()
+    await run_concurrently(count, concurrency, handler)
+    await ingestor.stop()
+    elapsed = time.perf_counter() - start
+    await engine.dispose()
+    return elapsed
+
+
+async def bench_batch_endpoint(count: int, batch_size: int):
+    engine, session_factory = await make_temp_database()
+    ingestor = ActivityIngestor(session_factory=session_factory)
+    await ingestor.start()
+
+    start = time.perf_counter()
+    for offset in range(0, count, batch_size):
+        await ingestor.submit([make_payload(i) for i in range(offset, min(offset + batch_size, count))])
+    await ingestor.stop()
+    elapsed = time.perf_counter() - start
+    await engine.dispose()
+    return elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Activity ingestion benchmark")
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    report("per-event commit (old path)", args.events, await bench_per_event(args.events, args.concurrency))
+    report("ingestor, ack=flush", args.events, await bench_ingestor(args.events, args.concurrency, "flush"))
+    report("ingestor, ack=enqueue", args.events, await bench_ingestor(args.events, args.concurrency, "enqueue"))
+    report(f"batch of {args.batch_size}", args.events, await bench_batch_endpoint(args.events, args.batch_size))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,173 @@
+# benchmarks/load.py - Нагрузочный сценарий: логин, каталог, запись активности, аналитика
+#
+# На запущенном сервере:   python -m benchmarks.load --url http://localhost:8000 --duration 60 --concurrency 50
+# В процессе (ASGI):       python -m benchmarks.load --database ./bench.sqlite3 --duration 30
+#
+# База - из benchmarks.generate (пароль у всех пользователей общий, userN@example.com).
+# Отчет: запросы, ошибки, запросов в секунду и p50/p95/p99 по каждому эндпоинту.
+import argparse
+import asyncio
+import random
+import time
+from collections import defaultdict
+
+import httpx
+
+from benchmarks.common import percentile, use_app_database
+from benchmarks.generate import PASSWORD, WORDS
+
+DEFAULT_MIX = "login=5,browse=50,post=30,dashboard=15"
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, label: str, elapsed: float, ok: bool):
+        self.latencies[label].append(elapsed * 1000)
+        if not ok:
+            self.errors[label] += 1
+
+    def report(self, duration: float):
+        total = sum(len(v) for v in self.latencies.values())
+        print(f"{'endpoint':<40} {'count':>8} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for label in sorted(self.latencies):
+            values = self.latencies[label]
+            print(
+                f"{label:<40} {len(values):>8} {self.errors[label]:>7} {len(values) / duration:>8.1f} "
+                f"{percentile(values, 0.5):>8.1f} {percentile(values, 0.95):>8.1f} {percentile(values, 0.99):>8.1f}"
+            )
+        print(f"{'total':<40} {total:>8} {sum(self.errors.values()):>7} {total / duration:>8.1f}")
+
+
+class VirtualUser:
+    def __init__(self, client: httpx.AsyncClient, stats: Stats, user_id: int, catalog: dict, teacher_headers: dict):
+        self.client = client
+        self.stats = stats
+        self.user_id = user_id
+        self.catalog = catalog
+        self.teacher_headers = teacher_headers
+        self.headers = {}
+
+    async def call(self, label: str, method: str, url: str, headers=None, **kwargs) -> httpx.Response:
+        start = time.perf_counter()
+        response = await self.client.request(method, url, headers=headers or self.headers, **kwargs)
+        self.stats.record(label, time.perf_counter() - start, response.status_code < 400)
+        return response
+
+    async def login(self):
+        response = await self.call("POST /token", "POST", "/token", headers={},
+                                   data={"username": f"user{self.user_id}@example.com", "password": PASSWORD})
+        if response.status_code == 200:
+            self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    async def browse(self):
+        response = await self.call("GET /courses", "GET", "/courses", params={"limit": 20})
+        cursor = response.headers.get("x-next-cursor")
+        if cursor:
+            await self.call("GET /courses?cursor", "GET", "/courses", params={"limit": 20, "cursor": cursor})
+        course_id = random.randint(1, self.catalog["courses"])
+        await self.call("GET /courses/{id}", "GET", f"/courses/{course_id}")
+        await self.call("GET /courses/{id}/materials", "GET", f"/courses/{course_id}/materials")
+        await self.call("GET /search", "GET", "/search", params={"q": random.choice(WORDS)})
+
+    async def post(self):
+        events = [
+            {"user_id": self.user_id, "material_id": random.randint(1, self.catalog["materials"]),
+             "action": random.choice(["view", "start", "complete"]), "duration": round(random.uniform(5, 600), 1),
+             "meta": {"device": random.choice(["desktop", "mobile", "tablet"])}}
+            for _ in range(random.randint(1, 20))
+        ]
+        if len(events) == 1:
+            await self.call("POST /activities", "POST", "/activities", json=events[0])
+        else:
+            await self.call("POST /activities/batch", "POST", "/activities/batch", json={"activities": events})
+
+    async def dashboard(self):
+        await self.call("GET /analytics/user/{id}/progress", "GET", f"/analytics/user/{self.user_id}/progress")
+        course_id = random.randint(1, self.catalog["courses"])
+        await self.call("GET /analytics/course/{id}/statistics", "GET", f"/analytics/course/{course_id}/statistics",
+                        headers=self.teacher_headers)
+        await self.call("GET /analytics/course/{id}/timeseries", "GET", f"/analytics/course/{course_id}/timeseries",
+                        headers=self.teacher_headers)
+
+    async def run(self, deadline: float, scenarios, weights):
+        await self.login()
+        while time.perf_counter() < deadline:
+            await random.choices(scenarios, weights)[0](self)
+
+
+def parse_mix(mix: str):
+    scenarios = {"login": VirtualUser.login, "browse": VirtualUser.browse,
+                 "post": VirtualUser.post, "dashboard": VirtualUser.dashboard}
+    pairs = [part.split("=") for part in mix.split(",")]
+    return [scenarios[name] for name, _ in pairs], [float(weight) for _, weight in pairs]
+
+
+async def login_as(client, email: str) -> dict:
+    response = await client.post("/token", data={"username": email, "password": PASSWORD})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def discover_catalog(client, headers) -> dict:
+    """Число курсов и материалов (id в сгенерированной базе идут подряд с 1)"""
+    courses = await client.get("/courses", params={"limit": 1, "include_total": True}, headers=headers)
+    materials = await client.get("/materials", params={"limit": 1, "include_total": True}, headers=headers)
+    return {"courses": int(courses.headers["x-total-count"]), "materials": int(materials.headers["x-total-count"])}
+
+
+async def run_load(client: httpx.AsyncClient, duration: float, concurrency: int, users: int, mix: str):
+    """Прогоняет смешанную нагрузку; возвращает (Stats, фактическую длительность)"""
+    stats = Stats()
+    # user1 - администратор, user2 - преподаватель (см. benchmarks.generate)
+    admin_headers = await login_as(client, "user1@example.com")
+    teacher_headers = await login_as(client, "user2@example.com")
+    catalog = await discover_catalog(client, admin_headers)
+    scenarios, weights = parse_mix(mix)
+    virtual_users = [
+        VirtualUser(client, stats, random.randint(3, users), catalog, teacher_headers)
+        for _ in range(concurrency)
+    ]
+    start = time.perf_counter()
+    deadline = start + duration
+    await asyncio.gather(*(user.run(deadline, scenarios, weights) for user in virtual_users))
+    return stats, time.perf_counter() - start
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Mixed-workload load driver")
+    parser.add_argument("--url", default=None, help="running server; in-process ASGI app if omitted")
+    parser.add_argument("--database", default="./bench.sqlite3", help="SQLite file for the in-process app")
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--concurrency", type=int, default=20, help="virtual users")
+    parser.add_argument("--users", type=int, default=100_000, help="user ids to log in as (from the generator)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="scenario weights")
+    args = parser.parse_args()
+
+    engine = None
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=60)
+    else:
+        # Без lifespan: startup приложения создавал бы таблицы в рабочей базе из DATABASE_URL
+        from db import create_engine_from_settings, make_session_factory
+        from ingest import ingestor
+
+        engine = create_engine_from_settings(f"sqlite+aiosqlite:///{args.database}")
+        app = use_app_database(make_session_factory(engine))
+        await ingestor.start()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://load", timeout=60)
+
+    async with client:
+        stats, elapsed = await run_load(client, args.duration, args.concurrency, args.users, args.mix)
+    if engine is not None:
+        await ingestor.stop()
+        await engine.dispose()
+
+    print(f"{args.concurrency} virtual users, {elapsed:.1f} s, mix {args.mix}")
+    stats.report(elapsed)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,82 @@
+# benchmarks/login_bench.py - Задержка /courses во время "шторма" логинов
+#
+# Запуск: python -m benchmarks.login_bench --duration 5 --logins 8
+import argparse
+import asyncio
+import time
+
+import httpx
+from sqlalchemy import insert
+
+from benchmarks.common import make_temp_database, percentile, use_app_database
+from db import Course, User
+from hashing import pwd_context
+
+EMAIL = "bench@example.com"
+PASSWORD = "password123"
+
+
+async def fill(session_factory):
+    async with session_factory() as db:
+        await db.execute(insert(User), [{
+            "id": 1, "name": "bench", "email": EMAIL, "role": "student",
+            "password_hash": pwd_context.hash(PASSWORD),
+        }])
+        await db.execute(insert(Course), [
+            {"title": f"course{i}", "category": "bench", "level": "beginner", "teacher_id": 1}
+            for i in range(50)
+        ])
+        await db.commit()
+
+
+async def run(client, duration: float, logins: int):
+    response = await client.post("/token", data={"username": EMAIL, "password": PASSWORD})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    deadline = time.perf_counter() + duration
+    latencies = []
+    login_count = 0
+
+    async def login_storm():
+        nonlocal login_count
+        while time.perf_counter() < deadline:
+            await client.post("/token", data={"username": EMAIL, "password": PASSWORD})
+            login_count += 1
+
+    async def browse():
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            await client.get("/courses", headers=headers)
+            latencies.append((time.perf_counter() - start) * 1000)
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(browse(), *(login_storm() for _ in range(logins)))
+    return latencies, login_count
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="/courses latency under /token load")
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--logins", type=int, default=8, help="concurrent login clients")
+    parser.add_argument("--workers", type=int, default=4, help="password hashing pool size")
+    args = parser.parse_args()
+
+    engine, session_factory = await make_temp_database()
+    await fill(session_factory)
+    app = use_app_database(session_factory)
+    from main import password_hasher
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for label, workers in (("inline bcrypt (before)", 0), (f"pool of {args.workers} (after)", args.workers)):
+            password_hasher.workers = workers
+            latencies, logins = await run(client, args.duration, args.logins)
+            print(
+                f"{label:<24} /courses p50 {percentile(latencies, 0.5):8.1f} ms  "
+                f"p99 {percentile(latencies, 0.99):8.1f} ms  ({len(latencies)} reads, {logins} logins)"
+            )
+    password_hasher.shutdown()
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,111 @@
+# benchmarks/progress_bench.py - Прогресс пользователя: цикл N+1 против одного запроса
+#
+# Запуск: python -m benchmarks.progress_bench --courses 40 --activities 5000
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime
+
+from sqlalchemy import func, insert, select
+
+from benchmarks.common import make_temp_database
+from db import Activity, Course, Material, User
+from progress import get_user_progress
+
+USER_ID = 1
+
+
+async def legacy_user_progress(db, user_id):
+    """Прежняя реализация get_user_progress (агрегация в Python + count() на курс)"""
+    stmt = select(Activity, Material, Course).join(
+        Material, Activity.material_id == Material.id
+    ).join(
+        Course, Material.course_id == Course.id
+    ).where(Activity.user_id == user_id)
+    result = await db.execute(stmt)
+
+    course_progress = {}
+    for activity, material, course in result.all():
+        if course.id not in course_progress:
+            course_progress[course.id] = {
+                "course_title": course.title, "total_materials": 0, "completed_materials": 0,
+                "total_time": 0.0, "avg_score": 0.0, "scores": []
+            }
+        progress = course_progress[course.id]
+        progress["total_time"] += activity.duration or 0
+        if activity.action == "complete":
+            progress["completed_materials"] += 1
+        if activity.score is not None:
+            progress["scores"].append(activity.score)
+
+    for course_id, progress in course_progress.items():
+        total_materials = (await db.execute(
+            select(func.count(Material.id)).where(Material.course_id == course_id)
+        )).scalar()
+        progress["total_materials"] = total_materials
+        progress["completion_percentage"] = (
+            progress["completed_materials"] / total_materials * 100 if total_materials > 0 else 0
+        )
+        progress["avg_score"] = sum(progress["scores"]) / len(progress["scores"]) if progress["scores"] else 0
+        del progress["scores"]
+    return course_progress
+
+
+async def fill(session_factory, courses: int, materials_per_course: int, activities: int):
+    async with session_factory() as db:
+        await db.execute(insert(User), [
+            {"id": i, "name": f"user{i}", "email": f"user{i}@example.com", "role": "student", "password_hash": "x"}
+            for i in range(1, 11)
+        ])
+        await db.execute(insert(Course), [
+            {"id": i, "title": f"course{i}", "category": "bench", "level": "beginner", "teacher_id": 1}
+            for i in range(1, courses + 1)
+        ])
+        material_ids = list(range(1, courses * materials_per_course + 1))
+        await db.execute(insert(Material), [
+            {"id": m, "course_id": (m - 1) // materials_per_course + 1, "title": f"m{m}", "type": "quiz",
+             "order_index": (m - 1) % materials_per_course}
+            for m in material_ids
+        ])
+        now = datetime.utcnow()
+        await db.execute(insert(Activity), [
+            {"user_id": random.choice([USER_ID] * 4 + list(range(2, 11))), "material_id": random.choice(material_ids),
+             "action": random.choice(["view", "complete", "start"]), "timestamp": now,
+             "duration": random.uniform(5, 120), "score": random.choice([None, random.uniform(50, 100)])}
+            for _ in range(activities)
+        ])
+        await db.commit()
+
+
+async def timed(session_factory, fn, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        async with session_factory() as db:
+            result = await fn(db, USER_ID)
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="User progress benchmark")
+    parser.add_argument("--courses", type=int, default=40)
+    parser.add_argument("--materials", type=int, default=20, help="materials per course")
+    parser.add_argument("--activities", type=int, default=5000, help="activities in the table")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    engine, session_factory = await make_temp_database()
+    await fill(session_factory, args.courses, args.materials, args.activities)
+
+    legacy_ms, legacy = await timed(session_factory, legacy_user_progress, args.repeat)
+    engine_ms, current = await timed(session_factory, get_user_progress, args.repeat)
+    await engine.dispose()
+
+    over_100 = sum(1 for p in legacy.values() if p["completion_percentage"] > 100)
+    print(f"courses with activity: {len(current)}")
+    print(f"legacy loop (N+1):  {legacy_ms:8.2f} ms/request, {over_100} courses above 100% completion")
+    print(f"single query:       {engine_ms:8.2f} ms/request")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,256 @@
+# benchmarks/query_plans.py - Регрессии планов запросов: EXPLAIN QUERY PLAN для всех эндпоинтов
+#
+# Запуск: python -m benchmarks.query_plans [--verbose]
+#
+# Вызывает каждый API-эндпоинт (и фоновые пересчеты) на временной базе, перехватывает
+# выполненные SQL-запросы и проверяет их планы. Код возврата 1, если запрос читает
+# таблицу полным сканированием и это не разрешено явно в ALLOWED_SCANS, или если
+# у эндпоинта нет ни одного вызова в CALLS.
+import argparse
+import asyncio
+import re
+import sqlite3
+import sys
+import tempfile
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import httpx
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from benchmarks.common import make_temp_database, use_app_database
+from db import Base
+
+# (имя вызова, метод, путь, параметры запроса, тело JSON)
+CALLS = [
+    ("register student", "POST", "/register", None, {"name": "Student", "email": "student@example.com",
+                                                     "role": "student", "password": "secret123"}),
+    ("users", "GET", "/users", {"limit": 1, "include_total": True}, None),
+    ("users page 2", "GET", "/users", {"limit": 1, "cursor": "WzFd"}, None),
+    ("users/me", "GET", "/users/me", None, None),
+    ("admin stats", "GET", "/admin/stats", None, None),
+    ("admin profile", "GET", "/admin/profiles/missing", None, None),
+    ("create course", "POST", "/courses", None, {"title": "Python basics", "description": "Intro course",
+                                                 "category": "programming", "level": "beginner", "teacher_id": 1}),
+    ("catalog summary", "GET", "/catalog/summary", None, None),
+    ("courses", "GET", "/courses", {"limit": 1, "include_total": True}, None),
+    ("courses page 2", "GET", "/courses", {"limit": 1, "cursor": "WzFd"}, None),
+    ("courses by category", "GET", "/courses", {"category": "programming", "include_total": True}, None),
+    ("courses by level", "GET", "/courses", {"level": "beginner"}, None),
+    ("courses by category and level", "GET", "/courses", {"category": "programming", "level": "beginner",
+                                                          "cursor": "WzFd"}, None),
+    ("course", "GET", "/courses/1", None, None),
+    ("import courses", "POST", "/import/courses", {"format": "ndjson"}, {
+        "id": 100, "title": "Imported course", "category": "programming", "level": "advanced", "teacher_id": 1}),
+    ("create material", "POST", "/materials", None, {"course_id": 1, "title": "Variables",
+                                                     "content": "Names and values", "type": "video"}),
+    ("course materials", "GET", "/courses/1/materials", {"limit": 1, "include_total": True}, None),
+    ("course materials page 2", "GET", "/courses/1/materials", {"limit": 1, "cursor": "WzAsIDFd"}, None),
+    ("materials", "GET", "/materials", {"limit": 1}, None),
+    ("material", "GET", "/materials/1", None, None),
+    ("materials by course", "GET", "/materials", {"course_id": 1, "include_total": True}, None),
+    ("activity", "POST", "/activities", None, {"user_id": 1, "material_id": 1, "action": "view",
+                                               "duration": 10.0}),
+    ("activity batch", "POST", "/activities/batch", None, {"activities": [
+        {"user_id": 2, "material_id": 1, "action": "complete", "duration": 30.0, "score": 90.0},
+        {"user_id": 1, "material_id": 2, "action": "view", "duration": 5.0},
+    ]}),
+    # Материал в начале курса после активности: карты пройденных материалов курса переписываются
+    ("create material after activity", "POST", "/materials", None, {"course_id": 1, "title": "Setup",
+                                                                    "type": "text", "order_index": -1}),
+    ("next material", "GET", "/users/me/next", None, None),
+    ("next material in course", "GET", "/users/me/next", {"course_id": 1}, None),
+    ("search", "GET", "/search", {"q": "python", "category": "programming"}, None),
+    ("search materials", "GET", "/search", {"q": "variables", "material_type": "video"}, None),
+    ("browse by category", "GET", "/search", {"category": "programming", "level": "beginner"}, None),
+    ("browse by material type", "GET", "/search", {"material_type": "video"}, None),
+    ("user progress", "GET", "/analytics/user/1/progress", None, None),
+    ("course statistics", "GET", "/analytics/course/1/statistics", None, None),
+    ("course timeseries", "GET", "/analytics/course/1/timeseries", {"granularity": "hour"}, None),
+    ("platform timeseries", "GET", "/analytics/platform/timeseries", {"action": "view"}, None),
+    ("export", "GET", "/etl/activities/export", {"after_id": 1, "limit": 100}, None),
+    ("export range", "GET", "/etl/activities/export", {"since": "2020-01-01T00:00:00",
+                                                       "until": "2100-01-01T00:00:00"}, None),
+    ("export course", "GET", "/etl/activities/export", {"course_id": 1}, None),
+    ("job user progress", "POST", "/jobs", None, {"type": "user_progress", "params": {"user_id": 1}}),
+    ("job export", "POST", "/jobs", None, {"type": "activities_export", "params": {"course_id": 1}}),
+    ("job etl export", "POST", "/jobs", None, {"type": "etl_export", "params": {"by": "id"}}),
+    ("job status", "GET", "/jobs/1", None, None),
+    ("job result", "GET", "/jobs/1/result", None, None),
+]
+
+# Полное сканирование допустимо только там, где оно и есть смысл запроса
+ALLOWED_SCANS = {
+    ("users", "users"): "keyset page over the primary key",
+    ("users page 2", "users"): "keyset page over the primary key",
+    ("courses", "courses"): "keyset page over the primary key",
+    ("courses page 2", "courses"): "keyset page over the primary key",
+    ("materials", "materials"): "keyset page over the primary key",
+    ("browse by category", "materials"): "unfiltered side of the browse is a page over the primary key",
+    ("browse by material type", "courses"): "unfiltered side of the browse is a page over the primary key",
+    ("export", "activities"): "keyset export over the primary key",
+    ("export course", "activities"): "keyset export over the primary key, materials filtered by course",
+    ("catalog summary", "catalog_summary"): "the summary is a handful of counters read whole",
+    ("rollups backfill", "activities"): "full rebuild reads every event",
+    ("course_stats rebuild", "activities"): "full rebuild reads every event",
+    ("course_stats rebuild", "course_students"): "full rebuild reads every event",
+}
+
+# Эндпоинты, которые не обращаются к базе (когорты считаются только по снимку в памяти)
+NO_SQL_PATHS = {"/", "/dashboard", "/analytics/cohorts", "/metrics"}
+
+SCAN_RE = re.compile(r"^SCAN (\w+)")
+
+
+def is_table_scan(detail: str, tables) -> str:
+    """Имя таблицы, если шаг плана - полное сканирование таблицы (не подзапроса и не FTS)"""
+    match = SCAN_RE.match(detail)
+    if not match or "VIRTUAL TABLE" in detail:
+        return ""
+    name = re.sub(r"_\d+$", "", match.group(1))
+    return name if name in tables else ""
+
+
+def explain(conn: sqlite3.Connection, statement: str, parameters):
+    rows = conn.execute("EXPLAIN QUERY PLAN " + statement, parameters or ()).fetchall()
+    return [row[3] for row in rows]
+
+
+async def exercise(app, session_factory, record, requested):
+    """Вызывает все CALLS через ASGI (без lifespan: startup создал бы таблицы в рабочей базе)"""
+    from catalog_summary import rebuild_catalog_summary
+    from course_stats import rebuild_course_stats
+    import etl
+    import jobs
+    from ingest import ingestor
+    from main import progress_snapshot, progress_topic
+    from pubsub import hub
+    from retention import archive_activities
+    from rollups import backfill
+    from learning_path import rebuild_learning_paths
+
+    await ingestor.start()
+    # Выгрузка ETL - во временный каталог и в этом процессе, чтобы ее запросы попали в проверку
+    etl.ETL_DIR, etl.ETL_WORKERS, etl.ETL_FORMAT = tempfile.mkdtemp(), 0, "npz"
+    jobs.JOB_RESULTS_DIR = tempfile.mkdtemp()
+    # Подписчики прогресса: запись активности считает и рассылает изменения (publish_progress)
+    subscriptions = [hub.subscribe(progress_topic(user_id)) for user_id in (1, 2)]
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://plans") as client:
+        record("register admin")
+        await client.post("/register", json={"name": "Admin", "email": "admin@example.com",
+                                             "role": "admin", "password": "secret123"})
+        record("token")
+        token = await client.post("/token", data={"username": "admin@example.com", "password": "secret123"})
+        requested.extend([("POST", "/register"), ("POST", "/token")])
+        headers = {"Authorization": f"Bearer {token.json()['access_token']}"}
+        for name, method, path, params, body in CALLS:
+            record(name)
+            response = await client.request(method, path, params=params, json=body, headers=headers)
+            requested.append((method, path))
+            if response.status_code >= 500:
+                raise RuntimeError(f"{name}: {method} {path} -> {response.status_code}")
+    await ingestor.stop()
+    # Поставленные задачи выполняются здесь же: захват, обработчики и запись результата
+    record("job run")
+    await jobs.runner.run_until_empty()
+    for by in etl.SHARDING:
+        record(f"etl export by {by}")
+        # Второй запуск в тот же каталог проверяет готовые шарды на новые события
+        directory = tempfile.mkdtemp()
+        for _ in range(2):
+            await etl.export_activities(etl.session_url(session_factory), by=by, shard_size=2, workers=0,
+                                        fmt="npz", directory=directory)
+    for subscription in subscriptions:
+        subscription.close()
+
+    # Поток SSE бесконечен, поэтому его снимок вызывается напрямую
+    record("progress stream")
+    await progress_snapshot(1)
+    requested.append(("GET", "/analytics/user/1/progress/stream"))
+
+    record("rollups backfill")
+    await backfill(session_factory)
+    record("learning_path rebuild")
+    await rebuild_learning_paths(session_factory)
+    record("course_stats rebuild")
+    async with session_factory() as session:
+        await rebuild_course_stats(session)
+        await session.commit()
+    record("catalog rebuild")
+    async with session_factory() as session:
+        await rebuild_catalog_summary(session)
+        await session.commit()
+    record("retention archive")
+    # Окно 0 дней и "сейчас" через два месяца: в архив уходят все события
+    await archive_activities(session_factory, days=0, directory=tempfile.mkdtemp(),
+                             now=datetime.utcnow() + timedelta(days=62))
+
+
+async def collect():
+    """Выполняет вызовы и возвращает (путь к базе, {имя вызова: {sql: параметры}})"""
+    engine, session_factory = await make_temp_database()
+    app = use_app_database(session_factory)
+
+    statements = defaultdict(dict)
+    requested = []
+    current = {"name": "setup"}
+
+    def record(name):
+        current["name"] = name
+
+    # На уровне класса Engine: etl.py подключается к той же базе своим engine
+    @event.listens_for(Engine, "before_cursor_execute")
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if conn.engine.url.database != engine.url.database:
+            return
+        if not executemany and statement.lstrip().upper().startswith(("SELECT", "WITH", "UPDATE", "DELETE")):
+            statements[current["name"]].setdefault(statement, parameters)
+
+    await exercise(app, session_factory, record, requested)
+    await engine.dispose()
+    return engine.url.database, app, statements, requested
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query plan regression check")
+    parser.add_argument("--verbose", action="store_true", help="print every plan")
+    args = parser.parse_args()
+
+    path, app, statements, requested = asyncio.run(collect())
+
+    failures = []
+    for route in app.routes:
+        if not isinstance(route, APIRoute) or route.path in NO_SQL_PATHS:
+            continue
+        pattern = re.compile("^" + re.sub(r"\{[^}]+\}", "[^/]+", route.path) + "$")
+        if not any(method in route.methods and pattern.match(p) for method, p in requested):
+            failures.append(f"{sorted(route.methods)} {route.path}: not covered by CALLS")
+
+    tables = set(Base.metadata.tables)
+    conn = sqlite3.connect(path)
+    for name, captured in statements.items():
+        for statement, parameters in captured.items():
+            plan = explain(conn, statement, parameters)
+            scans = [t for t in (is_table_scan(d, tables) for d in plan) if t and (name, t) not in ALLOWED_SCANS]
+            if args.verbose or scans:
+                print(f"-- {name}\n{statement.strip()}")
+                for detail in plan:
+                    print(f"   {detail}")
+            for table in scans:
+                failures.append(f"{name}: full scan of {table}")
+    conn.close()
+
+    checked = sum(len(captured) for captured in statements.values())
+    if failures:
+        print(f"\n{len(failures)} regressions in {checked} statements:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print(f"✅ {checked} statements from {len(requested)} requests use indexes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# benchmarks/scaling_bench.py - Масштабирование по числу процессов API: 1, 2, 4 и 8 воркеров
+#
+# Запуск: python -m benchmarks.scaling_bench --database ./bench.sqlite3 --duration 30 --concurrency 64
+#
+# База - из benchmarks.generate. Для каждого числа воркеров запускает python main.py --workers N
+# (1 - один процесс без процесса записи, больше - N воркеров uvicorn и процесс записи) и гоняет
+# смешанную нагрузку benchmarks.load. Кэш ответов у каждого прогона свой (новый файл SQLite).
+# Отчет: запросов в секунду, ошибки, p50/p95/p99 по всем запросам и p95 записи активности.
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from benchmarks.common import percentile
+from benchmarks.load import DEFAULT_MIX, run_load
+
+ROOT = Path(__file__).resolve().parent.parent
+WRITE_LABELS = ("POST /activities", "POST /activities/batch")
+
+
+def start_server(workers: int, port: int, database: str) -> subprocess.Popen:
+    workdir = tempfile.mkdtemp()
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite+aiosqlite:///{Path(database).resolve()}",
+        WRITER_SOCKET=os.path.join(workdir, "writer.sock"),
+        RESPONSE_CACHE_BACKEND="sqlite",
+        RESPONSE_CACHE_PATH=os.path.join(workdir, "response_cache.sqlite3"),
+        JOB_RESULTS_DIR=os.path.join(workdir, "job_results"),
+    )
+    return subprocess.Popen(
+        [sys.executable, "main.py", "--workers", str(workers), "--host", "127.0.0.1", "--port", str(port)],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+async def wait_ready(url: str, server: subprocess.Popen, timeout: float = 120.0):
+    deadline = time.perf_counter() + timeout
+    async with httpx.AsyncClient(base_url=url) as client:
+        while time.perf_counter() < deadline:
+            if server.poll() is not None:
+                raise RuntimeError(f"server exited with code {server.returncode}")
+            try:
+                await client.get("/openapi.json")
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.5)
+    raise RuntimeError(f"server did not start in {timeout} s")
+
+
+def stop_server(server: subprocess.Popen):
+    # SIGINT: main.py останавливает воркеры, затем процесс записи
+    server.send_signal(signal.SIGINT)
+    try:
+        server.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+async def measure(workers: int, args) -> dict:
+    url = f"http://127.0.0.1:{args.port}"
+    server = start_server(workers, args.port, args.database)
+    try:
+        await wait_ready(url, server)
+        async with httpx.AsyncClient(base_url=url, timeout=60) as client:
+            stats, elapsed = await run_load(client, args.duration, args.concurrency, args.users, args.mix)
+    finally:
+        stop_server(server)
+
+    latencies = [value for values in stats.latencies.values() for value in values]
+    writes = [value for label in WRITE_LABELS for value in stats.latencies.get(label, ())]
+    return {
+        "workers": workers,
+        "requests": len(latencies),
+        "errors": sum(stats.errors.values()),
+        "rps": len(latencies) / elapsed,
+        "p50": percentile(latencies, 0.5),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "write_p95": percentile(writes, 0.95),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="API throughput at 1, 2, 4 and 8 worker processes")
+    parser.add_argument("--database", default="./bench.sqlite3", help="SQLite file from benchmarks.generate")
+    parser.add_argument("--workers", default="1,2,4,8", help="worker counts to measure")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of load per worker count")
+    parser.add_argument("--concurrency", type=int, default=64, help="virtual users")
+    parser.add_argument("--users", type=int, default=100_000, help="user ids to log in as (from the generator)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="scenario weights")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs, {args.concurrency} virtual users, {args.duration:.0f} s per run, mix {args.mix}")
+    print(f"{'workers':>7} {'requests':>9} {'errors':>7} {'req/s':>8} {'speedup':>8} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'write p95':>10}")
+    baseline = None
+    for workers in (int(value) for value in args.workers.split(",")):
+        result = await measure(workers, args)
+        baseline = baseline or result["rps"]
+        print(
+            f"{result['workers']:>7} {result['requests']:>9} {result['errors']:>7} {result['rps']:>8.1f} "
+            f"{result['rps'] / baseline:>7.2f}x {result['p50']:>8.1f} {result['p95']:>8.1f} "
+            f"{result['p99']:>8.1f} {result['write_p95']:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
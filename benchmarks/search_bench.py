@@ -0,0 +1,87 @@
+# benchmarks/search_bench.py - Поиск: ilike('%q%') против индекса FTS5
+#
+# Запуск: python -m benchmarks.search_bench --materials 100000
+import argparse
+import asyncio
+import random
+import time
+
+from sqlalchemy import insert, or_, select
+
+from benchmarks.common import make_temp_database
+from db import Course, Material
+from search import search_catalog
+
+WORDS = (
+    "python данные анализ функция переменная цикл класс модуль алгоритм сортировка граф дерево "
+    "матрица вектор производная интеграл история сеть протокол сервер база запрос индекс"
+).split()
+# Словарь с "шумовыми" терминами, чтобы каждое слово встречалось примерно в 1% материалов
+VOCABULARY = WORDS + [f"term{i}" for i in range(20000)]
+QUERIES = ["python", "алгоритм сортировка", "интеграл", "протокол сервер", "матр"]
+
+
+def text_of(words: int) -> str:
+    return " ".join(random.choices(VOCABULARY, k=words))
+
+
+async def legacy_search(db, q):
+    """Прежний путь /search: ilike по всем текстовым колонкам без лимита"""
+    courses = await db.execute(select(Course).where(or_(
+        Course.title.ilike(f"%{q}%"), Course.description.ilike(f"%{q}%"), Course.category.ilike(f"%{q}%")
+    )))
+    materials = await db.execute(select(Material).where(or_(
+        Material.title.ilike(f"%{q}%"), Material.content.ilike(f"%{q}%")
+    )))
+    return len(courses.scalars().all()), len(materials.scalars().all())
+
+
+async def fill(session_factory, courses: int, materials: int, content_words: int):
+    async with session_factory() as db:
+        await db.execute(insert(Course), [
+            {"id": i, "title": text_of(4), "description": text_of(30), "category": random.choice(WORDS),
+             "level": "beginner", "teacher_id": 1}
+            for i in range(1, courses + 1)
+        ])
+        for offset in range(0, materials, 10000):
+            await db.execute(insert(Material), [
+                {"id": m, "course_id": random.randint(1, courses), "title": text_of(5),
+                 "content": text_of(content_words), "type": "text"}
+                for m in range(offset + 1, min(offset + 10000, materials) + 1)
+            ])
+        await db.commit()
+
+
+async def measure(session_factory, fn, repeat: int):
+    timings = []
+    for q in QUERIES:
+        for _ in range(repeat):
+            async with session_factory() as db:
+                start = time.perf_counter()
+                await fn(db, q)
+                timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.95)]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Search latency benchmark")
+    parser.add_argument("--courses", type=int, default=2000)
+    parser.add_argument("--materials", type=int, default=100000)
+    parser.add_argument("--content-words", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    engine, session_factory = await make_temp_database()
+    start = time.perf_counter()
+    await fill(session_factory, args.courses, args.materials, args.content_words)
+    print(f"filled {args.courses} courses / {args.materials} materials in {time.perf_counter() - start:.1f} s")
+
+    for name, fn in (("ilike (old)", legacy_search), ("fts5 bm25, limit 20", search_catalog)):
+        p50, p95 = await measure(session_factory, fn, args.repeat)
+        print(f"{name:<22} p50 {p50:9.2f} ms   p95 {p95:9.2f} ms")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+# benchmarks/serialization_bench.py - CPU на сериализацию списка: ORM + Pydantic + jsonable_encoder против колонок + orjson
+#
+# Запуск: python -m benchmarks.serialization_bench --rows 10000
+import argparse
+import asyncio
+import json
+import time
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import insert, select
+from sqlalchemy.orm import undefer
+
+import serialization
+from benchmarks.common import make_temp_database
+from db import Course, Material
+from main import Material as MaterialModel
+from response_cache import type_adapter
+
+
+async def fill(session_factory, rows: int):
+    async with session_factory() as db:
+        await db.execute(insert(Course), [{"id": 1, "title": "Course", "category": "bench", "level": "beginner",
+                                           "teacher_id": 1}])
+        await db.execute(insert(Material), [
+            {"course_id": 1, "title": f"Material {i}", "content": "Lorem ipsum dolor sit amet " * 8,
+             "type": "video", "order_index": i}
+            for i in range(rows)
+        ])
+        await db.commit()
+
+
+async def legacy(db) -> bytes:
+    """Прежний путь: ORM-объекты -> валидация response_model -> jsonable_encoder -> json.dumps"""
+    # content теперь отложен; прежний select(Material) читал его вместе с сущностью
+    result = await db.execute(select(Material).options(undefer(Material.content)).order_by(Material.id))
+    items = result.scalars().all()
+    validated = type_adapter(List[MaterialModel]).validate_python(items, from_attributes=True)
+    return json.dumps(jsonable_encoder(validated)).encode()
+
+
+async def fast(db) -> bytes:
+    """Новый путь: select(колонки) -> dict -> orjson"""
+    result = await db.execute(select(*serialization.model_columns(Material, MaterialModel)).order_by(Material.id))
+    return serialization.dumps(serialization.records(result.all()))
+
+
+async def measure(session_factory, fn, repeat: int):
+    """(CPU на вызов в мс, размер ответа); process_time не учитывает ожидание потока aiosqlite"""
+    body = b""
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    for _ in range(repeat):
+        async with session_factory() as db:
+            body = await fn(db)
+    return (time.process_time() - cpu) / repeat * 1000, (time.perf_counter() - wall) / repeat * 1000, body
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="List serialization benchmark")
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    engine, session_factory = await make_temp_database()
+    await fill(session_factory, args.rows)
+
+    legacy_cpu, legacy_wall, legacy_body = await measure(session_factory, legacy, args.repeat)
+    fast_cpu, fast_wall, fast_body = await measure(session_factory, fast, args.repeat)
+    await engine.dispose()
+
+    assert json.loads(legacy_body) == json.loads(fast_body), "responses differ"
+    scale = 10_000 / args.rows
+    print(f"{args.rows:,} materials, {len(fast_body) / 2 ** 20:.1f} MiB JSON; per 10k rows:")
+    print(f"ORM + Pydantic + jsonable_encoder:  CPU {legacy_cpu * scale:8.1f} ms   wall {legacy_wall * scale:8.1f} ms")
+    print(f"columns + orjson:                   CPU {fast_cpu * scale:8.1f} ms   wall {fast_wall * scale:8.1f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,413 @@
+# bulk_import.py - Пакетный импорт курсов, материалов и исторической активности
+#
+# Импорт файла: python bulk_import.py courses|materials|activities FILE [--format ndjson|csv] [--defer-indexes]
+#
+# Записи читаются потоком (NDJSON или CSV с заголовком), проверяются пачками по IMPORT_CHUNK_SIZE
+# и вставляются многострочным INSERT; каждая пачка - своя транзакция. Ошибочные записи попадают
+# в отчет, импорт продолжается; на первой неудачной пачке импорт останавливается. Повторный запуск
+# безопасен: записи с id вставляются через ON CONFLICT DO NOTHING, а продолжение идет после
+# resume_from - последней записи закоммиченных пачек (CLI хранит его в FILE.import.json).
+# Поисковый индекс курсов и материалов дописывается после загрузки, агрегаты активности
+# (course_stats, activity_rollups, learning_paths) обновляются в транзакции пачки.
+# Записи читает и делит на пачки import_records, а пишет loader: LocalLoader - в этом процессе;
+# /import в main.py передает шаги процессу записи (writer.py).
+import argparse
+import asyncio
+import codecs
+import csv
+import json
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import orjson
+from pydantic import BaseModel, Field, ValidationError
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import catalog_summary
+import course_stats
+import learning_path
+import rollups
+import search
+from db import create_tables, sync_indexes, SessionLocal, Activity, Course, Material, User
+
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "1000"))
+# Сколько ошибок попадает в отчет (счетчики считаются по всем)
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "100"))
+
+FORMATS = ("ndjson", "csv")
+
+
+class CourseRecord(BaseModel):
+    id: Optional[int] = None
+    title: str = Field(min_length=1, max_length=200)
+    description: Optional[str] = None
+    category: str = Field(max_length=50)
+    level: str = Field(pattern="^(beginner|intermediate|advanced)$")
+    teacher_id: int
+    created_at: Optional[datetime] = None
+
+
+class MaterialRecord(BaseModel):
+    id: Optional[int] = None
+    course_id: int
+    title: str = Field(min_length=1, max_length=200)
+    content: Optional[str] = None
+    type: str = Field(pattern="^(video|text|quiz|assignment)$")
+    order_index: int = 0
+    created_at: Optional[datetime] = None
+
+
+class ActivityRecord(BaseModel):
+    id: Optional[int] = None
+    user_id: int
+    material_id: int
+    action: str = Field(min_length=1, max_length=50)
+    timestamp: datetime
+    duration: Optional[float] = None
+    score: Optional[float] = None
+    meta: Optional[Dict[str, Any]] = None
+
+
+@dataclass(frozen=True)
+class ImportKind:
+    table: Any
+    record: Any
+    # Поле записи -> колонка id, которая должна существовать
+    references: Dict[str, Any]
+    # Ресурсы кэша ответов, которые меняет импорт
+    resources: Tuple[str, ...]
+
+
+KINDS = {
+    "courses": ImportKind(Course, CourseRecord, {"teacher_id": User.id}, ("courses",)),
+    "materials": ImportKind(Material, MaterialRecord, {"course_id": Course.id}, ("materials",)),
+    "activities": ImportKind(Activity, ActivityRecord, {"user_id": User.id, "material_id": Material.id}, ()),
+}
+
+
+# Чтение: (номер записи с 1, dict) или (номер, Exception), если запись не разобрать
+
+async def file_lines(path: str) -> AsyncIterator[str]:
+    with open(path, encoding="utf-8", newline="") as f:
+        for line in f:
+            yield line
+
+
+async def stream_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Строки тела запроса по мере поступления (UTF-8, символ может разрываться между частями)"""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    tail = ""
+    async for chunk in chunks:
+        tail += decoder.decode(chunk)
+        *lines, tail = tail.split("\n")
+        for line in lines:
+            yield line + "\n"
+    tail += decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def parse_csv_value(name: str, value: str) -> Any:
+    if value == "":
+        return None
+    if name == "meta":
+        return json.loads(value)
+    return value
+
+
+async def iter_records(lines: AsyncIterator[str], fmt: str) -> AsyncIterator[Tuple[int, Any]]:
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown import format: {fmt}")
+    number = 0
+    header = None
+    pending = ""
+    async for line in lines:
+        if fmt == "ndjson":
+            if not line.strip():
+                continue
+            number += 1
+            try:
+                yield number, orjson.loads(line)
+            except orjson.JSONDecodeError as e:
+                yield number, e
+            continue
+
+        # Запись CSV может занимать несколько строк (перевод строки внутри кавычек):
+        # она закончена, когда число кавычек четное
+        pending += line
+        if pending.count('"') % 2:
+            continue
+        record, pending = pending, ""
+        if not record.strip():
+            continue
+        values = next(csv.reader([record]))
+        if header is None:
+            header = values
+            continue
+        number += 1
+        try:
+            if len(values) != len(header):
+                raise ValueError(f"expected {len(header)} columns, got {len(values)}")
+            yield number, {name: parse_csv_value(name, value) for name, value in zip(header, values)}
+        except ValueError as e:
+            yield number, e
+    if pending.strip():
+        yield number + 1, ValueError("unterminated quoted field")
+
+
+# Загрузка
+
+def new_report(kind: str, skip: int) -> Dict[str, Any]:
+    return {"kind": kind, "received": 0, "inserted": 0, "existing": 0, "invalid": 0, "chunks": 0,
+            "failed_chunks": 0, "errors": [], "resume_from": skip, "complete": False}
+
+
+def add_error(report: Dict[str, Any], error: Dict[str, Any]):
+    if len(report["errors"]) < IMPORT_MAX_ERRORS:
+        report["errors"].append(error)
+
+
+def validation_message(e: Exception) -> str:
+    if isinstance(e, ValidationError):
+        return "; ".join(f'{".".join(map(str, err["loc"]))}: {err["msg"]}' for err in e.errors())
+    return str(e)
+
+
+async def validate_chunk(session: AsyncSession, spec: ImportKind, chunk, report) -> List[Dict[str, Any]]:
+    """Проверяет записи пачки: схема и существование связанных записей (одним IN на поле)"""
+    rows = []
+    for number, record in chunk:
+        try:
+            if isinstance(record, Exception):
+                raise record
+            row = spec.record.model_validate(record).model_dump()
+        except (ValidationError, ValueError, TypeError) as e:
+            report["invalid"] += 1
+            add_error(report, {"record": number, "error": validation_message(e)})
+            continue
+        row["_record"] = number
+        rows.append(row)
+
+    for field, column in spec.references.items():
+        existing = set((await session.scalars(select(column).where(column.in_({row[field] for row in rows})))).all())
+        valid = []
+        for row in rows:
+            if row[field] in existing:
+                valid.append(row)
+            else:
+                report["invalid"] += 1
+                add_error(report, {"record": row["_record"], "error": f"{field}: {row[field]} does not exist"})
+        rows = valid
+    return rows
+
+
+async def insert_rows(session: AsyncSession, spec: ImportKind, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Многострочный INSERT; возвращает вставленные строки (записи с существующим id пропускаются)"""
+    now = datetime.utcnow()
+    values = []
+    for row in rows:
+        value = {key: item for key, item in row.items() if key != "_record"}
+        if "created_at" in value and value["created_at"] is None:
+            value["created_at"] = now
+        values.append(value)
+
+    inserted = []
+    # Записи с id и без id - разные наборы колонок, поэтому разные INSERT
+    for with_id in (True, False):
+        group = [value for value in values if (value["id"] is not None) == with_id]
+        if not with_id:
+            group = [{key: item for key, item in value.items() if key != "id"} for value in group]
+        if not group:
+            continue
+        stmt = insert(spec.table)
+        if with_id:
+            stmt = stmt.on_conflict_do_nothing(index_elements=["id"])
+        result = await session.execute(stmt.returning(spec.table.id, sort_by_parameter_order=not with_id), group)
+        ids = result.scalars().all()
+        if with_id:
+            ids = set(ids)
+            inserted.extend(value for value in group if value["id"] in ids)
+        else:
+            inserted.extend({**value, "id": id_} for value, id_ in zip(group, ids))
+    return inserted
+
+
+async def load_chunk(session_factory, spec: ImportKind, chunk, report) -> bool:
+    """Одна пачка - одна транзакция. Если многострочная вставка падает, пачка повторяется
+    по одной записи в точках сохранения, чтобы отбросить только ошибочные записи"""
+    report["chunks"] += 1
+    report["received"] += len(chunk)
+    try:
+        async with session_factory() as session:
+            rows = await validate_chunk(session, spec, chunk, report)
+            try:
+                inserted = await insert_rows(session, spec, rows)
+            except Exception:
+                await session.rollback()
+                inserted = []
+                for row in rows:
+                    try:
+                        async with session.begin_nested():
+                            inserted.extend(await insert_rows(session, spec, [row]))
+                    except Exception as e:
+                        report["invalid"] += 1
+                        add_error(report, {"record": row["_record"], "error": str(e).splitlines()[0]})
+            if spec.table is Activity:
+                await course_stats.apply_activities(session, inserted)
+                await rollups.apply_activities(session, inserted)
+                await learning_path.apply_activities(session, inserted)
+            elif spec.table is Material:
+                await learning_path.materials_added(session, [(row["id"], row["course_id"]) for row in inserted])
+            await session.commit()
+    except Exception as e:
+        report["failed_chunks"] += 1
+        add_error(report, {"records": [chunk[0][0], chunk[-1][0]], "error": str(e).splitlines()[0]})
+        return False
+    report["inserted"] += len(inserted)
+    report["existing"] += len(rows) - len(inserted)
+    return True
+
+
+async def run_sync(session_factory, fn):
+    async with session_factory() as session:
+        connection = await session.connection()
+        await connection.run_sync(fn)
+        await session.commit()
+
+
+class LocalLoader:
+    """Шаги импорта в этом процессе: подготовка таблицы, запись пачки, завершение.
+    defer_indexes - удалить вторичные индексы таблицы на время загрузки (для офлайн-миграции:
+    запросы к таблице в это время сканируют ее целиком)"""
+
+    def __init__(self, session_factory, defer_indexes: bool = False):
+        self.session_factory = session_factory
+        self.defer_indexes = defer_indexes
+
+    async def begin(self, kind: str):
+        table = KINDS[kind].table
+        if table in (Course, Material):
+            async with self.session_factory() as session:
+                await search.suspend_insert_triggers(session)
+                await session.commit()
+        if self.defer_indexes:
+            await run_sync(self.session_factory, lambda conn: [
+                index.drop(conn, checkfirst=True) for index in table.__table__.indexes
+            ])
+
+    async def load(self, kind: str, chunk) -> Dict[str, Any]:
+        """Отчет по одной пачке; loaded - пачка закоммичена"""
+        report = new_report(kind, 0)
+        report["loaded"] = await load_chunk(self.session_factory, KINDS[kind], chunk, report)
+        return report
+
+    async def finish(self, kind: str):
+        # Индексы строятся после загрузки целиком, а не строкой на каждую вставку
+        if self.defer_indexes:
+            await run_sync(self.session_factory, sync_indexes)
+        if KINDS[kind].table in (Course, Material):
+            async with self.session_factory() as session:
+                await search.index_missing(session)
+                await search.restore_triggers(session)
+                await catalog_summary.rebuild_catalog_summary(session)
+                await session.commit()
+
+
+def merge_report(report: Dict[str, Any], part: Dict[str, Any]):
+    for key in ("received", "inserted", "existing", "invalid", "chunks", "failed_chunks"):
+        report[key] += part[key]
+    for error in part["errors"]:
+        add_error(report, error)
+
+
+async def import_records(
+    loader,
+    kind: str,
+    records: AsyncIterator[Tuple[int, Any]],
+    chunk_size: int = IMPORT_CHUNK_SIZE,
+    skip: int = 0,
+    on_chunk=None,
+) -> Dict[str, Any]:
+    """Импортирует записи после номера skip и останавливается на первой неудачной пачке:
+    записи без id вставляются без проверки на дубликаты, поэтому продолжать можно только с
+    resume_from - номера последней записи закоммиченных пачек"""
+    report = new_report(kind, skip)
+    await loader.begin(kind)
+
+    async def load(chunk) -> bool:
+        part = await loader.load(kind, chunk)
+        merge_report(report, part)
+        if part["loaded"]:
+            report["resume_from"] = chunk[-1][0]
+        if on_chunk:
+            on_chunk(report)
+        return part["loaded"]
+
+    try:
+        chunk = []
+        async for number, record in records:
+            if number <= skip:
+                continue
+            chunk.append((number, record))
+            if len(chunk) < chunk_size:
+                continue
+            if not await load(chunk):
+                break
+            chunk = []
+        else:
+            report["complete"] = not chunk or await load(chunk)
+    finally:
+        await loader.finish(kind)
+    return report
+
+
+def checkpoint_path(path: str) -> str:
+    return path + ".import.json"
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Bulk import of courses, materials and activities")
+    parser.add_argument("kind", choices=list(KINDS))
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=FORMATS, help="by file extension if omitted")
+    parser.add_argument("--chunk", type=int, default=IMPORT_CHUNK_SIZE)
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start from the beginning")
+    parser.add_argument("--defer-indexes", action="store_true", help="drop table indexes during the load")
+    args = parser.parse_args()
+
+    fmt = args.format or ("csv" if args.path.endswith(".csv") else "ndjson")
+    checkpoint = checkpoint_path(args.path)
+    skip = 0
+    if os.path.exists(checkpoint) and not args.restart:
+        with open(checkpoint) as f:
+            skip = json.load(f)["resume_from"]
+        print(f"Продолжение после записи {skip}")
+
+    def save_checkpoint(report):
+        with open(checkpoint + ".tmp", "w") as f:
+            json.dump({"kind": args.kind, "resume_from": report["resume_from"]}, f)
+        os.replace(checkpoint + ".tmp", checkpoint)
+        print(f'\r{report["received"]} записей, вставлено {report["inserted"]}, ошибок {report["invalid"]}',
+              end="", flush=True)
+
+    await create_tables()
+    report = await import_records(LocalLoader(SessionLocal, args.defer_indexes), args.kind,
+                                  iter_records(file_lines(args.path), fmt), chunk_size=args.chunk, skip=skip,
+                                  on_chunk=save_checkpoint)
+    print()
+    for error in report["errors"]:
+        where = error.get("record") or "{}-{}".format(*error["records"])
+        print(f'  {where}: {error["error"]}')
+    status = "✅" if report["complete"] else "⚠️"
+    print(f'{status} Вставлено {report["inserted"]}, уже были {report["existing"]}, с ошибками {report["invalid"]}, '
+          f'неудачных пачек {report["failed_chunks"]}')
+    if not report["complete"]:
+        print(f"Импорт остановлен, повторный запуск продолжит после записи {report['resume_from']}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
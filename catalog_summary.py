@@ -0,0 +1,97 @@
+# catalog_summary.py - Предрасчитанная сводка каталога для главной страницы
+#
+# Итоги (курсы, пользователи, материалы) и фасеты (категории, уровни, типы материалов)
+# хранятся в catalog_summary и увеличиваются в транзакции создания записи, поэтому
+# /catalog/summary не считает count(*) по фасетам на каждый заход.
+# Пересчет из таблиц: python catalog_summary.py rebuild
+import asyncio
+import sys
+from typing import Any, Dict, List, Tuple
+
+from sqlalchemy import delete, func, literal, select, union_all
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db import SessionLocal, CatalogFacet, Course, Material, User
+
+TOTAL = "total"
+# Поле ответа -> facet в таблице
+FACETS = {"categories": "category", "levels": "level", "material_types": "material_type"}
+
+
+async def increment(session: AsyncSession, keys: List[Tuple[str, Any]]):
+    """Прибавляет 1 к счетчикам (facet, value); записи без значения фасета пропускаются"""
+    rows = [{"facet": facet, "value": str(value), "count": 1} for facet, value in keys if value is not None]
+    if not rows:
+        return
+    stmt = insert(CatalogFacet)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[CatalogFacet.facet, CatalogFacet.value],
+        set_={"count": CatalogFacet.count + stmt.excluded.count}
+    )
+    await session.execute(stmt, rows)
+
+
+async def course_created(session: AsyncSession, course: Course):
+    await increment(session, [(TOTAL, "courses"), ("category", course.category), ("level", course.level)])
+
+
+async def material_created(session: AsyncSession, material: Material):
+    await increment(session, [(TOTAL, "materials"), ("material_type", material.type)])
+
+
+async def user_created(session: AsyncSession, user: User):
+    await increment(session, [(TOTAL, "users")])
+
+
+async def rebuild_catalog_summary(session: AsyncSession):
+    """Полностью пересчитывает catalog_summary из users, courses и materials"""
+    await session.execute(delete(CatalogFacet))
+    counts = union_all(
+        select(literal(TOTAL), literal("users"), func.count()).select_from(User),
+        select(literal(TOTAL), literal("courses"), func.count()).select_from(Course),
+        select(literal(TOTAL), literal("materials"), func.count()).select_from(Material),
+        select(literal("category"), Course.category, func.count())
+        .where(Course.category.is_not(None)).group_by(Course.category),
+        select(literal("level"), Course.level, func.count())
+        .where(Course.level.is_not(None)).group_by(Course.level),
+        select(literal("material_type"), Material.type, func.count())
+        .where(Material.type.is_not(None)).group_by(Material.type),
+    )
+    await session.execute(insert(CatalogFacet).from_select(["facet", "value", "count"], counts))
+
+
+async def ensure_catalog_summary(session: AsyncSession):
+    """Заполняет пустую сводку (новая таблица в существующей базе)"""
+    if await session.scalar(select(func.count()).select_from(CatalogFacet)) == 0:
+        await rebuild_catalog_summary(session)
+
+
+async def get_catalog_summary(session: AsyncSession) -> Dict[str, Any]:
+    result = await session.execute(select(CatalogFacet.facet, CatalogFacet.value, CatalogFacet.count))
+    summary = {"total_courses": 0, "total_users": 0, "total_materials": 0, **{name: [] for name in FACETS}}
+    names = {facet: name for name, facet in FACETS.items()}
+    for facet, value, count in result.all():
+        if facet == TOTAL:
+            summary[f"total_{value}"] = count
+        elif facet in names and count > 0:
+            summary[names[facet]].append({"value": value, "count": count})
+    for name in FACETS:
+        summary[name].sort(key=lambda item: (-item["count"], item["value"]))
+    return summary
+
+
+async def rebuild():
+    async with SessionLocal() as session:
+        await rebuild_catalog_summary(session)
+        await session.commit()
+        summary = await get_catalog_summary(session)
+    print(f'✅ Сводка каталога пересчитана: {summary["total_courses"]} курсов, '
+          f'{summary["total_materials"]} материалов, {summary["total_users"]} пользователей')
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebuild"]:
+        print("Использование: python catalog_summary.py rebuild")
+        sys.exit(1)
+    asyncio.run(rebuild())
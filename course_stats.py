@@ -0,0 +1,164 @@
+# course_stats.py - Материализованная статистика по курсам
+#
+# Пересчет из таблицы activities: python course_stats.py rebuild
+import asyncio
+import sys
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, List
+
+from sqlalchemy import DateTime, delete, func, literal, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db import SessionLocal, Activity, Material, CourseStats, CourseStudent
+from retention import iter_archived_rows
+
+
+async def material_courses(session: AsyncSession, material_ids) -> Dict[int, int]:
+    """Сопоставление material_id -> course_id"""
+    result = await session.execute(
+        select(Material.id, Material.course_id).where(Material.id.in_(set(material_ids)))
+    )
+    return dict(result.all())
+
+
+async def apply_activities(session: AsyncSession, rows: List[Dict[str, Any]]):
+    """Инкрементально обновляет course_stats по пачке новых событий"""
+    if not rows:
+        return
+    courses = await material_courses(session, (row["material_id"] for row in rows))
+
+    deltas = defaultdict(lambda: {"total_time": 0.0, "score_sum": 0.0, "score_count": 0, "completions": 0})
+    pairs = set()
+    for row in rows:
+        course_id = courses.get(row["material_id"])
+        if course_id is None:
+            continue
+        delta = deltas[course_id]
+        delta["total_time"] += row.get("duration") or 0
+        if row.get("score") is not None:
+            delta["score_sum"] += row["score"]
+            delta["score_count"] += 1
+        if row.get("action") == "complete":
+            delta["completions"] += 1
+        # События без пользователя не добавляют студентов (как и в rebuild_course_stats)
+        if row.get("user_id") is not None:
+            pairs.add((course_id, row["user_id"]))
+
+    if not deltas:
+        return
+
+    # Новые студенты курса - те пары (course_id, user_id), которых еще нет в course_students.
+    # Два IN вместо tuple IN: так SQLite ищет по первичному ключу, а не сканирует таблицу
+    existing = await session.execute(
+        select(CourseStudent.course_id, CourseStudent.user_id).where(
+            CourseStudent.course_id.in_({course_id for course_id, _ in pairs}),
+            CourseStudent.user_id.in_({user_id for _, user_id in pairs}),
+        )
+    )
+    new_pairs = pairs - set(existing.all())
+    new_students = defaultdict(int)
+    for course_id, _ in new_pairs:
+        new_students[course_id] += 1
+    if new_pairs:
+        await session.execute(
+            insert(CourseStudent),
+            [{"course_id": course_id, "user_id": user_id} for course_id, user_id in new_pairs]
+        )
+
+    now = datetime.utcnow()
+    stmt = insert(CourseStats)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[CourseStats.course_id],
+        set_={
+            "total_students": CourseStats.total_students + stmt.excluded.total_students,
+            "total_time": CourseStats.total_time + stmt.excluded.total_time,
+            "score_sum": CourseStats.score_sum + stmt.excluded.score_sum,
+            "score_count": CourseStats.score_count + stmt.excluded.score_count,
+            "completions": CourseStats.completions + stmt.excluded.completions,
+            "updated_at": stmt.excluded.updated_at,
+        }
+    )
+    await session.execute(stmt, [
+        {"course_id": course_id, "total_students": new_students[course_id], "updated_at": now, **delta}
+        for course_id, delta in deltas.items()
+    ])
+
+
+async def rebuild_course_stats(session: AsyncSession):
+    """Полностью пересчитывает course_stats и course_students из activities и архива"""
+    await session.execute(delete(CourseStats))
+    await session.execute(delete(CourseStudent))
+
+    await session.execute(
+        insert(CourseStudent).from_select(
+            ["course_id", "user_id"],
+            select(Material.course_id, Activity.user_id)
+            .join(Material, Activity.material_id == Material.id)
+            .where(Activity.user_id.is_not(None))
+            .distinct()
+        )
+    )
+    students = (
+        select(CourseStudent.course_id, func.count().label("total_students"))
+        .group_by(CourseStudent.course_id)
+        .subquery()
+    )
+    aggregates = (
+        select(
+            Material.course_id,
+            func.coalesce(students.c.total_students, 0),
+            func.coalesce(func.sum(Activity.duration), 0.0),
+            func.coalesce(func.sum(Activity.score), 0.0),
+            func.count(Activity.score),
+            func.count().filter(Activity.action == "complete"),
+            literal(datetime.utcnow(), DateTime),
+        )
+        .join(Material, Activity.material_id == Material.id)
+        .outerjoin(students, students.c.course_id == Material.course_id)
+        .group_by(Material.course_id)
+    )
+    await session.execute(
+        insert(CourseStats).from_select(
+            ["course_id", "total_students", "total_time", "score_sum", "score_count", "completions", "updated_at"],
+            aggregates
+        )
+    )
+    # Архивные события досчитываются тем же инкрементальным путем, что и новые
+    for rows in iter_archived_rows():
+        await apply_activities(session, rows)
+
+
+async def get_course_stats(session: AsyncSession, course_id: int) -> Dict[str, Any]:
+    stats = await session.get(CourseStats, course_id)
+    if stats is None:
+        return {
+            "total_students": 0,
+            "total_time_spent": 0.0,
+            "average_score": 0,
+            "total_completions": 0,
+            "engagement_rate": 0
+        }
+    return {
+        "total_students": stats.total_students,
+        "total_time_spent": stats.total_time,
+        "average_score": stats.score_sum / stats.score_count if stats.score_count else 0,
+        "total_completions": stats.completions,
+        "engagement_rate": stats.completions / stats.total_students if stats.total_students else 0
+    }
+
+
+async def rebuild():
+    async with SessionLocal() as session:
+        await rebuild_course_stats(session)
+        await session.commit()
+        count = await session.scalar(select(func.count()).select_from(CourseStats))
+    print(f'✅ Статистика пересчитана для {count} курсов')
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebuild"]:
+        print("Использование: python course_stats.py rebuild")
+        sys.exit(1)
+    asyncio.run(rebuild())
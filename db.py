@@ -1,34 +1,97 @@
 # db.py - Улучшенная версия
+import os
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import sessionmaker, declarative_base, relationship
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Float, JSON, Index, Text
+from sqlalchemy.orm import sessionmaker, declarative_base, relationship, deferred
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Float, JSON, Index, Text, LargeBinary, DDL, event
+from sqlalchemy import create_engine, make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from datetime import datetime
 
-DATABASE_URL = "sqlite+aiosqlite:///./db.sqlite3"
+# Настройки подключения (переопределяются переменными окружения)
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./db.sqlite3")
+DB_ECHO = os.getenv("DB_ECHO", "0") == "1"
+DB_WRITE_POOL_SIZE = int(os.getenv("DB_WRITE_POOL_SIZE", "5"))
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
 
-engine = create_async_engine(
-    DATABASE_URL, 
-    echo=True,
-    pool_pre_ping=True,
-    pool_recycle=300
-)
+# Настройки SQLite
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
 
-SessionLocal = sessionmaker(
-    engine, 
-    class_=AsyncSession, 
-    expire_on_commit=False,
-    autoflush=False
-)
+def set_sqlite_pragmas(dbapi_connection, read_only: bool = False):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    if read_only:
+        cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+def create_engine_from_settings(
+    url: str = DATABASE_URL,
+    read_only: bool = False,
+    pool_size: int = DB_WRITE_POOL_SIZE,
+    echo: bool = DB_ECHO
+):
+    """Создает async engine; для SQLite настраивает прагмы на каждом новом соединении"""
+    # Для файловой SQLite aiosqlite по умолчанию использует NullPool (новое соединение
+    # на каждую сессию), поэтому пул задаем явно
+    engine = create_async_engine(
+        url,
+        echo=echo,
+        poolclass=AsyncAdaptedQueuePool,
+        pool_pre_ping=True,
+        pool_recycle=300,
+        pool_size=pool_size,
+        max_overflow=DB_MAX_OVERFLOW
+    )
+    if engine.dialect.name == "sqlite":
+        @event.listens_for(engine.sync_engine, "connect")
+        def on_connect(dbapi_connection, connection_record):
+            set_sqlite_pragmas(dbapi_connection, read_only=read_only)
+    return engine
+
+def create_sync_engine(url: str = DATABASE_URL):
+    """Синхронный engine к той же базе для потоков вне event loop (синхронный драйвер диалекта)"""
+    url = make_url(url)
+    engine = create_engine(url.set(drivername=url.get_backend_name()), echo=DB_ECHO)
+    if engine.dialect.name == "sqlite":
+        @event.listens_for(engine, "connect")
+        def on_connect(dbapi_connection, connection_record):
+            set_sqlite_pragmas(dbapi_connection)
+    return engine
+
+def make_session_factory(bind):
+    return sessionmaker(
+        bind, 
+        class_=AsyncSession, 
+        expire_on_commit=False,
+        autoflush=False
+    )
+
+# Пул для записи и отдельный пул только для чтения: в режиме WAL читатели
+# не ждут писателя, поэтому аналитика не блокируется записью активности
+engine = create_engine_from_settings()
+read_engine = create_engine_from_settings(read_only=True, pool_size=DB_READ_POOL_SIZE)
+
+SessionLocal = make_session_factory(engine)
+ReadSessionLocal = make_session_factory(read_engine)
 
 Base = declarative_base()
 
 class User(Base):
     __tablename__ = 'users'
     
-    id = Column(Integer, primary_key=True, index=True)
-    name = Column(String(100), index=True, nullable=False)
+    id = Column(Integer, primary_key=True)
+    name = Column(String(100), nullable=False)
     email = Column(String(255), unique=True, index=True)
-    role = Column(String(20), index=True, nullable=False)
+    role = Column(String(20), nullable=False)
     password_hash = Column(String(255), nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
     is_active = Column(Integer, default=1)
@@ -39,10 +102,12 @@ class User(Base):
 class Course(Base):
     __tablename__ = 'courses'
     
-    id = Column(Integer, primary_key=True, index=True)
-    title = Column(String(200), index=True, nullable=False)
-    description = Column(Text)
-    category = Column(String(50), index=True)
+    id = Column(Integer, primary_key=True)
+    title = Column(String(200), nullable=False)
+    # Тяжелые Text-колонки не загружаются с сущностью: только явным select колонки
+    # (обращение к незагруженному атрибуту - ошибка, а не скрытый ленивый запрос)
+    description = deferred(Column(Text), raiseload=True)
+    category = Column(String(50))
     level = Column(String(20), index=True)
     teacher_id = Column(Integer, ForeignKey('users.id'))
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -51,6 +116,8 @@ class Course(Base):
     teacher = relationship('User', back_populates='courses')
     materials = relationship('Material', back_populates='course', cascade="all, delete-orphan")
     
+    # Индексы SQLite неявно заканчиваются rowid, поэтому (category, level) отдает курсы
+    # фильтра сразу в порядке id для keyset-пагинации; фильтр только по level - свой индекс
     __table_args__ = (
         Index('idx_course_category_level', 'category', 'level'),
     )
@@ -58,24 +125,29 @@ class Course(Base):
 class Material(Base):
     __tablename__ = 'materials'
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     course_id = Column(Integer, ForeignKey('courses.id'))
     title = Column(String(200), nullable=False)
-    content = Column(Text)
+    content = deferred(Column(Text), raiseload=True)
     type = Column(String(20), index=True)
     order_index = Column(Integer, default=0)
     created_at = Column(DateTime, default=datetime.utcnow)
     
     course = relationship('Course', back_populates='materials')
     activities = relationship('Activity', back_populates='material')
+    
+    # Материалы курса в порядке (order_index, id) - ровно ключ пагинации /courses/{id}/materials
+    __table_args__ = (
+        Index('idx_material_course_order', 'course_id', 'order_index'),
+    )
 
 class Activity(Base):
     __tablename__ = 'activities'
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'))
     material_id = Column(Integer, ForeignKey('materials.id'))
-    action = Column(String(50), index=True)
+    action = Column(String(50))
     timestamp = Column(DateTime, default=datetime.utcnow, index=True)
     duration = Column(Float, nullable=True)
     score = Column(Float, nullable=True)
@@ -84,7 +156,186 @@ class Activity(Base):
     user = relationship('User', back_populates='activities')
     material = relationship('Material', back_populates='activities')
     
+    # Каждый индекс - лишняя запись на каждое событие, поэтому только под реальные запросы:
+    # события пользователя за период, события материалов курса, диапазоны по времени (выгрузка, архив)
     __table_args__ = (
-        Index('idx_activity_user_action', 'user_id', 'action'),
+        Index('idx_activity_user_timestamp', 'user_id', 'timestamp'),
         Index('idx_activity_material_timestamp', 'material_id', 'timestamp'),
     )
+
+class CourseStats(Base):
+    """Агрегаты по курсу, обновляются инкрементально при записи активности"""
+    __tablename__ = 'course_stats'
+    
+    course_id = Column(Integer, ForeignKey('courses.id'), primary_key=True)
+    total_students = Column(Integer, nullable=False, default=0)
+    total_time = Column(Float, nullable=False, default=0.0)
+    score_sum = Column(Float, nullable=False, default=0.0)
+    score_count = Column(Integer, nullable=False, default=0)
+    completions = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class CourseStudent(Base):
+    """Множество уникальных студентов курса (для подсчета total_students)"""
+    __tablename__ = 'course_students'
+    
+    course_id = Column(Integer, ForeignKey('courses.id'), primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    
+    __table_args__ = {'sqlite_with_rowid': False}
+
+class ArchivedProgress(Base):
+    """Вклад событий, перенесенных в архив (retention.py), в прогресс пользователя по материалу"""
+    __tablename__ = 'archived_progress'
+    
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    material_id = Column(Integer, ForeignKey('materials.id'), primary_key=True)
+    # 1 - среди архивных событий был "complete"
+    completed = Column(Integer, nullable=False, default=0)
+    duration_sum = Column(Float, nullable=False, default=0.0)
+    score_sum = Column(Float, nullable=False, default=0.0)
+    score_count = Column(Integer, nullable=False, default=0)
+    
+    __table_args__ = {'sqlite_with_rowid': False}
+
+class LearningPath(Base):
+    """Точка продолжения курса для пользователя: последний материал, пройденные материалы
+    (битовая карта по порядку материалов курса) и следующий материал; обновляется при записи активности"""
+    __tablename__ = 'learning_paths'
+    
+    # Ключ (course_id, user_id): карты курса переписываются при добавлении материала
+    course_id = Column(Integer, ForeignKey('courses.id'), primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    last_material_id = Column(Integer, ForeignKey('materials.id'))
+    # NULL - пройдены все материалы курса
+    next_material_id = Column(Integer, ForeignKey('materials.id'))
+    # Бит i - i-й материал курса в порядке (order_index, id)
+    completed = Column(LargeBinary, nullable=False, default=b"")
+    completed_count = Column(Integer, nullable=False, default=0)
+    total_materials = Column(Integer, nullable=False, default=0)
+    last_activity_id = Column(Integer)
+    last_activity_at = Column(DateTime)
+    
+    # Последний курс пользователя (/users/me/next без course_id)
+    __table_args__ = (
+        Index('idx_learning_path_user_recent', 'user_id', 'last_activity_at'),
+        {'sqlite_with_rowid': False},
+    )
+
+class CatalogFacet(Base):
+    """Счетчики каталога для главной страницы: итоги (facet='total') и число курсов/материалов
+    по категории, уровню и типу; обновляются при создании записей"""
+    __tablename__ = 'catalog_summary'
+    
+    facet = Column(String(20), primary_key=True)
+    value = Column(String(100), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    
+    __table_args__ = {'sqlite_with_rowid': False}
+
+class ActivityRollup(Base):
+    """Почасовые и подневные агрегаты активности по курсу, материалу и действию"""
+    __tablename__ = 'activity_rollups'
+    
+    granularity = Column(String(10), primary_key=True)  # hour | day
+    bucket_start = Column(DateTime, primary_key=True)
+    course_id = Column(Integer, primary_key=True)
+    material_id = Column(Integer, primary_key=True)
+    action = Column(String(50), primary_key=True)
+    events = Column(Integer, nullable=False, default=0)
+    duration_sum = Column(Float, nullable=False, default=0.0)
+    score_sum = Column(Float, nullable=False, default=0.0)
+    score_count = Column(Integer, nullable=False, default=0)
+    users_hll = Column(LargeBinary)  # HyperLogLog уникальных пользователей (hll.py)
+    
+    __table_args__ = (
+        Index('idx_rollup_course_bucket', 'course_id', 'granularity', 'bucket_start'),
+    )
+
+class Job(Base):
+    """Фоновая задача (jobs.py): очередь, состояние, прогресс и результат"""
+    __tablename__ = 'jobs'
+    
+    id = Column(Integer, primary_key=True)
+    type = Column(String(50), nullable=False)
+    params = Column(JSON, nullable=True)
+    status = Column(String(20), nullable=False, default='queued')  # queued | running | done | failed
+    priority = Column(Integer, nullable=False, default=0)
+    progress = Column(Float, nullable=False, default=0.0)
+    message = Column(String(255))
+    result = Column(JSON, nullable=True)
+    result_file = Column(String(255))
+    error = Column(Text)
+    user_id = Column(Integer, ForeignKey('users.id'))
+    worker = Column(String(100))
+    # Номер захвата: результат записывает только тот, кто захватил задачу последним
+    attempts = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    heartbeat_at = Column(DateTime)
+    
+    # Выбор следующей задачи и число выполняемых задач каждого типа
+    __table_args__ = (
+        Index('idx_job_status_type', 'status', 'type'),
+    )
+
+# Полнотекстовый индекс (SQLite FTS5) по курсам и материалам.
+# rowid = id * 2 для курсов и id * 2 + 1 для материалов, поэтому синхронизирующие
+# триггеры обновляют индекс точечно по rowid.
+SEARCH_INDEX_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+        title, body, category, tokenize = 'unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS search_courses_ai AFTER INSERT ON courses BEGIN
+        INSERT INTO search_index(rowid, title, body, category)
+        VALUES (new.id * 2, new.title, new.description, new.category);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_courses_au AFTER UPDATE OF title, description, category ON courses BEGIN
+        DELETE FROM search_index WHERE rowid = old.id * 2;
+        INSERT INTO search_index(rowid, title, body, category)
+        VALUES (new.id * 2, new.title, new.description, new.category);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_courses_ad AFTER DELETE ON courses BEGIN
+        DELETE FROM search_index WHERE rowid = old.id * 2;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_materials_ai AFTER INSERT ON materials BEGIN
+        INSERT INTO search_index(rowid, title, body, category)
+        VALUES (new.id * 2 + 1, new.title, new.content, NULL);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_materials_au AFTER UPDATE OF title, content ON materials BEGIN
+        DELETE FROM search_index WHERE rowid = old.id * 2 + 1;
+        INSERT INTO search_index(rowid, title, body, category)
+        VALUES (new.id * 2 + 1, new.title, new.content, NULL);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_materials_ad AFTER DELETE ON materials BEGIN
+        DELETE FROM search_index WHERE rowid = old.id * 2 + 1;
+    END""",
+]
+
+for statement in SEARCH_INDEX_DDL:
+    event.listen(Base.metadata, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+event.listen(Base.metadata, 'before_drop', DDL('DROP TABLE IF EXISTS search_index').execute_if(dialect='sqlite'))
+
+# Индексы прежних версий схемы, которые больше не нужны ни одному запросу
+OBSOLETE_INDEXES = [
+    'ix_users_id', 'ix_users_name', 'ix_users_role',
+    'ix_courses_id', 'ix_courses_title', 'ix_courses_category',
+    'ix_materials_id',
+    'ix_activities_id', 'ix_activities_action', 'idx_activity_user_action',
+]
+
+def sync_indexes(connection):
+    """Приводит индексы существующей базы к моделям: create_all не трогает уже созданные таблицы"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+    if connection.dialect.name == 'sqlite':
+        for name in OBSOLETE_INDEXES:
+            connection.exec_driver_sql(f'DROP INDEX IF EXISTS {name}')
+
+async def create_tables():
+    """Создает недостающие таблицы и индексы, не трогая данные"""
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(sync_indexes)
@@ -0,0 +1,350 @@
+# etl.py - Параллельная выгрузка activities в колоночные файлы для хранилища
+#
+# Выгрузка: python etl.py export [--by id|day] [--shard-size N] [--workers N] [--format parquet|npz]
+# Список шардов: python etl.py list
+#
+# Таблица делится на шарды по диапазонам id (или по дням), шарды выгружаются параллельно в
+# процессах-воркерах в сжатые файлы с типизированной схемой; meta раскладывается по колонкам
+# meta_<поле> (ETL_META_FIELDS), остальные ключи - JSON в meta_extra. В manifest.json записываются
+# готовые шарды: повторный запуск пропускает их (продолжение после сбоя) и выгружает только новые,
+# недозаполненные и те, в которые с выгрузки добавились события (число строк или максимальный id
+# больше, чем в манифесте: импорт истории пишет и в закрытые дни и диапазоны id). События,
+# перенесенные retention.py в архив, уже лежат в колоночных файлах archive/ и сюда не попадают.
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import func, select
+
+from db import DATABASE_URL, create_engine_from_settings, make_session_factory, Activity, Material
+
+ETL_DIR = os.getenv("ETL_DIR", "./etl")
+ETL_FORMAT = os.getenv("ETL_FORMAT", "parquet")  # parquet | npz
+ETL_WORKERS = int(os.getenv("ETL_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Диапазон id одного шарда при --by id
+ETL_SHARD_SIZE = int(os.getenv("ETL_SHARD_SIZE", "1000000"))
+ETL_FETCH_SIZE = int(os.getenv("ETL_FETCH_SIZE", "50000"))
+ETL_COMPRESSION = os.getenv("ETL_COMPRESSION", "zstd")
+# Поля meta, которые становятся колонками: "имя:тип" через запятую, тип string|int64|float64
+ETL_META_FIELDS = os.getenv("ETL_META_FIELDS", "device:string")
+
+SHARDING = ("id", "day")
+EXTENSIONS = {"parquet": ".parquet", "npz": ".npz"}
+MANIFEST = "manifest.json"
+
+BASE_SCHEMA = [
+    ("activity_id", "int64"),
+    ("user_id", "int64"),
+    ("material_id", "int64"),
+    ("course_id", "int64"),
+    ("action", "string"),
+    ("timestamp", "timestamp"),
+    ("duration", "float64"),
+    ("score", "float64"),
+]
+CASTS = {"string": str, "int64": int, "float64": float}
+
+
+def parse_meta_fields(spec: str = ETL_META_FIELDS) -> List[Tuple[str, str]]:
+    fields = []
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, kind = item.partition(":")
+        kind = kind or "string"
+        if kind not in CASTS:
+            raise ValueError(f"Unknown meta field type: {item}")
+        fields.append((name, kind))
+    return fields
+
+
+def etl_schema(meta_fields: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    return BASE_SCHEMA + [(f"meta_{name}", kind) for name, kind in meta_fields] + [("meta_extra", "string")]
+
+
+def flatten(rows, meta_fields: List[Tuple[str, str]]) -> Dict[str, list]:
+    """Строки выборки -> колонки схемы; значения meta, не приводимые к типу колонки, остаются в meta_extra"""
+    columns = {name: [] for name, _ in etl_schema(meta_fields)}
+    for activity_id, user_id, material_id, course_id, action, timestamp, duration, score, meta in rows:
+        for name, value in zip(("activity_id", "user_id", "material_id", "course_id", "action", "timestamp",
+                                "duration", "score"),
+                               (activity_id, user_id, material_id, course_id, action, timestamp, duration, score)):
+            columns[name].append(value)
+        extra = dict(meta) if isinstance(meta, dict) else ({"value": meta} if meta is not None else {})
+        for name, kind in meta_fields:
+            value = extra.pop(name, None)
+            try:
+                value = CASTS[kind](value) if value is not None else None
+            except (TypeError, ValueError):
+                extra[name] = value
+                value = None
+            columns[f"meta_{name}"].append(value)
+        columns["meta_extra"].append(json.dumps(extra, sort_keys=True) if extra else None)
+    return columns
+
+
+# Запись шарда: колонки приходят пачками по ETL_FETCH_SIZE строк
+
+class ParquetShardWriter:
+    """Parquet с row group на пачку; pyarrow импортируется только здесь (воркеры и CLI)"""
+
+    def __init__(self, path: str, schema: List[Tuple[str, str]]):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        types = {"int64": pa.int64(), "float64": pa.float64(), "string": pa.string(), "timestamp": pa.timestamp("us")}
+        self._pa = pa
+        self._schema = pa.schema([(name, types[kind]) for name, kind in schema])
+        self._writer = pq.ParquetWriter(path, self._schema, compression=ETL_COMPRESSION)
+
+    def write(self, columns: Dict[str, list]):
+        self._writer.write_table(self._pa.Table.from_pydict(columns, schema=self._schema))
+
+    def close(self):
+        self._writer.close()
+
+
+class NpzShardWriter:
+    """Сжатые колонки NumPy; NULL - как в retention.py: -1 для id, NaN для чисел, "" для строк"""
+
+    def __init__(self, path: str, schema: List[Tuple[str, str]]):
+        self._path = path
+        self._schema = schema
+        self._chunks: Dict[str, List[np.ndarray]] = {name: [] for name, _ in schema}
+
+    def write(self, columns: Dict[str, list]):
+        for name, kind in self._schema:
+            values = columns[name]
+            if kind == "int64":
+                array = np.array([-1 if v is None else v for v in values], np.int64)
+            elif kind == "float64":
+                array = np.array([np.nan if v is None else v for v in values], np.float64)
+            elif kind == "timestamp":
+                array = np.array(values, "datetime64[us]")
+            else:
+                array = np.array(["" if v is None else v for v in values], dtype=str)
+            self._chunks[name].append(array)
+
+    def close(self):
+        with open(self._path, "wb") as f:
+            np.savez_compressed(f, **{
+                name: np.concatenate(chunks) if chunks else np.array([])
+                for name, chunks in self._chunks.items()
+            })
+
+
+WRITERS = {"parquet": ParquetShardWriter, "npz": NpzShardWriter}
+
+
+# Шарды: {"name", "start", "end", "complete"}; start/end - id (включительно) или ISO-даты [start, end)
+
+def shard_filter(by: str, shard: Dict[str, Any]):
+    if by == "id":
+        return [Activity.id >= shard["start"], Activity.id <= shard["end"]]
+    return [Activity.timestamp >= datetime.fromisoformat(shard["start"]),
+            Activity.timestamp < datetime.fromisoformat(shard["end"])]
+
+
+async def column_bounds(session, column):
+    # min и max отдельными подзапросами: вместе в одном SELECT SQLite читает весь индекс
+    return (await session.execute(select(
+        select(func.min(column)).scalar_subquery(), select(func.max(column)).scalar_subquery()
+    ))).one()
+
+
+async def plan_shards(session, by: str, shard_size: int) -> List[Dict[str, Any]]:
+    """Все шарды текущей таблицы; complete=False у последнего, в который еще пишутся события"""
+    if by == "id":
+        first, last = await column_bounds(session, Activity.id)
+        if first is None:
+            return []
+        shards = []
+        for index in range((first - 1) // shard_size, (last - 1) // shard_size + 1):
+            start, end = index * shard_size + 1, (index + 1) * shard_size
+            shards.append({"name": f"id-{start:012d}-{end:012d}", "start": start, "end": end,
+                           "complete": end <= last})
+        return shards
+
+    first, last = await column_bounds(session, Activity.timestamp)
+    if first is None:
+        return []
+    shards = []
+    day = first.replace(hour=0, minute=0, second=0, microsecond=0)
+    while day <= last:
+        end = day + timedelta(days=1)
+        shards.append({"name": f"day-{day:%Y-%m-%d}", "start": day.isoformat(), "end": end.isoformat(),
+                       "complete": end <= last})
+        day = end
+    return shards
+
+
+async def needs_export(session, by: str, shard: Dict[str, Any], info: Optional[Dict[str, Any]]) -> bool:
+    """Шард не выгружен, был недозаполнен или в нем появились события после выгрузки. Меньше строк,
+    чем в файле, - не повод: их перенес в архив retention.py, а в файле они остаются"""
+    if info is None or not info["complete"]:
+        return True
+    rows, last_id = (await session.execute(
+        select(func.count(), func.max(Activity.id)).where(*shard_filter(by, shard))
+    )).one()
+    return rows > info["rows"] or (last_id or 0) > (info["last_id"] or 0)
+
+
+async def _export_shard(url: str, by: str, shard: Dict[str, Any], fmt: str, directory: str,
+                        meta_fields: List[Tuple[str, str]]) -> Dict[str, Any]:
+    engine = create_engine_from_settings(url, read_only=True, pool_size=1)
+    filename = shard["name"] + EXTENSIONS[fmt]
+    path = os.path.join(directory, filename)
+    writer = WRITERS[fmt](path + ".tmp", etl_schema(meta_fields))
+    info = {"file": filename, "rows": 0, "first_id": None, "last_id": None, "complete": shard["complete"]}
+    try:
+        async with make_session_factory(engine)() as session:
+            stmt = select(
+                Activity.id, Activity.user_id, Activity.material_id, Material.course_id, Activity.action,
+                Activity.timestamp, Activity.duration, Activity.score, Activity.meta
+            ).outerjoin(Material, Activity.material_id == Material.id).where(
+                *shard_filter(by, shard)
+            ).order_by(Activity.id).execution_options(yield_per=ETL_FETCH_SIZE)
+            result = await session.stream(stmt)
+            async for rows in result.partitions():
+                writer.write(flatten(rows, meta_fields))
+                info["rows"] += len(rows)
+                info["first_id"] = info["first_id"] or rows[0][0]
+                info["last_id"] = rows[-1][0]
+    finally:
+        writer.close()
+        await engine.dispose()
+    os.replace(path + ".tmp", path)
+    return info
+
+
+def export_shard(url: str, by: str, shard: Dict[str, Any], fmt: str, directory: str,
+                 meta_fields: List[Tuple[str, str]]) -> Dict[str, Any]:
+    """Точка входа воркера: свой event loop и свое соединение с БД"""
+    return asyncio.run(_export_shard(url, by, shard, fmt, directory, meta_fields))
+
+
+# Манифест: параметры разбиения, схема и готовые шарды
+
+def load_manifest(directory: str = ETL_DIR) -> Optional[Dict[str, Any]]:
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest: Dict[str, Any], directory: str = ETL_DIR):
+    path = os.path.join(directory, MANIFEST)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def session_url(session_factory) -> str:
+    """URL базы фабрики сессий (с паролем) для подключения из воркеров"""
+    return session_factory.kw["bind"].url.render_as_string(hide_password=False)
+
+
+async def export_activities(
+    url: str = DATABASE_URL,
+    by: str = "id",
+    shard_size: int = ETL_SHARD_SIZE,
+    workers: int = ETL_WORKERS,
+    fmt: str = ETL_FORMAT,
+    directory: str = ETL_DIR,
+    meta_fields: Optional[List[Tuple[str, str]]] = None,
+    on_progress: Optional[Callable[[int, int, int], None]] = None,
+) -> Dict[str, Any]:
+    """Выгружает новые и недозаполненные шарды; возвращает {"shards", "exported", "rows"}.
+    on_progress(готово шардов, всего к выгрузке, строк) вызывается после каждого шарда"""
+    if by not in SHARDING:
+        raise ValueError(f"Unknown sharding: {by}")
+    if fmt not in WRITERS:
+        raise ValueError(f"Unknown ETL format: {fmt}")
+    meta_fields = parse_meta_fields() if meta_fields is None else meta_fields
+    schema = [list(column) for column in etl_schema(meta_fields)]
+    layout = {"by": by, "shard_size": shard_size if by == "id" else None, "format": fmt, "schema": schema}
+
+    os.makedirs(directory, exist_ok=True)
+    manifest = load_manifest(directory) or {**layout, "shards": {}}
+    changed = [key for key, value in layout.items() if manifest[key] != value]
+    if changed:
+        raise ValueError(f"{directory} holds an export with different {', '.join(changed)}; use another directory")
+
+    engine = create_engine_from_settings(url, read_only=True, pool_size=1)
+    try:
+        async with make_session_factory(engine)() as session:
+            shards = await plan_shards(session, by, shard_size)
+            done = manifest["shards"]
+            pending = [shard for shard in shards if await needs_export(session, by, shard, done.get(shard["name"]))]
+    finally:
+        await engine.dispose()
+
+    rows = 0
+    exported = 0
+    if on_progress:
+        on_progress(0, len(pending), rows)
+
+    def record(shard, info):
+        # Манифест пишет только родитель: шард попадает в него после того, как файл на месте
+        nonlocal rows, exported
+        info["exported_at"] = datetime.utcnow().isoformat()
+        done[shard["name"]] = info
+        save_manifest(manifest, directory)
+        rows += info["rows"]
+        exported += 1
+        if on_progress:
+            on_progress(exported, len(pending), rows)
+
+    if workers <= 0:
+        for shard in pending:
+            record(shard, await _export_shard(url, by, shard, fmt, directory, meta_fields))
+    else:
+        # spawn: воркеры не наследуют event loop и соединения родителя
+        loop = asyncio.get_running_loop()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            async def run(shard):
+                return shard, await loop.run_in_executor(pool, export_shard, url, by, shard, fmt, directory,
+                                                         meta_fields)
+
+            for future in asyncio.as_completed([run(shard) for shard in pending]):
+                record(*await future)
+    return {"shards": len(done), "exported": exported, "rows": rows}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Sharded columnar export of activities")
+    parser.add_argument("command", choices=["export", "list"])
+    parser.add_argument("--by", choices=SHARDING, default="id")
+    parser.add_argument("--shard-size", type=int, default=ETL_SHARD_SIZE, help="ids per shard (--by id)")
+    parser.add_argument("--workers", type=int, default=ETL_WORKERS, help="0 - export in this process")
+    parser.add_argument("--format", choices=list(WRITERS), default=ETL_FORMAT)
+    parser.add_argument("--output", default=ETL_DIR)
+    args = parser.parse_args()
+
+    if args.command == "list":
+        manifest = load_manifest(args.output)
+        if manifest is None:
+            print(f"В {args.output} нет выгрузки")
+            return
+        print(f'Разбиение: {manifest["by"]}, формат: {manifest["format"]}')
+        for name, info in sorted(manifest["shards"].items()):
+            status = "" if info["complete"] else "  (будет дополнен)"
+            print(f'{name}  {info["rows"]:>10}  {info["file"]}{status}')
+        return
+
+    def report(done, total, rows):
+        print(f"\r{done}/{total} шардов, {rows} событий", end="", flush=True)
+
+    result = await export_activities(by=args.by, shard_size=args.shard_size, workers=args.workers,
+                                     fmt=args.format, directory=args.output, on_progress=report)
+    print(f'\n✅ Выгружено {result["exported"]} шардов ({result["rows"]} событий), всего в {args.output}: '
+          f'{result["shards"]}')
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -2,6 +2,9 @@
 import asyncio
 from datetime import datetime, timedelta
 from db import SessionLocal, User, Course, Material, Activity
+from course_stats import rebuild_course_stats
+from rollups import backfill
+from learning_path import rebuild_learning_paths
 from passlib.context import CryptContext
 import random
 
@@ -152,6 +155,16 @@ async def fill_with_sample_data():
         db.add_all(activities)
         await db.commit()
         
+        # Пересчитываем агрегаты по курсам
+        await rebuild_course_stats(db)
+        await db.commit()
+        
+        # Агрегаты для временных рядов
+        await backfill()
+        
+        # Точки продолжения курсов
+        await rebuild_learning_paths()
+        
         print(f"Создано:")
         print(f"  - Пользователей: {len(users)}")
         print(f"  - Курсов: {len(courses)}")
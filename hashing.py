@@ -0,0 +1,81 @@
+# hashing.py - Хэширование паролей (bcrypt) вне event loop
+import asyncio
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from passlib.context import CryptContext
+
+# Число параллельных хэширований; 0 - считать прямо в event loop (как раньше)
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "4"))
+# "thread" (bcrypt отпускает GIL) или "process"
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread")
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+class PasswordHasher:
+    """Ограниченный пул воркеров для bcrypt с метрикой глубины очереди"""
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, executor: str = PASSWORD_HASH_EXECUTOR):
+        if executor not in ("thread", "process"):
+            raise ValueError(f"Unknown executor type: {executor}")
+        self.workers = workers
+        self.executor_type = executor
+        self._executor: Optional[Executor] = None
+        self.pending = 0
+        self.completed = 0
+
+    @property
+    def queue_depth(self) -> int:
+        """Сколько операций ждут свободного воркера"""
+        return max(0, self.pending - self.workers)
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.executor_type == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    async def _run(self, fn, *args):
+        if self.workers <= 0:
+            return fn(*args)
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(_verify, plain_password, hashed_password)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "executor": self.executor_type,
+            "in_flight": self.pending,
+            "queue_depth": self.queue_depth,
+            "completed": self.completed,
+        }
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,210 @@
+# ingest.py - Пакетная запись событий активности
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import insert
+
+from db import SessionLocal, Activity
+
+# Настройки очереди (переопределяются переменными окружения)
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+INGEST_FLUSH_INTERVAL = float(os.getenv("INGEST_FLUSH_INTERVAL", "0.05"))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "10000"))
+INGEST_ENQUEUE_TIMEOUT = float(os.getenv("INGEST_ENQUEUE_TIMEOUT", "1.0"))
+# "flush" - ответ после записи в БД, "enqueue" - сразу после постановки в очередь
+INGEST_DURABILITY = os.getenv("INGEST_DURABILITY", "flush")
+
+DURABILITY_MODES = ("flush", "enqueue")
+
+logger = logging.getLogger(__name__)
+
+
+class IngestQueueFull(Exception):
+    """Очередь переполнена, клиенту нужно повторить запрос позже"""
+
+
+class ActivityIngestor:
+    """Асинхронная очередь событий с записью пачками по размеру или по таймеру"""
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        batch_size: int = INGEST_BATCH_SIZE,
+        flush_interval: float = INGEST_FLUSH_INTERVAL,
+        max_queue: int = INGEST_QUEUE_SIZE,
+        enqueue_timeout: float = INGEST_ENQUEUE_TIMEOUT,
+        durability: str = INGEST_DURABILITY,
+    ):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode: {durability}")
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.enqueue_timeout = enqueue_timeout
+        self.durability = durability
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._flush_hooks = []
+        self._commit_hooks = []
+        self.flushed_total = 0
+        self.batches_total = 0
+
+    def add_flush_hook(self, hook):
+        """Регистрирует корутину hook(session, rows), которая выполняется
+        в той же транзакции, что и запись пачки (rows уже содержат id)"""
+        self._flush_hooks.append(hook)
+
+    def add_commit_hook(self, hook):
+        """Регистрирует корутину hook(session, rows), которая выполняется после коммита пачки
+        и ответа клиентам (уведомления); ошибки hook логируются и не влияют на запись"""
+        self._commit_hooks.append(hook)
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def start(self):
+        if self._worker and not self._worker.done():
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Дописывает накопленные события и останавливает воркер"""
+        if not self._worker:
+            return
+        await self._queue.join()
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+    async def submit(self, rows: List[Dict[str, Any]], durability: Optional[str] = None) -> Optional[List[int]]:
+        """Ставит события в очередь.
+
+        В режиме "flush" возвращает id записанных строк, в режиме "enqueue" - None.
+        """
+        durability = durability or self.durability
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode: {durability}")
+        await self.start()
+
+        # Пачка ставится в очередь целиком или не ставится вовсе: иначе при таймауте
+        # часть строк уже была бы записана, а клиент получил бы 503 и повторил их
+        if len(rows) > self.max_queue > 0:
+            raise IngestQueueFull(f"Batch of {len(rows)} events exceeds ingest queue ({self.max_queue} events)")
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.enqueue_timeout
+        # Backpressure: ждем места под всю пачку не дольше enqueue_timeout
+        while not self._has_room(len(rows)):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise IngestQueueFull(f"Ingest queue is full ({self.max_queue} events)")
+            await asyncio.sleep(min(remaining, 0.005))
+
+        futures = []
+        for row in rows:
+            row.setdefault("timestamp", datetime.utcnow())
+            future = loop.create_future() if durability == "flush" else None
+            self._queue.put_nowait((row, future))
+            futures.append(future)
+
+        if durability == "enqueue":
+            return None
+        return list(await asyncio.gather(*futures))
+
+    def _has_room(self, count: int) -> bool:
+        return self.max_queue <= 0 or self.max_queue - self._queue.qsize() >= count
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+            # Добираем пачку до batch_size, но не дольше flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                await asyncio.sleep(min(remaining, 0.005))
+            try:
+                await self._flush(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _write(self, session, rows):
+        result = await session.scalars(
+            insert(Activity).returning(Activity.id, sort_by_parameter_order=True),
+            rows,
+        )
+        for row, activity_id in zip(rows, result.all()):
+            row["id"] = activity_id
+        for hook in self._flush_hooks:
+            await hook(session, rows)
+
+    async def _flush(self, batch):
+        written, failed = batch, []
+        try:
+            async with self.session_factory() as session:
+                try:
+                    await self._write(session, [row for row, _ in batch])
+                except Exception:
+                    # В пачке события разных запросов: повторяем по одному в savepoint,
+                    # чтобы ошибка одной строки не отклоняла остальные
+                    logger.exception("Failed to flush %d activities, retrying one by one", len(batch))
+                    await session.rollback()
+                    written = []
+                    for row, future in batch:
+                        row.pop("id", None)
+                        try:
+                            async with session.begin_nested():
+                                await self._write(session, [row])
+                            written.append((row, future))
+                        except Exception as e:
+                            row.pop("id", None)
+                            failed.append((row, future, e))
+                await session.commit()
+        except Exception as e:
+            logger.exception("Failed to flush %d activities", len(batch))
+            for _, future in batch:
+                if future is not None and not future.done():
+                    future.set_exception(e)
+            return
+
+        for row, future, e in failed:
+            logger.error("Dropped activity %r: %s", row, e)
+            if future is not None and not future.done():
+                future.set_exception(e)
+        if not written:
+            return
+        rows = [row for row, _ in written]
+        self.flushed_total += len(rows)
+        self.batches_total += 1
+        for row, future in written:
+            if future is not None and not future.done():
+                future.set_result(row["id"])
+        if self._commit_hooks:
+            await self._run_commit_hooks(rows)
+
+    async def _run_commit_hooks(self, rows):
+        async with self.session_factory() as session:
+            for hook in self._commit_hooks:
+                try:
+                    await hook(session, rows)
+                except Exception:
+                    logger.exception("Commit hook %r failed for %d activities", hook, len(rows))
+
+
+ingestor = ActivityIngestor()
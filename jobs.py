@@ -0,0 +1,297 @@
+# jobs.py - Фоновые задачи: тяжелая аналитика и выгрузки вне обработчика запроса
+#
+# Задача - строка таблицы jobs: тип, параметры, приоритет, состояние, прогресс и результат
+# (JSON в jobs.result или файл в JOB_RESULTS_DIR). Типы задач регистрируются декоратором job_type
+# (обработчики API - в main.py). JobRunner запускается в процессе API (JOB_WORKERS воркеров) или
+# отдельным процессом: python jobs.py worker (в API тогда JOB_WORKERS=0). Следующая задача
+# забирается одним UPDATE ... RETURNING - по приоритету и с лимитом одновременных задач типа,
+# поэтому несколько процессов не возьмут одну задачу дважды и не превысят лимит.
+#
+# Heartbeat пишет отдельный поток со своим синхронным соединением: задача, которая надолго занимает
+# event loop, не выглядит упавшей. Каждый захват увеличивает jobs.attempts, и прогресс, результат
+# и ошибку записывает только последний захват: задача, возвращенная в очередь, пока ее прежний
+# исполнитель еще работал, не получит результат дважды.
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from pydantic import BaseModel
+from sqlalchemy import case, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from db import create_sync_engine, create_tables, SessionLocal, Job
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+JOB_RESULTS_DIR = os.getenv("JOB_RESULTS_DIR", "./job_results")
+# Как часто прогресс и heartbeat выполняемых задач записываются в таблицу
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", "2.0"))
+# Задача в running без heartbeat дольше этого времени (процесс упал) возвращается в очередь
+JOB_STALE_AFTER = float(os.getenv("JOB_STALE_AFTER", "60"))
+
+logger = logging.getLogger(__name__)
+
+
+class JobContext:
+    """Передается обработчику: прогресс и путь к файлу результата"""
+
+    def __init__(self, job_id: int, attempt: int = 1):
+        self.job_id = job_id
+        self.attempt = attempt
+        self.progress_value = 0.0
+        self.message: Optional[str] = None
+        self.result_file: Optional[str] = None
+
+    def progress(self, fraction: Optional[float] = None, message: Optional[str] = None):
+        """Запоминает прогресс; в таблицу он попадает с очередным heartbeat"""
+        if fraction is not None:
+            self.progress_value = min(max(fraction, 0.0), 1.0)
+        if message is not None:
+            self.message = message[:255]
+
+    def result_path(self, extension: str) -> str:
+        os.makedirs(JOB_RESULTS_DIR, exist_ok=True)
+        # Свой файл у каждого захвата: прежний исполнитель не перезапишет результат нового
+        self.result_file = os.path.join(JOB_RESULTS_DIR, f"job-{self.job_id}-{self.attempt}{extension}")
+        return self.result_file
+
+
+Handler = Callable[[JobContext, Any], Awaitable[Any]]
+
+
+@dataclass(frozen=True)
+class JobType:
+    name: str
+    handler: Handler
+    params: type
+    # Сколько задач типа выполняется одновременно (на все процессы)
+    concurrency: int = 1
+    priority: int = 0
+    roles: Tuple[str, ...] = ("admin",)
+    # Параметр с id пользователя: роли кроме teacher/admin запускают задачу только для себя
+    owner_param: Optional[str] = None
+
+
+registry: Dict[str, JobType] = {}
+
+
+def job_type(name: str, params: type = BaseModel, concurrency: int = 1, priority: int = 0,
+             roles: Tuple[str, ...] = ("admin",), owner_param: Optional[str] = None):
+    """Регистрирует корутину handler(ctx, params) как тип задачи; params - Pydantic-модель параметров"""
+    def register(handler: Handler) -> Handler:
+        registry[name] = JobType(name, handler, params, concurrency, priority, roles, owner_param)
+        return handler
+    return register
+
+
+async def submit(session: AsyncSession, name: str, params: BaseModel, user_id: Optional[int] = None,
+                 priority: Optional[int] = None) -> Job:
+    job = Job(type=name, params=params.model_dump(mode="json"), user_id=user_id,
+              priority=registry[name].priority if priority is None else priority)
+    session.add(job)
+    await session.commit()
+    runner.wake()
+    return job
+
+
+def claim_statement(worker: str, now: datetime):
+    """UPDATE, который переводит в running самую приоритетную задачу типа, у которого не исчерпан лимит"""
+    limits = {name: spec.concurrency for name, spec in registry.items()}
+    queued, running = aliased(Job), aliased(Job)
+    running_count = (
+        select(func.count())
+        .where(running.status == "running", running.type == queued.type)
+        .correlate(queued)
+        .scalar_subquery()
+    )
+    candidate = (
+        select(queued.id)
+        .where(queued.status == "queued", queued.type.in_(list(limits)),
+               running_count < case(limits, value=queued.type, else_=0))
+        .order_by(queued.priority.desc(), queued.id)
+        .limit(1)
+        .scalar_subquery()
+    )
+    return (
+        update(Job)
+        .where(Job.id == candidate, Job.status == "queued")
+        .values(status="running", worker=worker, started_at=now, heartbeat_at=now, progress=0.0,
+                attempts=Job.attempts + 1)
+        .returning(Job.id, Job.type, Job.params, Job.attempts)
+    )
+
+
+def claimed_job(ctx: JobContext):
+    """UPDATE задачи, пока она выполняется в захвате ctx"""
+    return update(Job).where(Job.id == ctx.job_id, Job.status == "running", Job.attempts == ctx.attempt)
+
+
+class JobRunner:
+    def __init__(self, session_factory=SessionLocal, workers: int = JOB_WORKERS,
+                 poll_interval: float = JOB_POLL_INTERVAL):
+        self.session_factory = session_factory
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._tasks = []
+        self._heartbeat_thread: Optional[threading.Thread] = None
+        self._heartbeat_stop = threading.Event()
+        self._wake: Optional[asyncio.Event] = None
+        self._running: Dict[int, JobContext] = {}
+        self.completed_total = 0
+        self.failed_total = 0
+
+    def wake(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    async def start(self):
+        if self._tasks or self.workers <= 0:
+            return
+        self._wake = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._heartbeat_stop.clear()
+        self._heartbeat_thread = threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True)
+        self._heartbeat_thread.start()
+
+    async def stop(self):
+        """Останавливает воркеры; прерванные задачи возвращаются в очередь"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._heartbeat_thread is not None:
+            self._heartbeat_stop.set()
+            await asyncio.to_thread(self._heartbeat_thread.join)
+            self._heartbeat_thread = None
+
+    async def _worker(self):
+        while True:
+            if not await self.run_next():
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    await self.requeue_stale()
+
+    async def run_next(self) -> bool:
+        """Забирает и выполняет одну задачу; False, если выполнять нечего"""
+        async with self.session_factory() as session:
+            claimed = (await session.execute(claim_statement(self.worker_id, datetime.utcnow()))).first()
+            await session.commit()
+        if claimed is None:
+            return False
+        job_id, name, params, attempt = claimed
+        spec = registry[name]
+        ctx = JobContext(job_id, attempt)
+        self._running[job_id] = ctx
+        started = time.perf_counter()
+        try:
+            result = await spec.handler(ctx, spec.params.model_validate(params or {}))
+        except asyncio.CancelledError:
+            await self._update(ctx, status="queued", worker=None, progress=0.0, message="interrupted")
+            raise
+        except Exception as e:
+            logger.exception("Job %d (%s) failed", job_id, name)
+            self.failed_total += 1
+            await self._update(ctx, status="failed", error=str(e), finished_at=datetime.utcnow(),
+                               message=ctx.message)
+        else:
+            if await self._update(ctx, status="done", progress=1.0, result=result, result_file=ctx.result_file,
+                                  message=ctx.message, finished_at=datetime.utcnow()):
+                self.completed_total += 1
+                logger.info("Job %d (%s) done in %.1f s", job_id, name, time.perf_counter() - started)
+            else:
+                logger.warning("Job %d (%s) was claimed again while running, result discarded", job_id, name)
+                if ctx.result_file and os.path.exists(ctx.result_file):
+                    os.remove(ctx.result_file)
+        finally:
+            self._running.pop(job_id, None)
+        return True
+
+    async def run_until_empty(self):
+        while await self.run_next():
+            pass
+
+    async def requeue_stale(self):
+        stale = datetime.utcnow() - timedelta(seconds=JOB_STALE_AFTER)
+        async with self.session_factory() as session:
+            result = await session.execute(
+                update(Job).where(Job.status == "running", Job.heartbeat_at < stale)
+                .values(status="queued", worker=None, progress=0.0)
+            )
+            await session.commit()
+        if result.rowcount:
+            logger.warning("Requeued %d stale jobs", result.rowcount)
+
+    def _heartbeat(self):
+        """Поток heartbeat: пишет прогресс синхронным соединением и не зависит от event loop"""
+        engine = create_sync_engine(self.session_factory.kw["bind"].url.render_as_string(hide_password=False))
+        try:
+            while not self._heartbeat_stop.wait(JOB_HEARTBEAT_INTERVAL):
+                for ctx in list(self._running.values()):
+                    try:
+                        with engine.begin() as connection:
+                            connection.execute(claimed_job(ctx).values(
+                                progress=ctx.progress_value, message=ctx.message, heartbeat_at=datetime.utcnow()
+                            ))
+                    except Exception:
+                        logger.exception("Failed to record progress of job %d", ctx.job_id)
+        finally:
+            engine.dispose()
+
+    async def _update(self, ctx: JobContext, **values) -> bool:
+        """Обновляет задачу, если она все еще в захвате ctx; False - ее уже забрали заново"""
+        async with self.session_factory() as session:
+            result = await session.execute(claimed_job(ctx).values(**values))
+            await session.commit()
+        return result.rowcount > 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers if self._tasks else 0,
+            "running": len(self._running),
+            "completed_total": self.completed_total,
+            "failed_total": self.failed_total,
+            "types": {name: spec.concurrency for name, spec in registry.items()},
+        }
+
+
+runner = JobRunner()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Background job worker")
+    parser.add_argument("command", choices=["worker"])
+    parser.add_argument("--workers", type=int, default=max(JOB_WORKERS, 1))
+    parser.add_argument("--once", action="store_true", help="run queued jobs and exit")
+    args = parser.parse_args()
+
+    # Типы задач API регистрируются при импорте main. Этот файл выполняется как __main__,
+    # поэтому очередь и реестр берутся из модуля jobs, который импортировал main
+    import main as _  # noqa: F401
+    from jobs import registry as types, runner as worker
+
+    logging.basicConfig(level=logging.INFO)
+    await create_tables()
+    if args.once:
+        await worker.run_until_empty()
+        return
+    worker.workers = args.workers
+    await worker.start()
+    print(f"✅ Воркер задач {worker.worker_id}: {args.workers} воркеров, типы: {', '.join(sorted(types))}")
+    try:
+        await asyncio.gather(*worker._tasks)
+    finally:
+        await worker.stop()
+
+if __name__ == "__main__":
+    asyncio.run(main())
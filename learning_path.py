@@ -0,0 +1,233 @@
+# learning_path.py - Точка продолжения курса: последний материал, пройденные материалы и следующий
+#
+# Пересчет из истории: python learning_path.py rebuild
+#
+# Состояние пары (course_id, user_id) хранится в learning_paths и обновляется в транзакции записи
+# активности (хук ingestor), поэтому /users/me/next читает одну строку, а не историю пользователя.
+# Пройденные материалы - битовая карта по материалам курса в порядке (order_index, id): бит i - i-й
+# материал, 500 материалов - 63 байта. Следующий материал - первый непройденный начиная с последнего
+# открытого (по кругу). Новый материал сдвигает порядок курса, поэтому materials_added
+# переписывает карты этого курса.
+import argparse
+import asyncio
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from course_stats import material_courses
+from db import create_tables, SessionLocal, Activity, Course, LearningPath, Material
+from retention import iter_archived_rows
+
+REBUILD_CHUNK = 5000
+
+
+def decode_bitmap(data: bytes) -> int:
+    return int.from_bytes(data or b"", "little")
+
+
+def encode_bitmap(bits: int) -> bytes:
+    return bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+
+
+def lowest_bit(value: int) -> int:
+    return (value & -value).bit_length() - 1
+
+
+def next_position(bits: int, total: int, start: int) -> Optional[int]:
+    """Первый непройденный материал начиная с позиции start, по кругу; None - пройдены все"""
+    pending = ~bits & ((1 << total) - 1)
+    if not pending:
+        return None
+    ahead = pending >> start
+    return start + lowest_bit(ahead) if ahead else lowest_bit(pending)
+
+
+async def course_orders(session: AsyncSession, course_ids: Iterable[int]) -> Dict[int, List[int]]:
+    """Материалы курсов в порядке (order_index, id) - том же, что у /courses/{id}/materials"""
+    result = await session.execute(
+        select(Material.course_id, Material.id)
+        .where(Material.course_id.in_(set(course_ids)))
+        .order_by(Material.course_id, Material.order_index, Material.id)
+    )
+    orders = defaultdict(list)
+    for course_id, material_id in result.all():
+        orders[course_id].append(material_id)
+    return orders
+
+
+def path_values(course_id: int, user_id: int, order: List[int], bits: int,
+                last_material_id: Optional[int], **last) -> Dict[str, Any]:
+    positions = {material_id: position for position, material_id in enumerate(order)}
+    start = positions.get(last_material_id, 0)
+    position = next_position(bits, len(order), start)
+    return {
+        "course_id": course_id,
+        "user_id": user_id,
+        "last_material_id": last_material_id,
+        "next_material_id": order[position] if position is not None else None,
+        "completed": encode_bitmap(bits),
+        "completed_count": bits.bit_count(),
+        "total_materials": len(order),
+        **last,
+    }
+
+
+async def apply_activities(session: AsyncSession, rows: List[Dict[str, Any]]):
+    """Инкрементально обновляет learning_paths по пачке новых событий"""
+    rows = [row for row in rows if row.get("user_id") is not None]
+    if not rows:
+        return
+    courses = await material_courses(session, (row["material_id"] for row in rows))
+    pairs = {(courses[row["material_id"]], row["user_id"]) for row in rows if row["material_id"] in courses}
+    if not pairs:
+        return
+    orders = await course_orders(session, {course_id for course_id, _ in pairs})
+    positions = {
+        material_id: position for order in orders.values() for position, material_id in enumerate(order)
+    }
+
+    # Два IN, как в course_stats: поиск по первичному ключу; лишние пары отсекаются ниже
+    result = await session.execute(
+        select(LearningPath.course_id, LearningPath.user_id, LearningPath.completed, LearningPath.last_material_id,
+               LearningPath.last_activity_id, LearningPath.last_activity_at).where(
+            LearningPath.course_id.in_({course_id for course_id, _ in pairs}),
+            LearningPath.user_id.in_({user_id for _, user_id in pairs}),
+        )
+    )
+    states = {
+        (course_id, user_id): {"bits": decode_bitmap(completed), "last_material_id": last_material_id,
+                               "last_activity_id": last_activity_id, "last_activity_at": last_activity_at}
+        for course_id, user_id, completed, last_material_id, last_activity_id, last_activity_at in result.all()
+        if (course_id, user_id) in pairs
+    }
+
+    for row in rows:
+        course_id = courses.get(row["material_id"])
+        if course_id is None:
+            continue
+        state = states.setdefault((course_id, row["user_id"]), {
+            "bits": 0, "last_material_id": None, "last_activity_id": None, "last_activity_at": None
+        })
+        if row.get("action") == "complete":
+            state["bits"] |= 1 << positions[row["material_id"]]
+        # Последнее событие - по времени, а не по id: импорт истории приходит после новых событий
+        if state["last_activity_at"] is None or (row["timestamp"], row["id"]) > (
+                state["last_activity_at"], state["last_activity_id"]):
+            state.update(last_material_id=row["material_id"], last_activity_id=row["id"],
+                         last_activity_at=row["timestamp"])
+
+    values = [
+        path_values(course_id, user_id, orders[course_id], state.pop("bits"), **state)
+        for (course_id, user_id), state in states.items()
+    ]
+    stmt = insert(LearningPath)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[LearningPath.course_id, LearningPath.user_id],
+        set_={column: stmt.excluded[column] for column in values[0] if column not in ("course_id", "user_id")}
+    )
+    await session.execute(stmt, values)
+
+
+async def materials_added(session: AsyncSession, materials: Iterable[Tuple[int, Optional[int]]]):
+    """Переписывает карты курсов, в которые добавлены материалы (пары material_id, course_id);
+    вызывается в транзакции вставки, после flush"""
+    added = defaultdict(set)
+    for material_id, course_id in materials:
+        if course_id is not None:
+            added[course_id].add(material_id)
+    if not added:
+        return
+    orders = await course_orders(session, added)
+    for course_id, order in orders.items():
+        previous = [material_id for material_id in order if material_id not in added[course_id]]
+        positions = {material_id: position for position, material_id in enumerate(order)}
+        result = await session.execute(
+            select(LearningPath.user_id, LearningPath.completed, LearningPath.last_material_id)
+            .where(LearningPath.course_id == course_id)
+        )
+        values = []
+        for user_id, completed, last_material_id in result.all():
+            old_bits = decode_bitmap(completed)
+            bits = 0
+            for old_position, material_id in enumerate(previous):
+                if old_bits >> old_position & 1:
+                    bits |= 1 << positions[material_id]
+            values.append(path_values(course_id, user_id, order, bits, last_material_id))
+        if values:
+            # UPDATE по первичному ключу для каждой строки
+            await session.execute(update(LearningPath), values)
+
+
+async def get_learning_path(session: AsyncSession, user_id: int, course_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """Состояние курса course_id (или последнего курса пользователя) с названием следующего материала"""
+    next_material = aliased(Material)
+    stmt = (
+        select(
+            LearningPath.course_id, Course.title.label("course_title"), LearningPath.last_material_id,
+            LearningPath.next_material_id, next_material.title.label("next_material_title"),
+            next_material.type.label("next_material_type"), LearningPath.completed,
+            LearningPath.completed_count, LearningPath.total_materials, LearningPath.last_activity_at,
+        )
+        .join(Course, Course.id == LearningPath.course_id)
+        .outerjoin(next_material, next_material.id == LearningPath.next_material_id)
+        .where(LearningPath.user_id == user_id)
+    )
+    if course_id is not None:
+        stmt = stmt.where(LearningPath.course_id == course_id)
+    else:
+        stmt = stmt.order_by(LearningPath.last_activity_at.desc()).limit(1)
+    row = (await session.execute(stmt)).mappings().first()
+    if row is None:
+        return None
+    return {**row, "completed": row["completed"].hex()}
+
+
+async def rebuild_learning_paths(session_factory=SessionLocal, chunk: int = REBUILD_CHUNK) -> int:
+    """Пересчитывает learning_paths из архива и activities"""
+    async with session_factory() as session:
+        await session.execute(delete(LearningPath))
+        # Как в rollups.backfill: более новые события учтет хук ingestor
+        max_id = (await session.execute(select(func.max(Activity.id)))).scalar() or 0
+        await session.commit()
+
+    processed = 0
+    for rows in iter_archived_rows(chunk=chunk):
+        async with session_factory() as session:
+            await apply_activities(session, rows)
+            await session.commit()
+        processed += len(rows)
+
+    last_id = 0
+    while True:
+        async with session_factory() as session:
+            stmt = select(
+                Activity.id, Activity.user_id, Activity.material_id, Activity.action, Activity.timestamp,
+            ).where(Activity.id > last_id, Activity.id <= max_id).order_by(Activity.id).limit(chunk)
+            rows = [dict(row) for row in (await session.execute(stmt)).mappings()]
+            if not rows:
+                break
+            await apply_activities(session, rows)
+            await session.commit()
+        last_id = rows[-1]["id"]
+        processed += len(rows)
+    return processed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Per-user course resume state")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.parse_args()
+
+    await create_tables()
+    started = datetime.utcnow()
+    processed = await rebuild_learning_paths()
+    print(f'✅ Точки продолжения пересчитаны по {processed} событиям за {(datetime.utcnow() - started).total_seconds():.1f} с')
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
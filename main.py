@@ -1,38 +1,67 @@
 # main.py - Полная корректная версия
-from fastapi import FastAPI, Query, HTTPException, Depends, status, Request
+from fastapi import FastAPI, Query, Path, HTTPException, Depends, status, Request, Response
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi.responses import HTMLResponse, StreamingResponse, JSONResponse, PlainTextResponse, ORJSONResponse, FileResponse
 from jose import JWTError, jwt
-from passlib.context import CryptContext
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Optional, Dict, Any, Iterable, Set
 from datetime import datetime, timedelta
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload
-from sqlalchemy import or_, and_, func, desc
-from collections import Counter
+from sqlalchemy import func, event
+from sqlalchemy.orm import Session, object_session
+from dataclasses import dataclass
 from io import StringIO
+import asyncio
 import csv
 import json
+import os
+import time
 
-from db import SessionLocal, User as DBUser, Course as DBCourse, Material as DBMaterial, Activity as DBActivity
+from db import create_tables, SessionLocal, ReadSessionLocal, User as DBUser, Course as DBCourse, Material as DBMaterial, Activity as DBActivity, Job as DBJob
+from ingest import ingestor, IngestQueueFull
+import analytics_engine
+import bulk_import
+import catalog_summary
+import course_stats
+import etl
+import jobs
+import learning_path
+import metrics
+import progress
+import pubsub
+import retention
+import rollups
+import search as search_module
+import serialization
+import writer
+from cache import TTLCache
+import response_cache
+from hashing import password_hasher
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, NEXT_CURSOR_HEADER, TOTAL_COUNT_HEADER, count_cache, fetch_page, set_total_count
 
 # Настройки приложения
 SECRET_KEY = "your-secret-key-here"  # В продакшене использовать переменные окружения
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Интервал комментариев-пингов в потоке прогресса (SSE), чтобы прокси не закрывали соединение
+PROGRESS_KEEPALIVE = float(os.getenv("PROGRESS_KEEPALIVE", "15"))
+
+# Кэш аутентифицированных пользователей и проверенных JWT
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "300"))
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/token")
 
 app = FastAPI(
     title="Online Courses Platform",
     description="Educational platform with course management and analytics",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
@@ -42,7 +71,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, TOTAL_COUNT_HEADER, metrics.PROFILE_ID_HEADER, "Server-Timing"],
 )
+# Метрики запросов: добавлен последним, поэтому внешний и учитывает все время ответа
+app.add_middleware(metrics.MetricsMiddleware)
 
 # Статические файлы и шаблоны
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -88,6 +120,16 @@ class Course(BaseModel):
     class Config:
         from_attributes = True
 
+class CourseSummary(BaseModel):
+    """Курс в списках: вместо описания - его начало"""
+    id: int
+    title: str
+    description_preview: Optional[str] = None
+    category: str
+    level: str
+    teacher_id: int
+    created_at: datetime
+
 class CourseCreate(BaseModel):
     title: str
     description: Optional[str] = None
@@ -112,6 +154,16 @@ class Material(BaseModel):
     class Config:
         from_attributes = True
 
+class MaterialSummary(BaseModel):
+    """Материал в списках: без текста урока, только начало и длина"""
+    id: int
+    course_id: int
+    title: str
+    type: str
+    order_index: int = 0
+    content_preview: Optional[str] = None
+    content_length: int = 0
+
 class MaterialCreate(BaseModel):
     course_id: int
     title: str
@@ -146,6 +198,38 @@ class ActivityCreate(BaseModel):
     score: Optional[float] = None
     meta: Optional[Dict[str, Any]] = None
 
+class ActivityBatchCreate(BaseModel):
+    activities: List[ActivityCreate] = Field(min_length=1, max_length=1000)
+
+class ActivityBatchResult(BaseModel):
+    accepted: int
+    ids: Optional[List[int]] = None
+
+class LearningPathState(BaseModel):
+    course_id: int
+    course_title: str
+    last_material_id: Optional[int] = None
+    # None - все материалы курса пройдены
+    next_material_id: Optional[int] = None
+    next_material_title: Optional[str] = None
+    next_material_type: Optional[str] = None
+    completed: str = Field(description="Hex bitmap: bit i % 8 of byte i // 8 is material i in course order")
+    completed_count: int
+    total_materials: int
+    last_activity_at: Optional[datetime] = None
+
+# Профили загрузки: списки выбирают сводку без тяжелых Text-колонок, карточки - все поля
+COURSE_SUMMARY_COLUMNS = serialization.model_columns(
+    DBCourse, CourseSummary, description_preview=serialization.preview(DBCourse.description)
+)
+COURSE_DETAIL_COLUMNS = serialization.model_columns(DBCourse, Course)
+MATERIAL_SUMMARY_COLUMNS = serialization.model_columns(
+    DBMaterial, MaterialSummary,
+    content_preview=serialization.preview(DBMaterial.content),
+    content_length=serialization.text_length(DBMaterial.content)
+)
+MATERIAL_DETAIL_COLUMNS = serialization.model_columns(DBMaterial, Material)
+
 # Dependency functions
 async def get_db():
     async with SessionLocal() as session:
@@ -157,11 +241,17 @@ async def get_db():
         finally:
             await session.close()
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def get_read_db():
+    """Сессия из пула только для чтения (не ждет записи в режиме WAL)"""
+    async with ReadSessionLocal() as session:
+        yield session
+
+# bcrypt выполняется в пуле воркеров, чтобы не блокировать event loop
+async def verify_password(plain_password, hashed_password):
+    return await password_hasher.verify(plain_password, hashed_password)
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    return await password_hasher.hash(password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -169,26 +259,168 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+@dataclass(frozen=True)
+class CurrentUser:
+    """Неизменяемый снимок пользователя, безопасный для хранения в кэше между запросами"""
+    id: int
+    name: str
+    email: Optional[str]
+    role: str
+    is_active: bool
+    created_at: datetime
+
+    @classmethod
+    def from_db(cls, user: DBUser) -> "CurrentUser":
+        return cls(
+            id=user.id, name=user.name, email=user.email, role=user.role,
+            is_active=bool(user.is_active), created_at=user.created_at
+        )
+
+user_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+token_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+def invalidate_user(user_id: int):
+    user_cache.invalidate(user_id)
+
+# Сбросы кэшей пользователей и X-Total-Count рассылаются через pubsub: в многопроцессном режиме
+# записи выполняет процесс записи, а кэши держит каждый воркер API
+CACHE_TOPIC = "cache"
+_invalidation_tasks: Set[asyncio.Task] = set()
+
+def apply_cache_invalidation(message: Dict[str, Any]):
+    for user_id in message["users"]:
+        invalidate_user(user_id)
+    if message["counts"]:
+        count_cache.clear()
+
+async def invalidate_caches(users: Iterable[int] = (), counts: bool = False):
+    """Сбрасывает кэши в этом процессе и в остальных процессах"""
+    message = {"users": list(users), "counts": counts}
+    apply_cache_invalidation(message)
+    await pubsub.hub.publish(CACHE_TOPIC, message)
+
+async def consume_cache_invalidations():
+    with pubsub.hub.subscribe(CACHE_TOPIC) as subscription:
+        while True:
+            message = await subscription.get()
+            if subscription.lagged:
+                # Часть сбросов отброшена - сбрасываем все
+                subscription.lagged = False
+                user_cache.clear()
+                count_cache.clear()
+            if message is not None:
+                apply_cache_invalidation(message)
+
+# Любое изменение или удаление пользователя через ORM сбрасывает его запись в кэше после коммита
+@event.listens_for(DBUser, "after_update")
+@event.listens_for(DBUser, "after_delete")
+def _invalidate_user_on_change(mapper, connection, target):
+    session = object_session(target)
+    if session is None:
+        invalidate_user(target.id)
+    else:
+        session.info.setdefault("invalidated_users", set()).add(target.id)
+
+@event.listens_for(Session, "after_commit")
+def _publish_user_invalidation(session):
+    user_ids = session.info.pop("invalidated_users", None)
+    if not user_ids:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        for user_id in user_ids:
+            invalidate_user(user_id)
+        return
+    task = loop.create_task(invalidate_caches(users=user_ids))
+    _invalidation_tasks.add(task)
+    task.add_done_callback(_invalidation_tasks.discard)
+
+@event.listens_for(Session, "after_rollback")
+def _forget_user_invalidation(session):
+    session.info.pop("invalidated_users", None)
+
+def decode_token(token: str) -> int:
+    """Проверяет JWT и возвращает id пользователя; результат кэшируется до exp токена"""
+    user_id = token_cache.get(token)
+    if user_id is not None:
+        return user_id
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    user_id = int(payload["sub"])
+    token_cache.set(token, user_id, ttl=payload["exp"] - time.time())
+    return user_id
+
+async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: int = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
-    except JWTError:
+        user_id = decode_token(token)
+    except (JWTError, KeyError, ValueError):
         raise credentials_exception
     
-    result = await db.execute(select(DBUser).where(DBUser.id == user_id))
-    user = result.scalar_one_or_none()
+    user = user_cache.get(user_id)
     if user is None:
+        async with ReadSessionLocal() as db:
+            result = await db.execute(select(DBUser).where(DBUser.id == user_id))
+            db_user = result.scalar_one_or_none()
+        if db_user is None:
+            raise credentials_exception
+        user = CurrentUser.from_db(db_user)
+        user_cache.set(user_id, user)
+    if not user.is_active:
         raise credentials_exception
     return user
 
+def progress_topic(user_id: int) -> str:
+    return f"user:{user_id}:progress"
+
+async def publish_progress(session: AsyncSession, rows: List[Dict[str, Any]]):
+    """Рассылает изменения прогресса от записанной пачки; считаются только для пользователей с подписчиками"""
+    rows = [row for row in rows if row.get("user_id") is not None
+            and pubsub.hub.should_publish(progress_topic(row["user_id"]))]
+    if not rows:
+        return
+    deltas = await progress.progress_deltas(session, rows)
+    for user_id, courses in deltas.items():
+        await pubsub.hub.publish(progress_topic(user_id), {
+            "courses": courses,
+            "last_activity_id": max(course["last_activity_id"] for course in courses),
+        })
+
+async def progress_snapshot(user_id: int):
+    """(last_activity_id, прогресс): прогресс ровно по событиям с id <= last_activity_id"""
+    if analytics_engine.ANALYTICS_BACKEND == "snapshot":
+        snapshot = analytics_engine.snapshot
+        return snapshot.last_id, snapshot.user_progress(user_id)
+    async with ReadSessionLocal() as db:
+        last_id = await db.scalar(select(func.max(DBActivity.id))) or 0
+        return last_id, await progress.get_user_progress(db, user_id, until_id=last_id)
+
+def sse_event(event: str, data: Any, event_id: Optional[int] = None) -> bytes:
+    head = f"event: {event}\n" + (f"id: {event_id}\n" if event_id is not None else "")
+    return head.encode() + b"data: " + serialization.dumps(data) + b"\n\n"
+
+async def progress_events(user_id: int):
+    """snapshot, затем delta по каждой записанной пачке; события, уже вошедшие в снимок, пропускаются"""
+    # Подписка до снимка: изменения между снимком и подпиской не теряются
+    with pubsub.hub.subscribe(progress_topic(user_id)) as subscription:
+        last_id, snapshot = await progress_snapshot(user_id)
+        yield sse_event("snapshot", {"progress": snapshot, "last_activity_id": last_id}, last_id)
+        while True:
+            message = await subscription.get(PROGRESS_KEEPALIVE)
+            if subscription.lagged:
+                # Часть изменений отброшена - клиент получает состояние заново
+                subscription.lagged = False
+                last_id, snapshot = await progress_snapshot(user_id)
+                yield sse_event("snapshot", {"progress": snapshot, "last_activity_id": last_id}, last_id)
+            if message is None:
+                yield b": ping\n\n"
+            elif message["last_activity_id"] > last_id:
+                yield sse_event("delta", message, message["last_activity_id"])
+
 def require_role(*roles):
     async def role_checker(current_user: DBUser = Depends(get_current_user)):
         if current_user.role not in roles:
@@ -196,6 +428,146 @@ def require_role(*roles):
         return current_user
     return role_checker
 
+# Жизненный цикл приложения
+# Агрегаты, которые обновляются в транзакции записи пачки активности
+ingestor.add_flush_hook(course_stats.apply_activities)
+ingestor.add_flush_hook(rollups.apply_activities)
+ingestor.add_flush_hook(learning_path.apply_activities)
+# Push прогресса подписчикам SSE - после коммита, чтобы не держать транзакцию записи
+ingestor.add_commit_hook(publish_progress)
+
+metrics.registry.gauge("ingest_queue_depth", "Activities waiting to be written", lambda: ingestor.depth)
+metrics.registry.gauge("ingest_flushed_total", "Activities written by the ingestor",
+                       lambda: ingestor.flushed_total, kind="counter")
+metrics.registry.gauge("response_cache_hit_rate", "Catalog response cache hit rate",
+                       lambda: response_cache.store.stats()["hit_rate"])
+metrics.registry.gauge("user_cache_hit_rate", "Authenticated user cache hit rate",
+                       lambda: user_cache.stats()["hit_rate"])
+
+_cache_consumer: Optional[asyncio.Task] = None
+
+@app.on_event("startup")
+async def on_startup():
+    global _cache_consumer
+    if writer.WRITER_MODE == "remote":
+        # Схему, ingestor и фоновые задачи ведет процесс записи (writer.py)
+        pubsub.hub.broker = writer.ClientBroker(writer.get_client())
+        await pubsub.hub.start()
+    else:
+        await create_tables()
+        async with SessionLocal() as session:
+            await catalog_summary.ensure_catalog_summary(session)
+            await session.commit()
+        await ingestor.start()
+        await jobs.runner.start()
+    if analytics_engine.ANALYTICS_BACKEND == "snapshot":
+        await analytics_engine.snapshot.start()
+    _cache_consumer = asyncio.create_task(consume_cache_invalidations())
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    if _cache_consumer is not None:
+        _cache_consumer.cancel()
+    await jobs.runner.stop()
+    await ingestor.stop()
+    await analytics_engine.snapshot.stop()
+    await pubsub.hub.stop()
+    if writer.WRITER_MODE == "remote":
+        await writer.get_client().close()
+    password_hasher.shutdown()
+
+@app.exception_handler(writer.WriterUnavailable)
+async def writer_unavailable(request: Request, exc: writer.WriterUnavailable):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+# Операции записи: выполняются в этом процессе или в процессе записи (writer.py, WRITER_MODE=remote)
+@writer.operation("activities")
+async def write_activities(rows: List[Dict[str, Any]], durability: Optional[str] = None) -> Optional[List[int]]:
+    return await ingestor.submit(rows, durability=durability)
+
+@writer.operation("course")
+async def write_course(values: Dict[str, Any]) -> Dict[str, Any]:
+    async with SessionLocal() as db:
+        db_course = DBCourse(**values)
+        db.add(db_course)
+        await catalog_summary.course_created(db, db_course)
+        # id и created_at заполняются при flush; refresh не нужен (и не загрузил бы отложенное описание)
+        await db.commit()
+    await invalidate_caches(counts=True)
+    return Course.model_validate(db_course).model_dump()
+
+@writer.operation("material")
+async def write_material(values: Dict[str, Any]) -> Dict[str, Any]:
+    async with SessionLocal() as db:
+        db_material = DBMaterial(**values)
+        db.add(db_material)
+        await catalog_summary.material_created(db, db_material)
+        await db.flush()
+        await learning_path.materials_added(db, [(db_material.id, db_material.course_id)])
+        await db.commit()
+    await invalidate_caches(counts=True)
+    return Material.model_validate(db_material).model_dump()
+
+@writer.operation("user")
+async def write_user(values: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """None - email уже занят (проверка здесь, в единственном писателе, не допускает гонки)"""
+    async with SessionLocal() as db:
+        if (await db.execute(select(DBUser.id).where(DBUser.email == values["email"]))).first():
+            return None
+        db_user = DBUser(**values)
+        db.add(db_user)
+        await catalog_summary.user_created(db, db_user)
+        await db.commit()
+    await invalidate_caches(counts=True)
+    return User.model_validate(db_user).model_dump()
+
+@writer.operation("job")
+async def write_job(type: str, params: Dict[str, Any], user_id: int, priority: Optional[int]) -> Dict[str, Any]:
+    # В многопроцессном режиме задачи выполняет процесс записи: submit будит его воркеры сразу
+    async with SessionLocal() as db:
+        job = await jobs.submit(db, type, jobs.registry[type].params.model_validate(params), user_id, priority)
+    return job_status(job)
+
+@writer.operation("import_begin")
+async def write_import_begin(kind: str):
+    await bulk_import.LocalLoader(SessionLocal).begin(kind)
+
+@writer.operation("import_chunk")
+async def write_import_chunk(kind: str, chunk: List[Any]) -> Dict[str, Any]:
+    return await bulk_import.LocalLoader(SessionLocal).load(kind, chunk)
+
+@writer.operation("import_finish")
+async def write_import_finish(kind: str):
+    await bulk_import.LocalLoader(SessionLocal).finish(kind)
+    await invalidate_caches(counts=True)
+
+class WriterLoader:
+    """Шаги bulk_import.import_records как операции записи"""
+
+    async def begin(self, kind: str):
+        await writer.execute("import_begin", kind=kind)
+
+    async def load(self, kind: str, chunk) -> Dict[str, Any]:
+        # Ошибки разбора передаются текстом: исключения парсеров не обязаны сериализоваться pickle
+        chunk = [(number, ValueError(str(record)) if isinstance(record, Exception) else record)
+                 for number, record in chunk]
+        return await writer.execute("import_chunk", kind=kind, chunk=chunk)
+
+    async def finish(self, kind: str):
+        await writer.execute("import_finish", kind=kind)
+
+@writer.operation("stats")
+async def writer_stats() -> Dict[str, Any]:
+    return {
+        "ingest": {
+            "queue_depth": ingestor.depth,
+            "flushed_total": ingestor.flushed_total,
+            "batches_total": ingestor.batches_total
+        },
+        "pubsub": pubsub.hub.stats(),
+        "jobs": jobs.runner.stats()
+    }
+
 # Frontend routes
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
@@ -207,146 +579,274 @@ async def dashboard(request: Request):
 
 # Authentication endpoints
 @app.post("/register", response_model=User)
-async def register(user: UserCreate, db: AsyncSession = Depends(get_db)):
+async def register(user: UserCreate, db: AsyncSession = Depends(get_read_db)):
     # Проверяем, существует ли пользователь с таким email
     result = await db.execute(select(DBUser).where(DBUser.email == user.email))
     if result.scalar_one_or_none():
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    hashed_password = get_password_hash(user.password)
-    db_user = DBUser(
-        name=user.name,
-        email=user.email,
-        role=user.role,
-        password_hash=hashed_password
-    )
-    db.add(db_user)
-    await db.commit()
-    await db.refresh(db_user)
+    hashed_password = await get_password_hash(user.password)
+    db_user = await writer.execute("user", values={
+        "name": user.name,
+        "email": user.email,
+        "role": user.role,
+        "password_hash": hashed_password
+    })
+    if db_user is None:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    count_cache.clear()
+    response_cache.bump("users")
     return db_user
 
 @app.post("/token", response_model=Token)
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_read_db)):
     result = await db.execute(select(DBUser).where(DBUser.email == form_data.username))
     user = result.scalar_one_or_none()
-    if not user or not verify_password(form_data.password, user.password_hash):
+    if not user or not await verify_password(form_data.password, user.password_hash):
         raise HTTPException(status_code=400, detail="Incorrect email or password")
     
-    access_token = create_access_token(data={"sub": user.id})
+    access_token = create_access_token(data={"sub": str(user.id)})
     return {"access_token": access_token, "token_type": "bearer"}
 
 # User management
+# Пагинация списков: keyset по id (курсор в X-Next-Cursor), skip оставлен для совместимости
+CursorQuery = Query(None, description="Opaque cursor from the X-Next-Cursor header")
+LimitQuery = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+SkipQuery = Query(0, ge=0, deprecated=True)
+IncludeTotalQuery = Query(False, description="Return cached total in the X-Total-Count header")
+
 @app.get("/users", response_model=List[User])
 async def get_users(
-    db: AsyncSession = Depends(get_db),
+    response: Response,
+    db: AsyncSession = Depends(get_read_db),
     current_user: DBUser = Depends(require_role("admin", "teacher")),
-    skip: int = 0,
-    limit: int = 100
+    cursor: Optional[str] = CursorQuery,
+    limit: int = LimitQuery,
+    skip: int = SkipQuery,
+    include_total: bool = IncludeTotalQuery
 ):
-    result = await db.execute(select(DBUser).offset(skip).limit(limit))
-    return result.scalars().all()
+    stmt = select(*serialization.model_columns(DBUser, User))
+    if include_total:
+        await set_total_count(db, response, stmt, ("users",))
+    rows = await fetch_page(db, stmt, [DBUser.id], cursor, limit, response, skip, scalars=False)
+    return serialization.json_response(serialization.records(rows), headers=dict(response.headers))
 
 @app.get("/users/me", response_model=User)
 async def read_users_me(current_user: DBUser = Depends(get_current_user)):
     return current_user
 
+@app.get("/users/me/next", response_model=LearningPathState)
+async def get_next_material(
+    course_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: DBUser = Depends(get_current_user)
+):
+    """Где пользователь остановился: курс course_id (по умолчанию - последний) и следующий материал"""
+    state = await learning_path.get_learning_path(db, current_user.id, course_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="No activity in this course yet")
+    return state
+
+@app.get("/admin/stats")
+async def get_runtime_stats(current_user: DBUser = Depends(require_role("admin"))):
+    return {
+        "user_cache": user_cache.stats(),
+        "token_cache": token_cache.stats(),
+        "password_hashing": password_hasher.stats(),
+        "response_cache": response_cache.store.stats(),
+        "ingest": {
+            "queue_depth": ingestor.depth,
+            "flushed_total": ingestor.flushed_total,
+            "batches_total": ingestor.batches_total
+        },
+        "analytics_snapshot": analytics_engine.snapshot.stats(),
+        "archive": retention.archive_stats(),
+        "pubsub": pubsub.hub.stats(),
+        "jobs": jobs.runner.stats(),
+        # В многопроцессном режиме запись и фоновые задачи - в процессе записи
+        "writer": await writer.execute("stats") if writer.WRITER_MODE == "remote" else None
+    }
+
+@app.get("/admin/profiles/{profile_id}", response_class=PlainTextResponse)
+async def get_profile(profile_id: str, current_user: DBUser = Depends(require_role("admin"))):
+    """Стеки профилированного запроса (заголовок X-Profile) в collapsed-формате"""
+    profile = metrics.profiles.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+# Catalog
+@app.get("/catalog/summary")
+async def get_catalog_summary(request: Request, db: AsyncSession = Depends(get_read_db)):
+    """Итоги и фасеты каталога для главной страницы (без авторизации)"""
+    async def build(response: Response):
+        return await catalog_summary.get_catalog_summary(db)
+
+    return await response_cache.cached_response(request, ("courses", "materials", "users"), None, build)
+
 # Course management
-@app.get("/courses", response_model=List[Course])
+@app.get("/courses", response_model=List[CourseSummary])
 async def get_courses(
-    db: AsyncSession = Depends(get_db),
+    request: Request,
+    db: AsyncSession = Depends(get_read_db),
     current_user: DBUser = Depends(get_current_user),
-    skip: int = 0,
-    limit: int = 100,
+    cursor: Optional[str] = CursorQuery,
+    limit: int = LimitQuery,
+    skip: int = SkipQuery,
+    include_total: bool = IncludeTotalQuery,
     category: Optional[str] = None,
     level: Optional[str] = None
 ):
-    stmt = select(DBCourse).offset(skip).limit(limit)
-    if category:
-        stmt = stmt.where(DBCourse.category == category)
-    if level:
-        stmt = stmt.where(DBCourse.level == level)
+    async def build(response: Response):
+        stmt = select(*COURSE_SUMMARY_COLUMNS)
+        if category:
+            stmt = stmt.where(DBCourse.category == category)
+        if level:
+            stmt = stmt.where(DBCourse.level == level)
+        
+        if include_total:
+            await set_total_count(db, response, stmt, ("courses", category, level))
+        rows = await fetch_page(db, stmt, [DBCourse.id], cursor, limit, response, skip, scalars=False)
+        return serialization.records(rows)
     
-    result = await db.execute(stmt)
-    return result.scalars().all()
+    return await response_cache.cached_response(request, ("courses",), None, build)
 
 @app.post("/courses", response_model=Course)
 async def create_course(
     course: CourseCreate,
-    db: AsyncSession = Depends(get_db),
     current_user: DBUser = Depends(require_role("admin", "teacher"))
 ):
-    db_course = DBCourse(**course.dict())
-    db.add(db_course)
-    await db.commit()
-    await db.refresh(db_course)
+    db_course = await writer.execute("course", values=course.dict())
+    count_cache.clear()
+    response_cache.bump("courses")
     return db_course
 
 @app.get("/courses/{course_id}", response_model=Course)
 async def get_course(
     course_id: int,
-    db: AsyncSession = Depends(get_db),
+    request: Request,
+    db: AsyncSession = Depends(get_read_db),
     current_user: DBUser = Depends(get_current_user)
 ):
-    result = await db.execute(select(DBCourse).where(DBCourse.id == course_id))
-    course = result.scalar_one_or_none()
-    if not course:
-        raise HTTPException(status_code=404, detail="Course not found")
-    return course
+    async def build(response: Response):
+        result = await db.execute(
+            select(*COURSE_DETAIL_COLUMNS).where(DBCourse.id == course_id)
+        )
+        course = result.mappings().one_or_none()
+        if not course:
+            raise HTTPException(status_code=404, detail="Course not found")
+        return dict(course)
+    
+    return await response_cache.cached_response(request, ("courses",), None, build)
 
-@app.get("/courses/{course_id}/materials", response_model=List[Material])
+@app.get("/courses/{course_id}/materials", response_model=List[MaterialSummary])
 async def get_course_materials(
     course_id: int,
-    db: AsyncSession = Depends(get_db),
-    current_user: DBUser = Depends(get_current_user)
+    request: Request,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: DBUser = Depends(get_current_user),
+    cursor: Optional[str] = CursorQuery,
+    limit: int = LimitQuery,
+    include_total: bool = IncludeTotalQuery
 ):
-    result = await db.execute(
-        select(DBMaterial)
-        .where(DBMaterial.course_id == course_id)
-        .order_by(DBMaterial.order_index)
-    )
-    return result.scalars().all()
+    async def build(response: Response):
+        stmt = select(*MATERIAL_SUMMARY_COLUMNS).where(DBMaterial.course_id == course_id)
+        if include_total:
+            await set_total_count(db, response, stmt, ("materials", course_id))
+        rows = await fetch_page(db, stmt, [DBMaterial.order_index, DBMaterial.id], cursor, limit, response,
+                                scalars=False)
+        return serialization.records(rows)
+    
+    return await response_cache.cached_response(request, ("materials",), None, build)
 
 # Material management
-@app.get("/materials", response_model=List[Material])
+@app.get("/materials", response_model=List[MaterialSummary])
 async def get_materials(
-    db: AsyncSession = Depends(get_db),
+    response: Response,
+    db: AsyncSession = Depends(get_read_db),
     current_user: DBUser = Depends(get_current_user),
+    cursor: Optional[str] = CursorQuery,
+    limit: int = LimitQuery,
+    include_total: bool = IncludeTotalQuery,
     course_id: Optional[int] = None
 ):
-    stmt = select(DBMaterial)
+    stmt = select(*MATERIAL_SUMMARY_COLUMNS)
     if course_id:
         stmt = stmt.where(DBMaterial.course_id == course_id)
     
-    result = await db.execute(stmt)
-    return result.scalars().all()
+    if include_total:
+        await set_total_count(db, response, stmt, ("materials", course_id))
+    rows = await fetch_page(db, stmt, [DBMaterial.id], cursor, limit, response, scalars=False)
+    return serialization.json_response(serialization.records(rows), headers=dict(response.headers))
+
+@app.get("/materials/{material_id}", response_model=Material)
+async def get_material(
+    material_id: int,
+    request: Request,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: DBUser = Depends(get_current_user)
+):
+    async def build(response: Response):
+        result = await db.execute(select(*MATERIAL_DETAIL_COLUMNS).where(DBMaterial.id == material_id))
+        material = result.mappings().one_or_none()
+        if not material:
+            raise HTTPException(status_code=404, detail="Material not found")
+        return dict(material)
+
+    return await response_cache.cached_response(request, ("materials",), None, build)
 
 @app.post("/materials", response_model=Material)
 async def create_material(
     material: MaterialCreate,
-    db: AsyncSession = Depends(get_db),
     current_user: DBUser = Depends(require_role("admin", "teacher"))
 ):
-    db_material = DBMaterial(**material.dict())
-    db.add(db_material)
-    await db.commit()
-    await db.refresh(db_material)
+    db_material = await writer.execute("material", values=material.dict())
+    count_cache.clear()
+    response_cache.bump("materials")
     return db_material
 
 # Activity logging
+DurabilityQuery = Query(None, pattern="^(flush|enqueue)$", description="Ack after DB flush or on enqueue")
+
+async def submit_activities(rows: List[Dict[str, Any]], ack: Optional[str]):
+    for row in rows:
+        row.setdefault("timestamp", datetime.utcnow())
+    try:
+        ids = await writer.execute("activities", rows=rows, durability=ack)
+    except IngestQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    # Процесс записи проставляет id в своей копии строк
+    for row, activity_id in zip(rows, ids or ()):
+        row["id"] = activity_id
+    return ids
+
 @app.post("/activities", response_model=Activity)
 async def create_activity(
     activity: ActivityCreate,
-    db: AsyncSession = Depends(get_db),
+    ack: Optional[str] = DurabilityQuery,
     current_user: DBUser = Depends(get_current_user)
 ):
-    db_activity = DBActivity(
-        **activity.dict(),
-        timestamp=datetime.utcnow()
-    )
-    db.add(db_activity)
-    await db.commit()
-    await db.refresh(db_activity)
-    return db_activity
+    row = activity.dict()
+    ids = await submit_activities([row], ack)
+    if ids is None:
+        return JSONResponse(status_code=202, content={"accepted": 1})
+    return row
+
+@app.post("/activities/batch", response_model=ActivityBatchResult)
+async def create_activities_batch(
+    batch: ActivityBatchCreate,
+    ack: Optional[str] = DurabilityQuery,
+    current_user: DBUser = Depends(get_current_user)
+):
+    rows = [activity.dict() for activity in batch.activities]
+    ids = await submit_activities(rows, ack)
+    if ids is None:
+        return JSONResponse(status_code=202, content={"accepted": len(rows), "ids": None})
+    return {"accepted": len(rows), "ids": ids}
 
 # Search functionality
 @app.get("/search")
@@ -355,187 +855,459 @@ async def search(
     category: Optional[str] = None,
     level: Optional[str] = None,
     material_type: Optional[str] = None,
-    db: AsyncSession = Depends(get_db),
+    limit: int = Query(search_module.SEARCH_DEFAULT_LIMIT, ge=1, le=search_module.SEARCH_MAX_LIMIT),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_read_db),
     current_user: DBUser = Depends(get_current_user)
 ):
-    # Поиск курсов
-    courses_stmt = select(DBCourse)
-    if q:
-        courses_stmt = courses_stmt.where(
-            or_(
-                DBCourse.title.ilike(f"%{q}%"),
-                DBCourse.description.ilike(f"%{q}%"),
-                DBCourse.category.ilike(f"%{q}%")
-            )
-        )
-    if category:
-        courses_stmt = courses_stmt.where(DBCourse.category == category)
-    if level:
-        courses_stmt = courses_stmt.where(DBCourse.level == level)
-    
-    courses_result = await db.execute(courses_stmt)
-    courses = courses_result.scalars().all()
-    
-    # Поиск материалов
-    materials_stmt = select(DBMaterial)
-    if q:
-        materials_stmt = materials_stmt.where(
-            or_(
-                DBMaterial.title.ilike(f"%{q}%"),
-                DBMaterial.content.ilike(f"%{q}%")
-            )
-        )
-    if material_type:
-        materials_stmt = materials_stmt.where(DBMaterial.type == material_type)
-    
-    materials_result = await db.execute(materials_stmt)
-    materials = materials_result.scalars().all()
-    
-    return {
-        "courses": courses,
-        "materials": materials,
-        "total_courses": len(courses),
-        "total_materials": len(materials)
-    }
+    # Полнотекстовый поиск по индексу FTS5 с ранжированием bm25 (см. search.py)
+    if q and q.strip():
+        result = await search_module.search_catalog(db, q, category, level, material_type, limit, offset)
+    else:
+        result = await search_module.browse_catalog(db, category, level, material_type, limit, offset)
+    return serialization.json_response(result)
 
 # Analytics endpoints
 @app.get("/analytics/user/{user_id}/progress")
 async def get_user_progress(
     user_id: int,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     current_user: DBUser = Depends(get_current_user)
 ):
-    # Получаем все активности пользователя
-    stmt = select(DBActivity, DBMaterial, DBCourse).join(
-        DBMaterial, DBActivity.material_id == DBMaterial.id
-    ).join(
-        DBCourse, DBMaterial.course_id == DBCourse.id
-    ).where(DBActivity.user_id == user_id)
-    
-    result = await db.execute(stmt)
-    activities_data = result.all()
-    
-    # Группируем по курсам
-    course_progress = {}
-    for activity, material, course in activities_data:
-        if course.id not in course_progress:
-            course_progress[course.id] = {
-                "course_title": course.title,
-                "total_materials": 0,
-                "completed_materials": 0,
-                "total_time": 0.0,
-                "avg_score": 0.0,
-                "scores": []
-            }
-        
-        progress = course_progress[course.id]
-        progress["total_time"] += activity.duration or 0
-        
-        if activity.action == "complete":
-            progress["completed_materials"] += 1
-        
-        if activity.score is not None:
-            progress["scores"].append(activity.score)
-    
-    # Вычисляем процент прогресса и средние оценки
-    for course_id, progress in course_progress.items():
-        # Получаем общее количество материалов в курсе
-        materials_count_stmt = select(func.count(DBMaterial.id)).where(
-            DBMaterial.course_id == course_id
-        )
-        materials_count_result = await db.execute(materials_count_stmt)
-        total_materials = materials_count_result.scalar()
-        
-        progress["total_materials"] = total_materials
-        progress["completion_percentage"] = (
-            progress["completed_materials"] / total_materials * 100
-            if total_materials > 0 else 0
-        )
-        progress["avg_score"] = (
-            sum(progress["scores"]) / len(progress["scores"])
-            if progress["scores"] else 0
-        )
-        del progress["scores"]  # Удаляем массив оценок из ответа
-    
-    return course_progress
+    if analytics_engine.ANALYTICS_BACKEND == "snapshot":
+        return analytics_engine.snapshot.user_progress(user_id)
+    # Один сгруппированный запрос вместо цикла с count() по каждому курсу
+    return await progress.get_user_progress(db, user_id)
+
+@app.get("/analytics/user/{user_id}/progress/stream")
+async def stream_user_progress(
+    user_id: int,
+    token: str = Query(..., description="Access token (EventSource cannot send headers)")
+):
+    """Прогресс в реальном времени (Server-Sent Events): snapshot, затем delta по курсам"""
+    current_user = await get_current_user(token)
+    if current_user.id != user_id and current_user.role not in ("teacher", "admin"):
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    return StreamingResponse(
+        progress_events(user_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.get("/analytics/course/{course_id}/statistics")
 async def get_course_statistics(
     course_id: int,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
     current_user: DBUser = Depends(require_role("admin", "teacher"))
 ):
-    # Получаем все активности по курсу
-    stmt = select(DBActivity, DBMaterial).join(
-        DBMaterial, DBActivity.material_id == DBMaterial.id
-    ).where(DBMaterial.course_id == course_id)
-    
-    result = await db.execute(stmt)
-    activities_data = result.all()
-    
-    # Анализируем данные
-    unique_students = set()
-    total_time = 0.0
-    scores = []
-    completions = 0
-    
-    for activity, material in activities_data:
-        unique_students.add(activity.user_id)
-        total_time += activity.duration or 0
-        
-        if activity.score is not None:
-            scores.append(activity.score)
-        
-        if activity.action == "complete":
-            completions += 1
-    
-    return {
-        "total_students": len(unique_students),
-        "total_time_spent": total_time,
-        "average_score": sum(scores) / len(scores) if scores else 0,
-        "total_completions": completions,
-        "engagement_rate": completions / len(unique_students) if unique_students else 0
-    }
+    if analytics_engine.ANALYTICS_BACKEND == "snapshot":
+        return analytics_engine.snapshot.course_statistics(course_id)
+    # Агрегаты поддерживаются при записи активности (см. course_stats.py)
+    return await course_stats.get_course_stats(db, course_id)
+
+@app.get("/analytics/cohorts")
+async def get_cohorts(
+    course_id: Optional[int] = None,
+    period_days: int = Query(7, ge=1, le=365),
+    periods: int = Query(12, ge=1, le=104),
+    current_user: DBUser = Depends(require_role("admin", "teacher"))
+):
+    # Когорты считаются только по колоночному снимку (см. analytics_engine.py)
+    if analytics_engine.ANALYTICS_BACKEND != "snapshot":
+        raise HTTPException(status_code=501, detail="Cohort analytics requires ANALYTICS_BACKEND=snapshot")
+    return analytics_engine.snapshot.cohorts(course_id, period_days, periods)
+
+GranularityQuery = Query("day", pattern="^(hour|day)$")
+
+@app.get("/analytics/course/{course_id}/timeseries")
+async def get_course_timeseries(
+    course_id: int,
+    granularity: str = GranularityQuery,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    action: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: DBUser = Depends(require_role("admin", "teacher"))
+):
+    # Читает только агрегаты activity_rollups (см. rollups.py)
+    return await rollups.timeseries(db, granularity, course_id, since, until, action)
+
+@app.get("/analytics/platform/timeseries")
+async def get_platform_timeseries(
+    granularity: str = GranularityQuery,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    action: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: DBUser = Depends(require_role("admin", "teacher"))
+):
+    return await rollups.timeseries(db, granularity, None, since, until, action)
 
 # ETL endpoints
-@app.get("/etl/activities/export")
-async def export_activities_csv(
-    db: AsyncSession = Depends(get_db),
-    current_user: DBUser = Depends(require_role("admin"))
+EXPORT_COLUMNS = [
+    "user_id", "user_name", "user_email", "course_id", "course_title",
+    "material_id", "material_title", "material_type", "action",
+    "timestamp", "duration", "score", "meta", "activity_id"
+]
+EXPORT_FETCH_SIZE = 1000
+
+def build_export_query(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    course_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = None
 ):
-    stmt = select(DBActivity, DBUser, DBMaterial, DBCourse).join(
+    stmt = select(
+        DBUser.id, DBUser.name, DBUser.email, DBCourse.id, DBCourse.title,
+        DBMaterial.id, DBMaterial.title, DBMaterial.type, DBActivity.action,
+        DBActivity.timestamp, DBActivity.duration, DBActivity.score,
+        DBActivity.meta, DBActivity.id
+    ).join(
         DBUser, DBActivity.user_id == DBUser.id
     ).join(
         DBMaterial, DBActivity.material_id == DBMaterial.id
     ).join(
         DBCourse, DBMaterial.course_id == DBCourse.id
-    )
-    
-    result = await db.execute(stmt)
-    
+    ).order_by(DBActivity.id)
+
+    if since:
+        stmt = stmt.where(DBActivity.timestamp >= since)
+    if until:
+        stmt = stmt.where(DBActivity.timestamp < until)
+    if course_id:
+        stmt = stmt.where(DBMaterial.course_id == course_id)
+    # Keyset-пагинация: следующая выгрузка начинается после последнего activity_id
+    if after_id:
+        stmt = stmt.where(DBActivity.id > after_id)
+    if limit:
+        stmt = stmt.limit(limit)
+    return stmt.execution_options(yield_per=EXPORT_FETCH_SIZE)
+
+async def archived_export_rows(
+    session: AsyncSession,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    course_id: Optional[int] = None,
+    after_id: Optional[int] = None
+):
+    """Строки выгрузки из архивных файлов (см. retention.py) в формате EXPORT_COLUMNS"""
+    for rows in retention.iter_archived_rows(since, until, EXPORT_FETCH_SIZE):
+        if after_id:
+            rows = [row for row in rows if row["id"] > after_id]
+        if not rows:
+            continue
+        users = await session.execute(
+            select(DBUser.id, DBUser.name, DBUser.email)
+            .where(DBUser.id.in_({row["user_id"] for row in rows}))
+        )
+        users = {user_id: (name, email) for user_id, name, email in users.all()}
+        materials = await session.execute(
+            select(DBMaterial.id, DBCourse.id, DBCourse.title, DBMaterial.title, DBMaterial.type)
+            .join(DBCourse, DBMaterial.course_id == DBCourse.id)
+            .where(DBMaterial.id.in_({row["material_id"] for row in rows}))
+        )
+        materials = {material[0]: material[1:] for material in materials.all()}
+
+        export_rows = []
+        for row in rows:
+            # Как и join в build_export_query: без пользователя или материала курса строка не выгружается
+            user = users.get(row["user_id"])
+            material = materials.get(row["material_id"])
+            if user is None or material is None or (course_id and material[0] != course_id):
+                continue
+            export_rows.append([
+                row["user_id"], *user, material[0], material[1], row["material_id"], material[2], material[3],
+                row["action"], row["timestamp"], row["duration"], row["score"], row["meta"], row["id"]
+            ])
+        yield export_rows
+
+async def export_row_chunks(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    course_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = None
+):
+    """Пачки строк выгрузки (EXPORT_COLUMNS) по мере чтения из архива и БД"""
+    async with ReadSessionLocal() as session:
+        # Архивные месяцы старше горячего окна идут первыми: их id меньше
+        if retention.reaches_archive(since):
+            async for rows in archived_export_rows(session, since, until, course_id, after_id):
+                if limit is not None:
+                    rows = rows[:limit]
+                    limit -= len(rows)
+                yield rows
+                if limit == 0:
+                    return
+
+        result = await session.stream(build_export_query(since, until, course_id, after_id, limit))
+        async for rows in result.partitions():
+            yield rows
+
+async def stream_activities_csv(chunks):
+    """Отдает CSV по частям"""
     output = StringIO()
     writer = csv.writer(output)
-    writer.writerow([
-        "user_id", "user_name", "user_email", "course_id", "course_title",
-        "material_id", "material_title", "material_type", "action",
-        "timestamp", "duration", "score", "meta"
-    ])
-    
-    for activity, user, material, course in result.all():
-        writer.writerow([
-            user.id, user.name, user.email, course.id, course.title,
-            material.id, material.title, material.type, activity.action,
-            activity.timestamp, activity.duration, activity.score,
-            json.dumps(activity.meta) if activity.meta else None
-        ])
-    
-    output.seek(0)
+    writer.writerow(EXPORT_COLUMNS)
+
+    async for rows in chunks:
+        for row in rows:
+            row = list(row)
+            meta = row[12]
+            row[12] = json.dumps(meta) if meta else None
+            writer.writerow(row)
+        yield output.getvalue()
+        output.seek(0)
+        output.truncate(0)
+
+    # Пустая выгрузка: только заголовок
+    if output.tell():
+        yield output.getvalue()
+
+async def activity_records(chunks):
+    async for rows in chunks:
+        yield [dict(zip(EXPORT_COLUMNS, row)) for row in rows]
+
+@app.get("/etl/activities/export")
+async def export_activities_csv(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    course_id: Optional[int] = None,
+    after_id: Optional[int] = Query(None, description="Export activities with id greater than this"),
+    limit: Optional[int] = Query(None, ge=1),
+    format: str = Query("csv", pattern="^(csv|json)$"),
+    current_user: DBUser = Depends(require_role("admin"))
+):
+    chunks = export_row_chunks(since, until, course_id, after_id, limit)
+    if format == "json":
+        # JSON-массив объектов, кодируется orjson по пачкам EXPORT_FETCH_SIZE
+        return StreamingResponse(
+            serialization.stream_json_array(activity_records(chunks)),
+            media_type=serialization.JSON_MEDIA_TYPE,
+            headers={"Content-Disposition": "attachment; filename=activities_export.json"}
+        )
     return StreamingResponse(
-        iter([output.getvalue()]),
+        stream_activities_csv(chunks),
         media_type="text/csv",
         headers={"Content-Disposition": "attachment; filename=activities_export.csv"}
     )
 
+# Bulk import
+@app.post("/import/{kind}")
+async def import_records(
+    request: Request,
+    kind: str = Path(..., pattern="^(courses|materials|activities)$"),
+    format: Optional[str] = Query(None, pattern="^(ndjson|csv)$", description="By Content-Type if omitted"),
+    skip: int = Query(0, ge=0, description="Skip records up to this number (resume_from of a previous run)"),
+    current_user: DBUser = Depends(require_role("admin"))
+):
+    """Потоковый импорт NDJSON/CSV из тела запроса пачками (см. bulk_import.py); возвращает отчет с ошибками.
+    При complete=false импорт остановлен на неудачной пачке: повторить с skip=resume_from"""
+    fmt = format or ("csv" if "csv" in request.headers.get("content-type", "") else "ndjson")
+    records = bulk_import.iter_records(bulk_import.stream_lines(request.stream()), fmt)
+    report = await bulk_import.import_records(WriterLoader(), kind, records, skip=skip)
+    if report["inserted"]:
+        count_cache.clear()
+        response_cache.bump(*bulk_import.KINDS[kind].resources)
+    return report
+
+# Background jobs
+# Тяжелые расчеты и выгрузки выполняет JobRunner (jobs.py), а не обработчик запроса
+class ActivityExportParams(BaseModel):
+    since: Optional[datetime] = None
+    until: Optional[datetime] = None
+    course_id: Optional[int] = None
+    format: str = Field("csv", pattern="^(csv|json)$")
+
+class EtlExportParams(BaseModel):
+    by: str = Field("id", pattern="^(id|day)$")
+
+class RebuildParams(BaseModel):
+    target: str = Field(pattern="^(course_stats|rollups|learning_paths|catalog_summary|search)$")
+
+class UserProgressParams(BaseModel):
+    user_id: int
+
+class JobCreate(BaseModel):
+    type: str
+    params: Dict[str, Any] = Field(default_factory=dict)
+    priority: Optional[int] = Field(None, ge=-100, le=100, description="Admins only")
+
+class JobStatus(BaseModel):
+    id: int
+    type: str
+    status: str
+    priority: int
+    progress: float
+    message: Optional[str] = None
+    params: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    result_url: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+@jobs.job_type("activities_export", ActivityExportParams)
+async def run_activities_export(ctx: jobs.JobContext, params: ActivityExportParams):
+    """Выгрузка /etl/activities/export в файл результата"""
+    async with ReadSessionLocal() as db:
+        last_id = await db.scalar(select(func.max(DBActivity.id))) or 0
+    written = 0
+
+    async def counted(chunks):
+        nonlocal written
+        async for rows in chunks:
+            written += len(rows)
+            if rows:
+                # activity_id - последняя колонка; выгрузка идет по возрастанию id
+                ctx.progress(rows[-1][-1] / last_id if last_id else None, f"{written} rows")
+            yield rows
+
+    chunks = counted(export_row_chunks(params.since, params.until, params.course_id))
+    if params.format == "json":
+        parts = serialization.stream_json_array(activity_records(chunks))
+    else:
+        parts = stream_activities_csv(chunks)
+    with open(ctx.result_path(f".{params.format}"), "wb") as f:
+        async for part in parts:
+            f.write(part if isinstance(part, bytes) else part.encode())
+    return {"rows": written}
+
+@jobs.job_type("etl_export", EtlExportParams)
+async def run_etl_export(ctx: jobs.JobContext, params: EtlExportParams):
+    """Шардированная выгрузка в колоночные файлы ETL_DIR (etl.py); одна за раз - манифест пишет один процесс"""
+    def on_progress(done: int, total: int, rows: int):
+        ctx.progress(done / total if total else 1.0, f"{done}/{total} shards, {rows} rows")
+
+    return await etl.export_activities(
+        url=etl.session_url(ReadSessionLocal), by=params.by, workers=etl.ETL_WORKERS,
+        fmt=etl.ETL_FORMAT, directory=etl.ETL_DIR, on_progress=on_progress
+    )
+
+@jobs.job_type("rebuild", RebuildParams, priority=-10)
+async def run_rebuild(ctx: jobs.JobContext, params: RebuildParams):
+    """Полный пересчет агрегатов или поискового индекса"""
+    if params.target == "rollups":
+        await rollups.backfill(SessionLocal)
+    elif params.target == "learning_paths":
+        await learning_path.rebuild_learning_paths(SessionLocal)
+    else:
+        rebuild = {
+            "course_stats": course_stats.rebuild_course_stats,
+            "catalog_summary": catalog_summary.rebuild_catalog_summary,
+            "search": search_module.reindex_search,
+        }[params.target]
+        async with SessionLocal() as db:
+            await rebuild(db)
+            await db.commit()
+    if params.target == "catalog_summary":
+        response_cache.bump("courses", "materials", "users")
+    return {"target": params.target}
+
+@jobs.job_type("user_progress", UserProgressParams, concurrency=4, priority=10,
+               roles=("student", "teacher", "admin"), owner_param="user_id")
+async def run_user_progress(ctx: jobs.JobContext, params: UserProgressParams):
+    last_id, data = await progress_snapshot(params.user_id)
+    return {"last_activity_id": last_id, "progress": data}
+
+def job_status(job: DBJob) -> Dict[str, Any]:
+    status = JobStatus.model_validate(job, from_attributes=True).model_dump()
+    if job.status == "done":
+        status["result_url"] = f"/jobs/{job.id}/result"
+    return status
+
+async def load_job(db: AsyncSession, job_id: int, current_user: DBUser) -> DBJob:
+    job = await db.get(DBJob, job_id)
+    # Чужая задача выглядит как несуществующая
+    if job is None or (job.user_id != current_user.id and current_user.role != "admin"):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.post("/jobs", response_model=JobStatus, status_code=202)
+async def create_job(
+    job: JobCreate,
+    current_user: DBUser = Depends(get_current_user)
+):
+    spec = jobs.registry.get(job.type)
+    if spec is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job type: {job.type}")
+    if current_user.role not in spec.roles:
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    try:
+        params = spec.params.model_validate(job.params)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+    if (spec.owner_param and current_user.role not in ("teacher", "admin")
+            and getattr(params, spec.owner_param) != current_user.id):
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    priority = job.priority if current_user.role == "admin" else None
+    return await writer.execute("job", type=job.type, params=params.model_dump(mode="json"),
+                                user_id=current_user.id, priority=priority)
+
+@app.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_job(
+    job_id: int,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: DBUser = Depends(get_current_user)
+):
+    return job_status(await load_job(db, job_id, current_user))
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(
+    job_id: int,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: DBUser = Depends(get_current_user)
+):
+    """Результат выполненной задачи: файл (выгрузки) или JSON"""
+    job = await load_job(db, job_id, current_user)
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    if job.result_file:
+        if not os.path.exists(job.result_file):
+            raise HTTPException(status_code=410, detail="Result file is no longer available")
+        return FileResponse(job.result_file, filename=os.path.basename(job.result_file))
+    return job.result
+
 if __name__ == "__main__":
+    import argparse
+    import asyncio
+    import signal
+    import subprocess
+    import sys
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+
+    parser = argparse.ArgumentParser(description="Online Courses Platform API server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="API worker processes; more than one adds a single writer process")
+    args = parser.parse_args()
+
+    if args.workers <= 1:
+        uvicorn.run(app, host=args.host, port=args.port)
+    else:
+        # Отдельные интерпретаторы, а не multiprocessing: spawn заново выполнил бы этот файл
+        # как __mp_main__, и хуки ingestor регистрировались бы дважды
+        root = os.path.dirname(os.path.abspath(__file__))
+        # Кэш ответов и версии ресурсов - общий файл SQLite, который видят все воркеры
+        env = dict(os.environ, RESPONSE_CACHE_BACKEND=os.getenv("RESPONSE_CACHE_BACKEND", "sqlite"),
+                   WRITER_SOCKET=writer.WRITER_SOCKET)
+        # SIGTERM (systemd, docker stop) завершает дочерние процессы так же, как Ctrl+C
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        processes = [subprocess.Popen([sys.executable, "-m", "writer"], cwd=root, env=env)]
+        try:
+            asyncio.run(writer.wait_ready(writer.WRITER_SOCKET, alive=lambda: processes[0].poll() is None))
+            # Воркеры API только читают и передают записи процессу записи; фоновые задачи - тоже в нем
+            env.update(WRITER_MODE="remote", JOB_WORKERS="0")
+            processes.append(subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--host", args.host,
+                                               "--port", str(args.port), "--workers", str(args.workers)],
+                                              cwd=root, env=env))
+            processes[-1].wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # Сначала воркеры API, затем процесс записи: он дописывает уже принятые события
+            for process in reversed(processes):
+                process.terminate()
+                process.wait()
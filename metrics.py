@@ -0,0 +1,351 @@
+# metrics.py - Метрики запросов в формате Prometheus и выборочный профилировщик
+#
+# MetricsMiddleware на каждый HTTP-запрос записывает задержку, размер ответа, число
+# SQL-запросов и время в БД (через события before/after_cursor_execute всех движков).
+# Если один и тот же SQL выполняется за запрос N_PLUS_ONE_THRESHOLD раз и больше,
+# это считается N+1: счетчик db_n_plus_one_total и предупреждение в лог.
+#
+# Профилирование: запрос с заголовком "X-Profile: <PROFILE_TOKEN>" снимается выборочным
+# профилировщиком, в ответе приходит X-Profile-Id, стеки (collapsed-формат для
+# flamegraph.pl / speedscope) - GET /admin/profiles/{id}.
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import Headers, MutableHeaders
+
+from cache import TTLCache
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "10"))
+# Пустой токен - профилирование по заголовку выключено
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "20"))
+PROFILE_TTL = float(os.getenv("PROFILE_TTL", "3600"))
+
+PROFILE_HEADER = "x-profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+logger = logging.getLogger(__name__)
+
+
+# ---------------------------------------------------------------------------
+# Метрики и текстовый формат Prometheus
+# ---------------------------------------------------------------------------
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self.samples()
+
+
+class CounterMetric(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, labels: Tuple[str, ...] = (), amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_labels(self.label_names, key)} {_number(value)}"
+                for key, value in sorted(self.values.items())]
+
+
+class GaugeMetric(Metric):
+    """Значение задается явно или читается функцией в момент выгрузки"""
+
+    def __init__(self, name: str, help: str, function: Optional[Callable[[], float]] = None, kind: str = "gauge"):
+        super().__init__(name, help)
+        self.function = function
+        self.kind = kind
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def samples(self) -> List[str]:
+        value = self.function() if self.function else self.value
+        return [f"{self.name} {_number(value)}"]
+
+
+class HistogramMetric(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float], labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        # labels -> [счетчики по корзинам (не накопительные), сумма, количество]
+        self.series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][i] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total, count) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def gauge(self, name: str, help: str, function: Callable[[], float], kind: str = "gauge") -> GaugeMetric:
+        """Показатель, который вычисляется при каждой выгрузке (глубина очереди, размер кэша);
+        kind="counter" для уже накопленных счетчиков"""
+        return self.register(GaugeMetric(name, help, function, kind))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+ROUTE_LABELS = ("method", "route")
+requests_total = registry.register(CounterMetric(
+    "http_requests_total", "HTTP requests by route and status", ("method", "route", "status")))
+request_duration = registry.register(HistogramMetric(
+    "http_request_duration_seconds", "Request latency", LATENCY_BUCKETS, ROUTE_LABELS))
+response_size = registry.register(HistogramMetric(
+    "http_response_size_bytes", "Response body size", SIZE_BUCKETS, ROUTE_LABELS))
+requests_in_flight = registry.register(GaugeMetric(
+    "http_requests_in_flight", "Requests being processed"))
+db_queries = registry.register(HistogramMetric(
+    "db_queries_per_request", "SQL statements executed per request", QUERY_BUCKETS, ROUTE_LABELS))
+db_time = registry.register(HistogramMetric(
+    "db_time_per_request_seconds", "Time spent in SQL statements per request", LATENCY_BUCKETS, ROUTE_LABELS))
+n_plus_one = registry.register(CounterMetric(
+    "db_n_plus_one_total", f"Requests that repeated one statement {N_PLUS_ONE_THRESHOLD}+ times", ROUTE_LABELS))
+
+
+# ---------------------------------------------------------------------------
+# Учет SQL в рамках запроса
+# ---------------------------------------------------------------------------
+
+@dataclass
+class RequestStats:
+    queries: int = 0
+    db_time: float = 0.0
+    statements: Counter = field(default_factory=Counter)
+
+
+# Задается middleware; фоновые задачи (запись пачек, снимок) запросу не принадлежат
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_request.get() is not None:
+        conn.info["query_started"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current_request.get()
+    started = conn.info.pop("query_started", None)
+    if stats is None or started is None:
+        return
+    stats.queries += 1
+    stats.db_time += time.perf_counter() - started
+    stats.statements[statement] += 1
+
+
+if METRICS_ENABLED:
+    # На классе Engine: учитываются и пулы приложения, и движки, подмененные в бенчмарках
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+# ---------------------------------------------------------------------------
+# Выборочный профилировщик
+# ---------------------------------------------------------------------------
+
+class SamplingProfiler:
+    """Снимает стек потока event loop каждые interval секунд из отдельного потока.
+
+    Event loop общий, поэтому в профиль попадает и работа параллельных запросов
+    (и ожидание в select, если loop простаивает)."""
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> str:
+        self._stop.set()
+        self._thread.join()
+        return self.collapsed()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        """Строки "frame;frame;frame count" от корня к вершине стека"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+profiles = TTLCache(maxsize=PROFILE_KEEP, ttl=PROFILE_TTL)
+
+
+# ---------------------------------------------------------------------------
+# Middleware
+# ---------------------------------------------------------------------------
+
+def route_label(scope) -> str:
+    """Шаблон пути сработавшего маршрута (/courses/{course_id}), а не сам путь,
+    чтобы число рядов метрик не росло с числом id"""
+    app = scope.get("app")
+    endpoint = scope.get("endpoint")
+    if app is None or endpoint is None:
+        return "unmatched"
+    routes = getattr(app, "_metrics_routes", None)
+    if routes is None:
+        routes = {}
+        for route in app.router.routes:
+            routes[getattr(route, "endpoint", None) or getattr(route, "app", None)] = route.path
+        app._metrics_routes = routes
+    return routes.get(endpoint, "unmatched")
+
+
+class MetricsMiddleware:
+    """ASGI middleware (не BaseHTTPMiddleware: не буферизует потоковые ответы)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        profiler = None
+        profile_id = None
+        if PROFILE_TOKEN and Headers(scope=scope).get(PROFILE_HEADER) == PROFILE_TOKEN:
+            profile_id = uuid.uuid4().hex
+            profiler = SamplingProfiler(threading.get_ident())
+            profiler.start()
+
+        started = time.perf_counter()
+        status = 500
+        size = 0
+
+        async def send_with_metrics(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = MutableHeaders(scope=message)
+                # Для потоковых ответов - время до первого байта
+                headers.append("Server-Timing", f"db;dur={stats.db_time * 1000:.1f};desc=\"{stats.queries} queries\", "
+                                                f"app;dur={(time.perf_counter() - started) * 1000:.1f}")
+                if profile_id:
+                    headers.append(PROFILE_ID_HEADER, profile_id)
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        requests_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            elapsed = time.perf_counter() - started
+            requests_in_flight.dec()
+            current_request.reset(token)
+            if profiler is not None:
+                profiles.set(profile_id, profiler.stop())
+            self.record(scope, stats, status, size, elapsed)
+
+    @staticmethod
+    def record(scope, stats: RequestStats, status: int, size: int, elapsed: float):
+        labels = (scope["method"], route_label(scope))
+        requests_total.inc(labels + (str(status),))
+        request_duration.observe(labels, elapsed)
+        response_size.observe(labels, size)
+        db_queries.observe(labels, stats.queries)
+        db_time.observe(labels, stats.db_time)
+        if stats.statements:
+            statement, count = stats.statements.most_common(1)[0]
+            if count >= N_PLUS_ONE_THRESHOLD:
+                n_plus_one.inc(labels)
+                logger.warning("Possible N+1 in %s %s: statement executed %d times: %s",
+                               labels[0], labels[1], count, " ".join(statement.split())[:300])
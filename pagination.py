@@ -0,0 +1,84 @@
+# pagination.py - Keyset (cursor) пагинация для списочных эндпоинтов
+import base64
+import json
+import os
+from typing import Any, List, Optional, Sequence
+
+from fastapi import HTTPException, Response
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cache import TTLCache
+
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "50"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "200"))
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+TOTAL_COUNT_HEADER = "X-Total-Count"
+
+# Кэш count(*) по (таблица, фильтры); сбрасывается при создании записей
+count_cache = TTLCache(maxsize=256, ttl=float(os.getenv("COUNT_CACHE_TTL", "60")))
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    raw = json.dumps(list(values), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> List[Any]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # Значения попадают в SQL как параметры: допускаем только скаляры ключей страницы
+    if (
+        not isinstance(values, list)
+        or len(values) != size
+        or any(isinstance(v, bool) or not isinstance(v, (int, float, str)) for v in values)
+    ):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+def apply_cursor(stmt, columns, cursor: Optional[str]):
+    """Добавляет к запросу порядок по columns и условие "после курсора" """
+    if cursor:
+        values = decode_cursor(cursor, len(columns))
+        if len(columns) == 1:
+            stmt = stmt.where(columns[0] > values[0])
+        else:
+            stmt = stmt.where(tuple_(*columns) > tuple_(*values))
+    return stmt.order_by(*columns)
+
+
+async def fetch_page(
+    db: AsyncSession,
+    stmt,
+    columns,
+    cursor: Optional[str],
+    limit: int,
+    response: Response,
+    skip: int = 0,
+    scalars: bool = True,
+):
+    """Выбирает страницу и выставляет заголовок X-Next-Cursor, если есть продолжение.
+    scalars=False - для select(колонки): возвращаются строки, колонки курсора должны быть среди выбранных"""
+    stmt = apply_cursor(stmt, columns, cursor)
+    if skip and not cursor:
+        stmt = stmt.offset(skip)
+    result = await db.execute(stmt.limit(limit + 1))
+    items = result.scalars().all() if scalars else result.all()
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor([getattr(last, c.key) for c in columns])
+    return items
+
+
+async def set_total_count(db: AsyncSession, response: Response, stmt, cache_key):
+    """X-Total-Count из кэшированного счетчика, count(*) только при промахе"""
+    total = count_cache.get(cache_key)
+    if total is None:
+        total = await db.scalar(select(func.count()).select_from(stmt.subquery()))
+        count_cache.set(cache_key, total)
+    response.headers[TOTAL_COUNT_HEADER] = str(total)
@@ -0,0 +1,150 @@
+# progress.py - Прогресс пользователя по курсам одним SQL-запросом
+#
+# События, перенесенные в архив (retention.py), учитываются через archived_progress - вклад
+# архива по материалу, который переносится туда в транзакции удаления из activities.
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import case, func, select, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db import Activity, ArchivedProgress, Course, Material
+
+
+def course_material_count():
+    """Количество материалов курса - коррелированный подзапрос к Course"""
+    return (
+        select(func.count(Material.id))
+        .where(Material.course_id == Course.id)
+        .correlate(Course)
+        .scalar_subquery()
+    )
+
+
+def user_progress_query(user_id: int, until_id: Optional[int] = None):
+    # События горячего окна и строки archived_progress в одном виде: материал, завершенный материал
+    # (NULL, если не завершен), длительность, сумма и число оценок
+    hot = select(
+        Activity.material_id.label("material_id"),
+        case((Activity.action == "complete", Activity.material_id)).label("completed_material"),
+        Activity.duration.label("duration"),
+        Activity.score.label("score_sum"),
+        case((Activity.score.is_not(None), 1), else_=0).label("score_count"),
+    ).where(Activity.user_id == user_id)
+    if until_id is not None:
+        hot = hot.where(Activity.id <= until_id)
+    archived = select(
+        ArchivedProgress.material_id,
+        case((ArchivedProgress.completed > 0, ArchivedProgress.material_id)),
+        ArchivedProgress.duration_sum,
+        ArchivedProgress.score_sum,
+        ArchivedProgress.score_count,
+    ).where(ArchivedProgress.user_id == user_id)
+    events = union_all(hot, archived).subquery()
+
+    # Количество материалов курса считается коррелированным подзапросом в той же выборке
+    total_materials = course_material_count()
+    return (
+        select(
+            Course.id,
+            Course.title,
+            total_materials.label("total_materials"),
+            # Повторные "complete" по одному материалу считаются один раз
+            func.count(func.distinct(events.c.completed_material)).label("completed_materials"),
+            func.coalesce(func.sum(events.c.duration), 0.0).label("total_time"),
+            func.sum(events.c.score_sum).label("score_sum"),
+            func.sum(events.c.score_count).label("score_count"),
+        )
+        .select_from(events)
+        .join(Material, events.c.material_id == Material.id)
+        .join(Course, Material.course_id == Course.id)
+        .group_by(Course.id, Course.title)
+    )
+
+
+async def get_user_progress(
+    session: AsyncSession, user_id: int, until_id: Optional[int] = None
+) -> Dict[int, Dict[str, Any]]:
+    """Прогресс по курсам; until_id - только события с id <= until_id (согласованный снимок для SSE)"""
+    result = await session.execute(user_progress_query(user_id, until_id))
+
+    course_progress = {}
+    for course_id, title, total_materials, completed, total_time, score_sum, score_count in result.all():
+        course_progress[course_id] = {
+            "course_title": title,
+            "total_materials": total_materials,
+            "completed_materials": completed,
+            "total_time": total_time,
+            "avg_score": score_sum / score_count if score_count else 0,
+            "score_count": score_count,
+            "completion_percentage": completed / total_materials * 100 if total_materials else 0,
+        }
+    return course_progress
+
+
+async def progress_deltas(session: AsyncSession, rows: List[Dict[str, Any]]) -> Dict[int, List[Dict[str, Any]]]:
+    """Изменения прогресса по курсам от пачки записанных событий (rows с id), по пользователям.
+
+    completed_materials - только материалы, завершенные впервые: повторный "complete"
+    (в пачке или раньше, с меньшим id) прогресс не увеличивает."""
+    rows = [row for row in rows if row.get("user_id") is not None and row.get("material_id") is not None]
+    if not rows:
+        return {}
+    materials = await session.execute(
+        select(Material.id, Material.course_id).where(Material.id.in_({row["material_id"] for row in rows}))
+    )
+    material_course = dict(materials.all())
+
+    completes = {(row["user_id"], row["material_id"]) for row in rows if row.get("action") == "complete"}
+    seen = set()
+    if completes:
+        # Два IN вместо tuple IN (см. course_stats); лишние пары отсекаются по completes
+        previous = await session.execute(
+            select(Activity.user_id, Activity.material_id).where(
+                Activity.user_id.in_({user_id for user_id, _ in completes}),
+                Activity.material_id.in_({material_id for _, material_id in completes}),
+                Activity.action == "complete",
+                Activity.id < min(row["id"] for row in rows),
+            ).distinct()
+        )
+        archived = await session.execute(
+            select(ArchivedProgress.user_id, ArchivedProgress.material_id).where(
+                ArchivedProgress.user_id.in_({user_id for user_id, _ in completes}),
+                ArchivedProgress.material_id.in_({material_id for _, material_id in completes}),
+                ArchivedProgress.completed > 0,
+            )
+        )
+        seen = (set(previous.all()) | set(archived.all())) & completes
+
+    deltas = defaultdict(lambda: {"events": 0, "time_spent": 0.0, "score_sum": 0.0, "score_count": 0,
+                                  "completed_materials": 0, "last_activity_id": 0})
+    for row in rows:
+        course_id = material_course.get(row["material_id"])
+        if course_id is None:
+            continue
+        delta = deltas[(row["user_id"], course_id)]
+        delta["events"] += 1
+        delta["time_spent"] += row.get("duration") or 0
+        if row.get("score") is not None:
+            delta["score_sum"] += row["score"]
+            delta["score_count"] += 1
+        pair = (row["user_id"], row["material_id"])
+        if row.get("action") == "complete" and pair not in seen:
+            seen.add(pair)
+            delta["completed_materials"] += 1
+        delta["last_activity_id"] = max(delta["last_activity_id"], row["id"])
+    if not deltas:
+        return {}
+
+    # Название и размер курса - чтобы клиент мог показать курс, которого еще не было в прогрессе
+    courses = await session.execute(
+        select(Course.id, Course.title, course_material_count())
+        .where(Course.id.in_({course_id for _, course_id in deltas}))
+    )
+    courses = {course_id: (title, total) for course_id, title, total in courses.all()}
+
+    by_user = defaultdict(list)
+    for (user_id, course_id), delta in deltas.items():
+        title, total = courses.get(course_id, (None, 0))
+        by_user[user_id].append({"course_id": course_id, "course_title": title, "total_materials": total, **delta})
+    return dict(by_user)
@@ -0,0 +1,136 @@
+# pubsub.py - Pub/sub для push-уведомлений (SSE) внутри процесса
+#
+# Hub раздает сообщения подписчикам темы через ограниченные очереди. Доставка идет через
+# брокер: MemoryBroker передает сообщение сразу в тот же процесс. Брокер между процессами
+# (локальный сокет процесса записи - writer.py, Redis, NATS) реализует тот же интерфейс -
+# start(deliver), publish, stop, interested, watch/unwatch - и вызывает deliver(topic, message)
+# при получении сообщения.
+import asyncio
+import os
+from collections import defaultdict
+from typing import Any, Callable, Dict, Optional, Set
+
+PUBSUB_QUEUE_SIZE = int(os.getenv("PUBSUB_QUEUE_SIZE", "100"))
+
+Deliver = Callable[[str, Any], None]
+
+
+class Subscription:
+    """Очередь сообщений одного подписчика. Если подписчик не успевает читать, старые
+    сообщения отбрасываются и выставляется lagged: клиенту нужно перечитать состояние целиком"""
+
+    def __init__(self, hub: "Hub", topic: str, maxsize: int):
+        self.hub = hub
+        self.topic = topic
+        self.lagged = False
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+
+    def put(self, message: Any):
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.lagged = True
+        self._queue.put_nowait(message)
+
+    async def get(self, timeout: Optional[float] = None) -> Any:
+        """Следующее сообщение; None, если за timeout сообщений не было"""
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+    def __enter__(self) -> "Subscription":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MemoryBroker:
+    """Доставка внутри процесса"""
+
+    def __init__(self):
+        self._deliver: Optional[Deliver] = None
+
+    async def start(self, deliver: Deliver):
+        self._deliver = deliver
+
+    async def publish(self, topic: str, message: Any):
+        if self._deliver is not None:
+            self._deliver(topic, message)
+
+    async def stop(self):
+        self._deliver = None
+
+    def interested(self, topic: str) -> bool:
+        """Есть ли подписчики темы вне этого Hub"""
+        return False
+
+    def watch(self, topic: str):
+        """У темы появился первый подписчик в этом Hub"""
+
+    def unwatch(self, topic: str):
+        """У темы не осталось подписчиков в этом Hub"""
+
+
+class Hub:
+    def __init__(self, broker=None, queue_size: int = PUBSUB_QUEUE_SIZE):
+        self.broker = broker or MemoryBroker()
+        self.queue_size = queue_size
+        self._subscribers: Dict[str, Set[Subscription]] = defaultdict(set)
+        self._started = False
+        self.published_total = 0
+        self.delivered_total = 0
+
+    async def start(self):
+        if not self._started:
+            await self.broker.start(self._deliver)
+            self._started = True
+
+    async def stop(self):
+        if self._started:
+            await self.broker.stop()
+            self._started = False
+
+    def subscribe(self, topic: str) -> Subscription:
+        subscription = Subscription(self, topic, self.queue_size)
+        if topic not in self._subscribers:
+            self.broker.watch(topic)
+        self._subscribers[topic].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscribers = self._subscribers.get(subscription.topic)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.topic]
+                self.broker.unwatch(subscription.topic)
+
+    def should_publish(self, topic: str) -> bool:
+        """Стоит ли готовить сообщение: есть подписчики здесь или у других процессов брокера"""
+        return topic in self._subscribers or self.broker.interested(topic)
+
+    async def publish(self, topic: str, message: Any):
+        await self.start()
+        self.published_total += 1
+        await self.broker.publish(topic, message)
+
+    def _deliver(self, topic: str, message: Any):
+        for subscription in list(self._subscribers.get(topic, ())):
+            subscription.put(message)
+            self.delivered_total += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "broker": type(self.broker).__name__,
+            "topics": len(self._subscribers),
+            "subscribers": sum(len(s) for s in self._subscribers.values()),
+            "published_total": self.published_total,
+            "delivered_total": self.delivered_total,
+        }
+
+
+hub = Hub()
@@ -0,0 +1,200 @@
+# response_cache.py - Кэш ответов каталога с ETag и версиями ресурсов
+#
+# Ключ кэша = путь + параметры запроса + текущие версии ресурсов, от которых зависит ответ.
+# create_course/create_material увеличивают версию ресурса, и старые записи перестают
+# находиться (их вытесняет LRU или TTL).
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence
+
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+
+from cache import TTLCache
+import serialization
+
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory")  # memory | sqlite
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "./response_cache.sqlite3")
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "2048"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+RESPONSE_CACHE_MAX_AGE = int(os.getenv("RESPONSE_CACHE_MAX_AGE", "0"))
+
+# Заголовки ответа, которые сохраняются вместе с телом (пагинация)
+CACHED_HEADERS = ("x-next-cursor", "x-total-count")
+
+
+@dataclass
+class CacheEntry:
+    body: bytes
+    etag: str
+    headers: Dict[str, str]
+
+
+class MemoryStore:
+    """LRU в памяти процесса"""
+
+    def __init__(self, maxsize: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL):
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._versions: Dict[str, int] = {}
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        return self._entries.get(key)
+
+    def set(self, key: str, entry: CacheEntry):
+        self._entries.set(key, entry)
+
+    def get_version(self, resource: str) -> int:
+        return self._versions.get(resource, 0)
+
+    def bump_version(self, resource: str) -> int:
+        self._versions[resource] = self._versions.get(resource, 0) + 1
+        return self._versions[resource]
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "memory", **self._entries.stats(), "versions": dict(self._versions)}
+
+
+class SQLiteStore:
+    """Локальная замена общего кэша: файл SQLite, который видят все процессы на машине"""
+
+    def __init__(self, path: str = RESPONSE_CACHE_PATH, maxsize: int = RESPONSE_CACHE_SIZE,
+                 ttl: float = RESPONSE_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=1000")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY, body BLOB, etag TEXT, headers TEXT, expires_at REAL, used_at REAL
+        )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_used_at ON entries (used_at)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS versions (resource TEXT PRIMARY KEY, version INTEGER)")
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        now = time.time()
+        row = self._conn.execute(
+            "SELECT body, etag, headers FROM entries WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._conn.execute("UPDATE entries SET used_at = ? WHERE key = ?", (now, key))
+        return CacheEntry(body=row[0], etag=row[1], headers=json.loads(row[2]))
+
+    def set(self, key: str, entry: CacheEntry):
+        now = time.time()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+            (key, entry.body, entry.etag, json.dumps(entry.headers), now + self.ttl, now)
+        )
+        # Вытесняем давно не использованные записи сверх лимита
+        self._conn.execute(
+            "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+            (self.maxsize,)
+        )
+
+    def get_version(self, resource: str) -> int:
+        row = self._conn.execute("SELECT version FROM versions WHERE resource = ?", (resource,)).fetchone()
+        return row[0] if row else 0
+
+    def bump_version(self, resource: str) -> int:
+        self._conn.execute(
+            "INSERT INTO versions VALUES (?, 1) ON CONFLICT(resource) DO UPDATE SET version = version + 1",
+            (resource,)
+        )
+        return self.get_version(resource)
+
+    def clear(self):
+        self._conn.execute("DELETE FROM entries")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": "sqlite",
+            "size": self._conn.execute("SELECT count(*) FROM entries").fetchone()[0],
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "versions": dict(self._conn.execute("SELECT resource, version FROM versions").fetchall()),
+        }
+
+
+def create_store(backend: str = RESPONSE_CACHE_BACKEND):
+    if backend == "memory":
+        return MemoryStore()
+    if backend == "sqlite":
+        return SQLiteStore()
+    raise ValueError(f"Unknown response cache backend: {backend}")
+
+
+store = create_store()
+
+
+def bump(*resources: str):
+    """Инвалидирует закэшированные ответы, зависящие от ресурсов"""
+    for resource in resources:
+        store.bump_version(resource)
+
+
+def cache_key(request: Request, resources: Sequence[str]) -> str:
+    params = "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
+    versions = ",".join(f"{r}:{store.get_version(r)}" for r in resources)
+    return f"{request.url.path}?{params}|{versions}"
+
+
+@lru_cache(maxsize=None)
+def type_adapter(response_model: Any) -> TypeAdapter:
+    return TypeAdapter(response_model)
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return header.strip() == "*" or etag in [tag.strip() for tag in header.split(",")]
+
+
+async def cached_response(
+    request: Request,
+    resources: Sequence[str],
+    response_model: Any,
+    build: Callable[[Response], Awaitable[Any]],
+) -> Response:
+    """Отдает ответ из кэша (или 304 по If-None-Match); при промахе вызывает build(response)
+    и сериализует результат через response_model. response_model=None - build уже вернул
+    dict/list из колонок, они кодируются orjson без валидации"""
+    key = cache_key(request, resources)
+    entry = store.get(key)
+    if entry is None:
+        sub_response = Response()
+        data = await build(sub_response)
+        if response_model is None:
+            body = serialization.dumps(data)
+        else:
+            adapter = type_adapter(response_model)
+            body = adapter.dump_json(adapter.validate_python(data, from_attributes=True))
+        headers = {k: v for k, v in sub_response.headers.items() if k in CACHED_HEADERS}
+        entry = CacheEntry(body=body, etag=f'"{hashlib.sha1(body).hexdigest()}"', headers=headers)
+        store.set(key, entry)
+
+    headers = {
+        **entry.headers,
+        "ETag": entry.etag,
+        "Cache-Control": f"private, max-age={RESPONSE_CACHE_MAX_AGE}, must-revalidate",
+    }
+    if etag_matches(request, entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
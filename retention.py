@@ -0,0 +1,414 @@
+# retention.py - Хранение activities: горячее окно в БД, старые месяцы в архивных файлах
+#
+# Архивация: python retention.py archive [--days N] [--format npz|csv]
+# Список архивов: python retention.py list
+# Пересчет archived_progress по архивным файлам: python retention.py rebuild
+#
+# События старше окна (с точностью до месяца) выгружаются в archive/activities-YYYY-MM.npz
+# (сжатые колонки NumPy) или activities-YYYY-MM.csv.gz и удаляются из activities пачками.
+# activity_rollups и course_stats не трогаются: они уже содержат вклад архивных событий.
+# Для SQL-расчета прогресса вклад удаленных событий переносится в archived_progress в той же
+# транзакции, что и удаление.
+import argparse
+import asyncio
+import csv
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db import create_tables, SessionLocal, Activity, ArchivedProgress
+
+ACTIVITY_RETENTION_DAYS = int(os.getenv("ACTIVITY_RETENTION_DAYS", "365"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "./archive")
+ARCHIVE_FORMAT = os.getenv("ARCHIVE_FORMAT", "npz")  # npz | csv
+RETENTION_BATCH = int(os.getenv("RETENTION_BATCH", "5000"))
+# Пауза между пачками удаления, чтобы не держать блокировку записи подряд
+RETENTION_PAUSE = float(os.getenv("RETENTION_PAUSE", "0.05"))
+
+ARCHIVE_COLUMNS = ("id", "user_id", "material_id", "action", "timestamp", "duration", "score", "meta")
+EXTENSIONS = {"npz": ".npz", "csv": ".csv.gz"}
+MANIFEST = "manifest.json"
+
+
+def month_start(value: datetime) -> datetime:
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(value: datetime) -> datetime:
+    if value.month == 12:
+        return value.replace(year=value.year + 1, month=1)
+    return value.replace(month=value.month + 1)
+
+
+def retention_cutoff(days: int = ACTIVITY_RETENTION_DAYS, now: Optional[datetime] = None) -> datetime:
+    """Начало месяца, в который попадает граница окна: архивируются только целые месяцы"""
+    now = now or datetime.utcnow()
+    return month_start(now - timedelta(days=days))
+
+
+# Формат файлов: колонки как NumPy-массивы; NULL - это -1 для id, NaN для чисел и "" для строк
+
+def rows_to_columns(rows: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    return {
+        "id": np.array([r["id"] for r in rows], np.int64),
+        "user_id": np.array([-1 if r["user_id"] is None else r["user_id"] for r in rows], np.int64),
+        "material_id": np.array([-1 if r["material_id"] is None else r["material_id"] for r in rows], np.int64),
+        "action": np.array([r["action"] or "" for r in rows], dtype=str),
+        "timestamp": np.array([r["timestamp"] for r in rows], "datetime64[us]"),
+        "duration": np.array([r["duration"] for r in rows], np.float64),
+        "score": np.array([r["score"] for r in rows], np.float64),
+        "meta": np.array([json.dumps(r["meta"]) if r["meta"] else "" for r in rows], dtype=str),
+    }
+
+
+def columns_to_rows(columns: Dict[str, np.ndarray]) -> List[Dict[str, Any]]:
+    rows = []
+    for id_, user_id, material_id, action, timestamp, duration, score, meta in zip(
+        columns["id"].tolist(), columns["user_id"].tolist(), columns["material_id"].tolist(),
+        columns["action"].tolist(), columns["timestamp"].astype(object), columns["duration"].tolist(),
+        columns["score"].tolist(), columns["meta"].tolist(),
+    ):
+        rows.append({
+            "id": id_,
+            "user_id": None if user_id < 0 else user_id,
+            "material_id": None if material_id < 0 else material_id,
+            "action": action or None,
+            "timestamp": timestamp,
+            "duration": None if duration != duration else duration,
+            "score": None if score != score else score,
+            "meta": json.loads(meta) if meta else None,
+        })
+    return rows
+
+
+class ArchiveWriter:
+    """Пишет архив пачками колонок и атомарно: во временный файл, затем rename в close.
+    CSV сразу уходит в gzip; npz хранит массивы целиком, поэтому до close копятся колонки NumPy"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.rows = 0
+        self._tmp = path + ".tmp"
+        self._file = None
+        self._chunks: Dict[str, List[np.ndarray]] = {name: [] for name in ARCHIVE_COLUMNS}
+        if not path.endswith(".npz"):
+            self._file = gzip.open(self._tmp, "wt", newline="")
+            self._csv = csv.writer(self._file)
+            self._csv.writerow(ARCHIVE_COLUMNS)
+
+    def write(self, columns: Dict[str, np.ndarray]):
+        self.rows += len(columns["id"])
+        if self._file is None:
+            for name in ARCHIVE_COLUMNS:
+                self._chunks[name].append(columns[name])
+        else:
+            self._csv.writerows(zip(*(columns[name].tolist() for name in ARCHIVE_COLUMNS)))
+
+    def close(self):
+        if self._file is None:
+            with open(self._tmp, "wb") as f:
+                np.savez_compressed(f, **{name: np.concatenate(chunks) for name, chunks in self._chunks.items()})
+        else:
+            self._file.close()
+        os.replace(self._tmp, self.path)
+
+    def discard(self):
+        if self._file is not None:
+            self._file.close()
+        if os.path.exists(self._tmp):
+            os.remove(self._tmp)
+
+
+def read_archive(path: str) -> Dict[str, np.ndarray]:
+    if path.endswith(".npz"):
+        with np.load(path, allow_pickle=False) as data:
+            return {name: data[name] for name in ARCHIVE_COLUMNS}
+    with gzip.open(path, "rt", newline="") as f:
+        rows = list(csv.reader(f))[1:]
+    values = list(zip(*rows)) if rows else [()] * len(ARCHIVE_COLUMNS)
+    return {
+        "id": np.array(values[0], np.int64),
+        "user_id": np.array(values[1], np.int64),
+        "material_id": np.array(values[2], np.int64),
+        "action": np.array(values[3], dtype=str),
+        "timestamp": np.array(values[4], "datetime64[us]"),
+        "duration": np.array(values[5], np.float64),
+        "score": np.array(values[6], np.float64),
+        "meta": np.array(values[7], dtype=str),
+    }
+
+
+# Манифест: граница архива и список месячных файлов
+
+def load_manifest(directory: str = ARCHIVE_DIR) -> Dict[str, Any]:
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return {"archived_before": None, "months": {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest: Dict[str, Any], directory: str = ARCHIVE_DIR):
+    path = os.path.join(directory, MANIFEST)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def archived_before(directory: str = ARCHIVE_DIR) -> Optional[datetime]:
+    """Граница горячего окна: все события раньше нее лежат в архиве"""
+    value = load_manifest(directory)["archived_before"]
+    return datetime.fromisoformat(value) if value else None
+
+
+def reaches_archive(since: Optional[datetime], directory: str = ARCHIVE_DIR) -> bool:
+    boundary = archived_before(directory)
+    return boundary is not None and (since is None or since < boundary)
+
+
+def archive_files(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    directory: str = ARCHIVE_DIR,
+) -> List[str]:
+    """Месячные файлы, пересекающиеся с [since, until), по возрастанию месяца"""
+    paths = []
+    for month, info in sorted(load_manifest(directory)["months"].items()):
+        start = datetime.strptime(month, "%Y-%m")
+        if until is not None and start >= until:
+            continue
+        if since is not None and next_month(start) <= since:
+            continue
+        paths.append(os.path.join(directory, info["file"]))
+    return paths
+
+
+def iter_archived(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    directory: str = ARCHIVE_DIR,
+) -> Iterator[Dict[str, np.ndarray]]:
+    """Колонки архивных событий в диапазоне [since, until), по одному месяцу за раз.
+    Читается только то, что раньше archived_before: месяц, архивация которого не завершилась,
+    еще отдается из activities"""
+    boundary = archived_before(directory)
+    if boundary is None:
+        return
+    until = boundary if until is None else min(until, boundary)
+    for path in archive_files(since, until, directory):
+        columns = read_archive(path)
+        mask = np.ones(len(columns["id"]), bool)
+        if since is not None:
+            mask &= columns["timestamp"] >= np.datetime64(since, "us")
+        mask &= columns["timestamp"] < np.datetime64(until, "us")
+        if not mask.all():
+            columns = {name: values[mask] for name, values in columns.items()}
+        if len(columns["id"]):
+            yield columns
+
+
+def iter_archived_rows(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    chunk: int = RETENTION_BATCH,
+    directory: str = ARCHIVE_DIR,
+) -> Iterator[List[Dict[str, Any]]]:
+    """То же, что iter_archived, но пачками словарей в формате строк activities"""
+    for columns in iter_archived(since, until, directory):
+        for offset in range(0, len(columns["id"]), chunk):
+            yield columns_to_rows({name: values[offset:offset + chunk] for name, values in columns.items()})
+
+
+def archive_stats(directory: str = ARCHIVE_DIR) -> Dict[str, Any]:
+    manifest = load_manifest(directory)
+    return {
+        "archived_before": manifest["archived_before"],
+        "months": len(manifest["months"]),
+        "rows": sum(info["rows"] for info in manifest["months"].values()),
+    }
+
+
+async def add_archived_progress(session: AsyncSession, rows):
+    """Прибавляет события (user_id, material_id, action, duration, score) к archived_progress"""
+    totals: Dict[tuple, Dict[str, Any]] = {}
+    for user_id, material_id, action, duration, score in rows:
+        if user_id is None or material_id is None:
+            continue
+        total = totals.setdefault((user_id, material_id), {
+            "user_id": user_id, "material_id": material_id, "completed": 0,
+            "duration_sum": 0.0, "score_sum": 0.0, "score_count": 0,
+        })
+        if action == "complete":
+            total["completed"] = 1
+        total["duration_sum"] += duration or 0.0
+        if score is not None:
+            total["score_sum"] += score
+            total["score_count"] += 1
+    if not totals:
+        return
+    stmt = insert(ArchivedProgress)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ArchivedProgress.user_id, ArchivedProgress.material_id],
+        set_={
+            "completed": func.max(ArchivedProgress.completed, stmt.excluded.completed),
+            "duration_sum": ArchivedProgress.duration_sum + stmt.excluded.duration_sum,
+            "score_sum": ArchivedProgress.score_sum + stmt.excluded.score_sum,
+            "score_count": ArchivedProgress.score_count + stmt.excluded.score_count,
+        }
+    )
+    await session.execute(stmt, list(totals.values()))
+
+
+async def archive_month(session_factory, start: datetime, end: datetime, fmt: str, batch: int, directory: str) -> int:
+    """Выгружает события [start, end) в месячный файл и удаляет их из activities пачками"""
+    month = start.strftime("%Y-%m")
+    manifest = load_manifest(directory)
+    info = manifest["months"].get(month)
+    filename = f"activities-{month}{EXTENSIONS[fmt]}"
+    # Каждая пачка сразу уходит в файл, а не копится за весь месяц
+    writer = ArchiveWriter(os.path.join(directory, filename))
+    archived_ids = None
+    if info is not None:
+        # Повтор после сбоя: месяц уже частично в архиве, события не дублируются
+        old = read_archive(os.path.join(directory, info["file"]))
+        writer.write(old)
+        archived_ids = old["id"]
+
+    rows = 0
+    last_id = 0
+    try:
+        async with session_factory() as session:
+            while True:
+                stmt = select(*(getattr(Activity, name) for name in ARCHIVE_COLUMNS)).where(
+                    Activity.timestamp >= start, Activity.timestamp < end, Activity.id > last_id
+                ).order_by(Activity.id).limit(batch)
+                chunk = [dict(row) for row in (await session.execute(stmt)).mappings()]
+                if not chunk:
+                    break
+                columns = rows_to_columns(chunk)
+                if archived_ids is not None:
+                    new = ~np.isin(columns["id"], archived_ids)
+                    columns = {name: values[new] for name, values in columns.items()}
+                writer.write(columns)
+                rows += len(chunk)
+                last_id = chunk[-1]["id"]
+    except BaseException:
+        writer.discard()
+        raise
+    if not rows:
+        writer.discard()
+        return 0
+
+    writer.close()
+    manifest["months"][month] = {"file": filename, "rows": writer.rows}
+    save_manifest(manifest, directory)
+    if info is not None and info["file"] != filename:
+        os.remove(os.path.join(directory, info["file"]))
+
+    # Удаляем только то, что уже записано в файл (id <= last_id)
+    while True:
+        async with session_factory() as session:
+            ids = select(Activity.id).where(
+                Activity.timestamp >= start, Activity.timestamp < end, Activity.id <= last_id
+            ).limit(batch)
+            result = await session.execute(
+                delete(Activity).where(Activity.id.in_(ids)).returning(
+                    Activity.user_id, Activity.material_id, Activity.action, Activity.duration, Activity.score
+                ).execution_options(synchronize_session=False)
+            )
+            deleted = result.all()
+            await add_archived_progress(session, deleted)
+            await session.commit()
+        if len(deleted) < batch:
+            break
+        await asyncio.sleep(RETENTION_PAUSE)
+    return rows
+
+
+async def rebuild_archived_progress(session_factory=SessionLocal, chunk: int = RETENTION_BATCH) -> int:
+    """Пересчитывает archived_progress по архивным файлам (архивы, созданные до появления таблицы)"""
+    async with session_factory() as session:
+        await session.execute(delete(ArchivedProgress))
+        await session.commit()
+    processed = 0
+    for rows in iter_archived_rows(chunk=chunk):
+        async with session_factory() as session:
+            await add_archived_progress(session, [
+                (row["user_id"], row["material_id"], row["action"], row["duration"], row["score"]) for row in rows
+            ])
+            await session.commit()
+        processed += len(rows)
+    return processed
+
+
+async def archive_activities(
+    session_factory=SessionLocal,
+    days: int = ACTIVITY_RETENTION_DAYS,
+    fmt: str = ARCHIVE_FORMAT,
+    batch: int = RETENTION_BATCH,
+    directory: str = ARCHIVE_DIR,
+    now: Optional[datetime] = None,
+) -> Dict[str, int]:
+    """Переносит в архив все целые месяцы старше окна хранения; возвращает число событий по месяцам"""
+    if fmt not in EXTENSIONS:
+        raise ValueError(f"Unknown archive format: {fmt}")
+    os.makedirs(directory, exist_ok=True)
+    cutoff = retention_cutoff(days, now)
+
+    archived = {}
+    while True:
+        async with session_factory() as session:
+            oldest = await session.scalar(select(func.min(Activity.timestamp)).where(Activity.timestamp < cutoff))
+        if oldest is None:
+            break
+        start = month_start(oldest)
+        end = min(next_month(start), cutoff)
+        archived[start.strftime("%Y-%m")] = await archive_month(session_factory, start, end, fmt, batch, directory)
+        # Границу двигаем только после удаления месяца из activities
+        advance_boundary(end, directory)
+
+    advance_boundary(cutoff, directory)
+    return archived
+
+
+def advance_boundary(boundary: datetime, directory: str = ARCHIVE_DIR):
+    manifest = load_manifest(directory)
+    if manifest["archived_before"] is None or datetime.fromisoformat(manifest["archived_before"]) < boundary:
+        manifest["archived_before"] = boundary.isoformat()
+        save_manifest(manifest, directory)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Activity retention")
+    parser.add_argument("command", choices=["archive", "list", "rebuild"])
+    parser.add_argument("--days", type=int, default=ACTIVITY_RETENTION_DAYS)
+    parser.add_argument("--format", choices=list(EXTENSIONS), default=ARCHIVE_FORMAT)
+    args = parser.parse_args()
+
+    if args.command == "list":
+        manifest = load_manifest()
+        print(f'Горячее окно начинается с {manifest["archived_before"] or "-"}')
+        for month, info in sorted(manifest["months"].items()):
+            print(f'{month}  {info["rows"]:>10}  {info["file"]}')
+        return
+
+    await create_tables()
+    if args.command == "rebuild":
+        processed = await rebuild_archived_progress()
+        print(f'✅ archived_progress пересчитан по {processed} архивным событиям')
+        return
+    archived = await archive_activities(days=args.days, fmt=args.format)
+    for month, count in sorted(archived.items()):
+        print(f'{month}: {count} событий')
+    print(f'✅ В архив перенесено {sum(archived.values())} событий')
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
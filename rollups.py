@@ -0,0 +1,204 @@
+# rollups.py - Почасовые и подневные агрегаты активности для трендов
+#
+# Заполнение из истории: python rollups.py backfill [--since YYYY-MM-DD]
+import argparse
+import asyncio
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from course_stats import material_courses
+from db import create_tables, SessionLocal, Activity, ActivityRollup
+from hll import HyperLogLog
+from retention import iter_archived_rows
+
+GRANULARITIES = ("hour", "day")
+DEFAULT_WINDOWS = {"hour": timedelta(days=2), "day": timedelta(days=30)}
+BACKFILL_CHUNK = 5000
+# Ограничение на число ключей в одном запросе tuple IN (...)
+KEY_CHUNK = 500
+
+ROLLUP_KEY = (
+    ActivityRollup.granularity, ActivityRollup.bucket_start, ActivityRollup.course_id,
+    ActivityRollup.material_id, ActivityRollup.action,
+)
+
+
+def bucket_start(timestamp: datetime, granularity: str) -> datetime:
+    if granularity == "hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+async def apply_activities(session: AsyncSession, rows: List[Dict[str, Any]]):
+    """Инкрементально добавляет пачку событий в почасовые и подневные агрегаты"""
+    if not rows:
+        return
+    courses = await material_courses(session, (row["material_id"] for row in rows))
+
+    groups: Dict[tuple, Dict[str, Any]] = {}
+    for row in rows:
+        course_id = courses.get(row["material_id"])
+        if course_id is None:
+            continue
+        for granularity in GRANULARITIES:
+            key = (granularity, bucket_start(row["timestamp"], granularity), course_id,
+                   row["material_id"], row.get("action") or "")
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = {
+                    "events": 0, "duration_sum": 0.0, "score_sum": 0.0, "score_count": 0, "users": set()
+                }
+            group["events"] += 1
+            group["duration_sum"] += row.get("duration") or 0
+            if row.get("score") is not None:
+                group["score_sum"] += row["score"]
+                group["score_count"] += 1
+            if row.get("user_id") is not None:
+                group["users"].add(row["user_id"])
+
+    keys = list(groups)
+    for offset in range(0, len(keys), KEY_CHUNK):
+        chunk = keys[offset:offset + KEY_CHUNK]
+        # HLL нельзя сложить в SQL, поэтому текущие скетчи объединяем в Python.
+        # IN по каждой колонке ключа (а не tuple IN, который SQLite читает полным сканированием)
+        # ищет по первичному ключу; лишние комбинации отбрасываются ниже
+        existing = await session.execute(
+            select(*ROLLUP_KEY, ActivityRollup.users_hll).where(
+                *(column.in_({key[i] for key in chunk}) for i, column in enumerate(ROLLUP_KEY))
+            )
+        )
+        sketches = {tuple(row[:5]): row[5] for row in existing.all()}
+
+        values = []
+        for key in chunk:
+            group = groups[key]
+            sketch = HyperLogLog.from_bytes(sketches.get(key))
+            sketch.update(group.pop("users"))
+            values.append({
+                "granularity": key[0], "bucket_start": key[1], "course_id": key[2],
+                "material_id": key[3], "action": key[4], "users_hll": sketch.to_bytes(), **group
+            })
+
+        stmt = insert(ActivityRollup)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(ROLLUP_KEY),
+            set_={
+                "events": ActivityRollup.events + stmt.excluded.events,
+                "duration_sum": ActivityRollup.duration_sum + stmt.excluded.duration_sum,
+                "score_sum": ActivityRollup.score_sum + stmt.excluded.score_sum,
+                "score_count": ActivityRollup.score_count + stmt.excluded.score_count,
+                "users_hll": stmt.excluded.users_hll,
+            }
+        )
+        await session.execute(stmt, values)
+
+
+async def timeseries(
+    session: AsyncSession,
+    granularity: str = "day",
+    course_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    action: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """Временной ряд только по агрегатам, без чтения сырых событий"""
+    if since is None:
+        since = bucket_start(datetime.utcnow() - DEFAULT_WINDOWS[granularity], granularity)
+    stmt = select(
+        ActivityRollup.bucket_start, ActivityRollup.events, ActivityRollup.duration_sum,
+        ActivityRollup.score_sum, ActivityRollup.score_count, ActivityRollup.users_hll,
+    ).where(
+        ActivityRollup.granularity == granularity,
+        ActivityRollup.bucket_start >= since,
+    ).order_by(ActivityRollup.bucket_start)
+    if until:
+        stmt = stmt.where(ActivityRollup.bucket_start < until)
+    if course_id is not None:
+        stmt = stmt.where(ActivityRollup.course_id == course_id)
+    if action:
+        stmt = stmt.where(ActivityRollup.action == action)
+
+    buckets: Dict[datetime, Dict[str, Any]] = {}
+    for bucket, events, duration_sum, score_sum, score_count, users_hll in (await session.execute(stmt)).all():
+        point = buckets.get(bucket)
+        if point is None:
+            point = buckets[bucket] = {
+                "events": 0, "duration_sum": 0.0, "score_sum": 0.0, "score_count": 0, "users": HyperLogLog()
+            }
+        point["events"] += events
+        point["duration_sum"] += duration_sum
+        point["score_sum"] += score_sum
+        point["score_count"] += score_count
+        point["users"].merge(HyperLogLog.from_bytes(users_hll))
+
+    return [
+        {
+            "bucket": bucket,
+            "events": point["events"],
+            "total_duration": point["duration_sum"],
+            "avg_score": point["score_sum"] / point["score_count"] if point["score_count"] else None,
+            "unique_users": point["users"].count(),
+        }
+        for bucket, point in buckets.items()
+    ]
+
+
+async def backfill(session_factory=SessionLocal, since: Optional[datetime] = None, chunk: int = BACKFILL_CHUNK):
+    """Пересчитывает агрегаты из архива и activities (с начала суток since или за всю историю)"""
+    if since is not None:
+        since = bucket_start(since, "day")
+
+    async with session_factory() as session:
+        stmt = delete(ActivityRollup)
+        if since is not None:
+            stmt = stmt.where(ActivityRollup.bucket_start >= since)
+        await session.execute(stmt)
+        # Граница читается в транзакции DELETE: события после нее уже учтет хук ingestor,
+        # и при пересчете в работающем API они не попадут в агрегаты дважды
+        max_id = (await session.execute(select(func.max(Activity.id)))).scalar() or 0
+        await session.commit()
+
+    processed = 0
+    # События старше горячего окна читаются из архивных файлов (см. retention.py)
+    for rows in iter_archived_rows(since, chunk=chunk):
+        async with session_factory() as session:
+            await apply_activities(session, rows)
+            await session.commit()
+        processed += len(rows)
+
+    last_id = 0
+    while True:
+        async with session_factory() as session:
+            stmt = select(
+                Activity.id, Activity.user_id, Activity.material_id, Activity.action,
+                Activity.timestamp, Activity.duration, Activity.score,
+            ).where(Activity.id > last_id, Activity.id <= max_id).order_by(Activity.id).limit(chunk)
+            if since is not None:
+                stmt = stmt.where(Activity.timestamp >= since)
+            rows = [dict(row) for row in (await session.execute(stmt)).mappings()]
+            if not rows:
+                break
+            await apply_activities(session, rows)
+            await session.commit()
+        last_id = rows[-1]["id"]
+        processed += len(rows)
+    return processed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Activity rollups")
+    parser.add_argument("command", choices=["backfill"])
+    parser.add_argument("--since", type=datetime.fromisoformat, default=None)
+    args = parser.parse_args()
+
+    await create_tables()
+    processed = await backfill(since=args.since)
+    print(f'✅ Агрегаты пересчитаны по {processed} событиям')
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,201 @@
+# search.py - Полнотекстовый поиск по курсам и материалам (SQLite FTS5)
+#
+# Индекс search_index и синхронизирующие триггеры описаны в db.py.
+# Перестроение индекса: python search.py reindex
+import asyncio
+import re
+import sys
+from typing import Any, Dict, Optional
+
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db import create_tables, SessionLocal, Course, Material, SEARCH_INDEX_DDL
+from serialization import PREVIEW_CHARS, preview
+
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+# Веса bm25 для колонок title, body, category
+BM25_WEIGHTS = "10.0, 1.0, 5.0"
+
+COURSE_KIND = 0
+MATERIAL_KIND = 1
+
+
+def build_match_query(q: str) -> str:
+    """Превращает пользовательский ввод в безопасный запрос FTS5 (AND по префиксам слов)"""
+    return " ".join(f'"{token}"*' for token in re.findall(r"\w+", q))
+
+
+def build_filters(category: Optional[str], level: Optional[str], material_type: Optional[str]):
+    course_cond = ["c.id IS NOT NULL"]
+    material_cond = ["m.id IS NOT NULL"]
+    if category:
+        course_cond.append("c.category = :category")
+    if level:
+        course_cond.append("c.level = :level")
+    if material_type:
+        material_cond.append("m.type = :material_type")
+    return f"(({' AND '.join(course_cond)}) OR ({' AND '.join(material_cond)}))"
+
+
+SEARCH_FROM = """
+    FROM search_index s
+    LEFT JOIN courses c ON s.rowid % 2 = 0 AND c.id = s.rowid / 2
+    LEFT JOIN materials m ON s.rowid % 2 = 1 AND m.id = s.rowid / 2
+    WHERE search_index MATCH :match AND {filters}
+"""
+
+
+async def search_catalog(
+    session: AsyncSession,
+    q: str,
+    category: Optional[str] = None,
+    level: Optional[str] = None,
+    material_type: Optional[str] = None,
+    limit: int = SEARCH_DEFAULT_LIMIT,
+    offset: int = 0,
+) -> Dict[str, Any]:
+    """Ранжированный (bm25) поиск курсов и материалов одним запросом к индексу"""
+    response = {"courses": [], "materials": [], "total_courses": 0, "total_materials": 0}
+    match = build_match_query(q)
+    if not match:
+        return response
+
+    params = {
+        "match": match, "category": category, "level": level,
+        "material_type": material_type, "limit": limit, "offset": offset, "preview_chars": PREVIEW_CHARS,
+    }
+    from_clause = SEARCH_FROM.format(filters=build_filters(category, level, material_type))
+
+    rows = await session.execute(text(f"""
+        SELECT s.rowid % 2 AS kind, s.rowid / 2 AS ref_id,
+               bm25(search_index, {BM25_WEIGHTS}) AS rank,
+               snippet(search_index, -1, '<mark>', '</mark>', '…', 16) AS snippet,
+               c.title AS course_title, substr(c.description, 1, :preview_chars) AS description_preview,
+               c.category, c.level, c.teacher_id,
+               m.course_id, m.title AS material_title, m.type, m.order_index
+        {from_clause}
+        ORDER BY rank
+        LIMIT :limit OFFSET :offset
+    """), params)
+
+    for row in rows.mappings():
+        if row["kind"] == COURSE_KIND:
+            response["courses"].append({
+                "id": row["ref_id"],
+                "title": row["course_title"],
+                "description_preview": row["description_preview"],
+                "category": row["category"],
+                "level": row["level"],
+                "teacher_id": row["teacher_id"],
+                "rank": row["rank"],
+                "snippet": row["snippet"],
+            })
+        else:
+            response["materials"].append({
+                "id": row["ref_id"],
+                "course_id": row["course_id"],
+                "title": row["material_title"],
+                "type": row["type"],
+                "order_index": row["order_index"],
+                "rank": row["rank"],
+                "snippet": row["snippet"],
+            })
+
+    totals = await session.execute(text(f"SELECT s.rowid % 2, count(*) {from_clause} GROUP BY 1"), params)
+    for kind, count in totals.all():
+        response["total_courses" if kind == COURSE_KIND else "total_materials"] = count
+    return response
+
+
+async def browse_catalog(
+    session: AsyncSession,
+    category: Optional[str] = None,
+    level: Optional[str] = None,
+    material_type: Optional[str] = None,
+    limit: int = SEARCH_DEFAULT_LIMIT,
+    offset: int = 0,
+) -> Dict[str, Any]:
+    """Поиск без текстового запроса - только фильтры и пагинация"""
+    courses_stmt = select(
+        Course.id, Course.title, preview(Course.description).label("description_preview"),
+        Course.category, Course.level, Course.teacher_id
+    )
+    if category:
+        courses_stmt = courses_stmt.where(Course.category == category)
+    if level:
+        courses_stmt = courses_stmt.where(Course.level == level)
+
+    materials_stmt = select(Material.id, Material.course_id, Material.title, Material.type, Material.order_index)
+    if material_type:
+        materials_stmt = materials_stmt.where(Material.type == material_type)
+
+    courses = await session.execute(courses_stmt.order_by(Course.id).limit(limit).offset(offset))
+    materials = await session.execute(materials_stmt.order_by(Material.id).limit(limit).offset(offset))
+    return {
+        "courses": [dict(row) for row in courses.mappings()],
+        "materials": [dict(row) for row in materials.mappings()],
+        "total_courses": await session.scalar(select(func.count()).select_from(courses_stmt.subquery())),
+        "total_materials": await session.scalar(select(func.count()).select_from(materials_stmt.subquery())),
+    }
+
+
+async def reindex_search(session: AsyncSession):
+    """Перестраивает search_index из таблиц courses и materials"""
+    await session.execute(text("DELETE FROM search_index"))
+    await session.execute(text("""
+        INSERT INTO search_index(rowid, title, body, category)
+        SELECT id * 2, title, description, category FROM courses
+    """))
+    await session.execute(text("""
+        INSERT INTO search_index(rowid, title, body, category)
+        SELECT id * 2 + 1, title, content, NULL FROM materials
+    """))
+    await session.execute(text("INSERT INTO search_index(search_index) VALUES ('optimize')"))
+
+
+# Триггеры, которые индексируют каждую вставленную строку; пакетный импорт выключает их
+# на время загрузки и затем дописывает индекс одним запросом (index_missing)
+INSERT_TRIGGERS = ("search_courses_ai", "search_materials_ai")
+
+
+async def suspend_insert_triggers(session: AsyncSession):
+    for name in INSERT_TRIGGERS:
+        await session.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+
+
+async def restore_triggers(session: AsyncSession):
+    """Создает недостающие триггеры (их же восстанавливает create_tables при старте)"""
+    for statement in SEARCH_INDEX_DDL:
+        await session.execute(text(statement))
+
+
+async def index_missing(session: AsyncSession):
+    """Добавляет в search_index курсы и материалы, которых в нем нет"""
+    await session.execute(text("""
+        INSERT INTO search_index(rowid, title, body, category)
+        SELECT id * 2, title, description, category FROM courses
+        WHERE NOT EXISTS (SELECT 1 FROM search_index WHERE rowid = courses.id * 2)
+    """))
+    await session.execute(text("""
+        INSERT INTO search_index(rowid, title, body, category)
+        SELECT id * 2 + 1, title, content, NULL FROM materials
+        WHERE NOT EXISTS (SELECT 1 FROM search_index WHERE rowid = materials.id * 2 + 1)
+    """))
+
+
+async def reindex():
+    await create_tables()
+    async with SessionLocal() as session:
+        await reindex_search(session)
+        await session.commit()
+        count = await session.scalar(text("SELECT count(*) FROM search_index"))
+    print(f'✅ Поисковый индекс перестроен: {count} документов')
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["reindex"]:
+        print("Использование: python search.py reindex")
+        sys.exit(1)
+    asyncio.run(reindex())
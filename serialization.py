@@ -0,0 +1,74 @@
+# serialization.py - Быстрая сериализация списочных ответов
+#
+# Списки выбираются как строки нужных колонок (без ORM-объектов), превращаются в dict и
+# кодируются orjson. Pydantic-модель эндпоинта остается в response_model для документации,
+# но Response возвращается напрямую, поэтому FastAPI не валидирует ответ повторно и не
+# вызывает jsonable_encoder.
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional
+
+import os
+
+import orjson
+from fastapi import Response
+from sqlalchemy import Boolean, func, type_coerce
+
+JSON_MEDIA_TYPE = "application/json"
+# Длина превью тяжелых текстов в списках (символов)
+PREVIEW_CHARS = int(os.getenv("PREVIEW_CHARS", "200"))
+# Как в ORJSONResponse: ключи-числа и типы NumPy (снимок аналитики)
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def dumps(data: Any) -> bytes:
+    return orjson.dumps(data, option=ORJSON_OPTIONS)
+
+
+def preview(column, chars: int = PREVIEW_CHARS):
+    """Начало текста для списков вместо всего значения"""
+    return func.substr(column, 1, chars)
+
+
+def text_length(column):
+    return func.coalesce(func.length(column), 0)
+
+
+def model_columns(entity, model, **computed) -> list:
+    """Колонки ORM-модели entity в порядке полей Pydantic-модели model; computed - SQL-выражения
+    для полей, которых нет в таблице (превью, длина).
+    Флаги, которые в БД хранятся как Integer (is_active), читаются как bool, как их отдавал Pydantic"""
+    columns = []
+    for name, field in model.model_fields.items():
+        if name in computed:
+            columns.append(computed[name].label(name))
+            continue
+        column = getattr(entity, name)
+        if field.annotation is bool and not isinstance(column.type, Boolean):
+            column = type_coerce(column, Boolean).label(name)
+        columns.append(column)
+    return columns
+
+
+def records(rows) -> List[Dict[str, Any]]:
+    """Строки результата select(колонки) -> список dict по именам колонок"""
+    if not rows:
+        return []
+    fields = rows[0]._fields
+    return [dict(zip(fields, row)) for row in rows]
+
+
+def json_response(data: Any, status_code: int = 200, headers: Optional[Dict[str, str]] = None) -> Response:
+    return Response(content=dumps(data), status_code=status_code, media_type=JSON_MEDIA_TYPE, headers=headers)
+
+
+async def stream_json_array(chunks: AsyncIterator[Iterable[Dict[str, Any]]]) -> AsyncIterator[bytes]:
+    """JSON-массив по частям: каждая пачка кодируется целиком, без сборки всего ответа в памяти"""
+    yield b"["
+    first = True
+    async for chunk in chunks:
+        body = dumps(list(chunk))[1:-1]
+        if not body:
+            continue
+        yield body if first else b"," + body
+        first = False
+    yield b"]"
+
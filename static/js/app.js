@@ -142,6 +142,10 @@ class EduPlatformAPI {
         return await this.request(`/courses?${params}`);
     }
 
+    async getCatalogSummary() {
+        return await this.request('/catalog/summary');
+    }
+
     async createCourse(courseData) {
         return await this.request('/courses', {
             method: 'POST',
@@ -158,6 +162,30 @@ class EduPlatformAPI {
         return await this.request(`/analytics/user/${userId}/progress`);
     }
 
+    async getCourseMaterials(courseId, limit = 100) {
+        return await this.request(`/courses/${courseId}/materials?limit=${limit}`);
+    }
+
+    // Где пользователь остановился в курсе; null, если активности в курсе еще нет
+    async getNextMaterial(courseId) {
+        const response = await fetch(`/users/me/next?course_id=${courseId}`, {
+            headers: { 'Authorization': `Bearer ${this.token}` }
+        });
+        if (response.status === 404) return null;
+        if (!response.ok) throw new Error('Request failed');
+        return await response.json();
+    }
+
+    // Поток прогресса (SSE): snapshot - состояние целиком, delta - изменения по курсам.
+    // EventSource не передает заголовки, поэтому токен идет в query
+    subscribeProgress(userId, onSnapshot, onDelta) {
+        const params = new URLSearchParams({ token: this.token });
+        const source = new EventSource(`/analytics/user/${userId}/progress/stream?${params}`);
+        source.addEventListener('snapshot', event => onSnapshot(JSON.parse(event.data)));
+        source.addEventListener('delta', event => onDelta(JSON.parse(event.data)));
+        return source;
+    }
+
     async logActivity(activityData) {
         return await this.request('/activities', {
             method: 'POST',
@@ -283,7 +311,7 @@ function displaySearchResults(results) {
                 <div class="card mb-2">
                     <div class="card-body">
                         <h6 class="card-title">${course.title}</h6>
-                        <p class="card-text">${course.description || ''}</p>
+                        <p class="card-text">${course.description_preview || ''}</p>
                         <span class="badge bg-primary">${course.category}</span>
                         <span class="badge bg-secondary">${course.level}</span>
                     </div>
@@ -299,6 +327,7 @@ function displaySearchResults(results) {
                 <div class="card mb-2">
                     <div class="card-body">
                         <h6 class="card-title">${material.title}</h6>
+                        ${material.snippet ? `<p class="card-text small">${material.snippet}</p>` : ''}
                         <span class="badge bg-info">${material.type}</span>
                     </div>
                 </div>
@@ -321,10 +350,20 @@ async function loadFeaturedCourses() {
 
 async function loadStatistics() {
     try {
-        // Load basic statistics - you may need to implement these endpoints
-        document.getElementById('totalCourses').textContent = '10+';
-        document.getElementById('totalUsers').textContent = '100+';
-        document.getElementById('totalMaterials').textContent = '50+';
+        const summary = await api.getCatalogSummary();
+        document.getElementById('totalCourses').textContent = summary.total_courses;
+        document.getElementById('totalUsers').textContent = summary.total_users;
+        document.getElementById('totalMaterials').textContent = summary.total_materials;
+
+        const categories = document.getElementById('categoriesList');
+        if (categories) {
+            categories.innerHTML = summary.categories.map(category => `
+                <div class="list-group-item d-flex justify-content-between align-items-center">
+                    ${category.value}
+                    <span class="badge bg-primary rounded-pill">${category.count}</span>
+                </div>
+            `).join('');
+        }
     } catch (error) {
         console.error('Failed to load statistics:', error);
     }
@@ -344,7 +383,7 @@ function displayCourses(courses, containerId) {
             <div class="card course-card h-100" onclick="openCourse(${course.id})">
                 <div class="card-body">
                     <h5 class="card-title">${course.title}</h5>
-                    <p class="card-text">${course.description || ''}</p>
+                    <p class="card-text">${course.description_preview || ''}</p>
                     <div class="d-flex justify-content-between align-items-center">
                         <span class="badge bg-primary">${course.category}</span>
                         <span class="badge bg-secondary">${course.level}</span>
@@ -375,6 +414,47 @@ async function checkAuthAndLoadDashboard() {
     
     loadUserProfile();
     loadMyCourses();
+    subscribeProgress();
+}
+
+// Прогресс пользователя: приходит снимком по SSE и обновляется дельтами, без повторных запросов
+let progressState = null;
+let progressSource = null;
+// Список курсов загружается один раз; сбрасывается после создания курса
+let myCourses = null;
+
+function subscribeProgress() {
+    if (progressSource || !window.EventSource) return;
+    progressSource = api.subscribeProgress(api.currentUser.id, data => {
+        progressState = data.progress;
+        renderProgressIfVisible();
+    }, data => {
+        if (!progressState) return;
+        data.courses.forEach(delta => applyProgressDelta(progressState, delta));
+        renderProgressIfVisible();
+    });
+}
+
+function applyProgressDelta(state, delta) {
+    const course = state[delta.course_id] || (state[delta.course_id] = {
+        course_title: delta.course_title, completed_materials: 0, total_time: 0,
+        avg_score: 0, score_count: 0
+    });
+    const scoreSum = course.avg_score * course.score_count + delta.score_sum;
+    course.total_materials = delta.total_materials;
+    course.completed_materials += delta.completed_materials;
+    course.total_time += delta.time_spent;
+    course.score_count += delta.score_count;
+    course.avg_score = course.score_count ? scoreSum / course.score_count : 0;
+    course.completion_percentage = course.total_materials
+        ? course.completed_materials / course.total_materials * 100 : 0;
+}
+
+function renderProgressIfVisible() {
+    const tab = document.getElementById('progress-tab');
+    if (tab && tab.style.display !== 'none') {
+        renderProgress(progressState);
+    }
 }
 
 async function loadUserProfile() {
@@ -397,10 +477,12 @@ async function loadMyCourses() {
     const container = document.getElementById('myCoursesContainer');
     if (!container) return;
     
-    container.innerHTML = '<div class="loading"></div>';
+    if (!myCourses) {
+        container.innerHTML = '<div class="loading"></div>';
+    }
     
     try {
-        const courses = await api.getCourses();
+        const courses = myCourses || (myCourses = await api.getCourses());
         
         if (courses.length === 0) {
             container.innerHTML = '<div class="alert alert-info">У вас пока нет курсов</div>';
@@ -413,7 +495,7 @@ async function loadMyCourses() {
                     <div class="d-flex justify-content-between align-items-start">
                         <div>
                             <h5 class="card-title">${course.title}</h5>
-                            <p class="card-text">${course.description || ''}</p>
+                            <p class="card-text">${course.description_preview || ''}</p>
                             <span class="badge bg-primary me-2">${course.category}</span>
                             <span class="badge bg-secondary">${course.level}</span>
                         </div>
@@ -464,36 +546,47 @@ async function loadProgress() {
     const container = document.getElementById('progressContainer');
     if (!container) return;
     
+    // Поток SSE уже держит актуальное состояние
+    if (progressState) {
+        renderProgress(progressState);
+        return;
+    }
+    
     container.innerHTML = '<div class="loading"></div>';
     
     try {
-        const progress = await api.getUserProgress(api.currentUser.id);
-        
-        if (Object.keys(progress).length === 0) {
-            container.innerHTML = '<div class="alert alert-info">Прогресс не найден</div>';
-            return;
-        }
-        
-        container.innerHTML = Object.values(progress).map(course => `
-            <div class="progress-item">
-                <h6>${course.course_title}</h6>
-                <div class="progress mb-2">
-                    <div class="progress-bar" style="width: ${course.completion_percentage}%">
-                        ${Math.round(course.completion_percentage)}%
-                    </div>
-                </div>
-                <div class="d-flex justify-content-between text-muted">
-                    <small>Материалов завершено: ${course.completed_materials}/${course.total_materials}</small>
-                    <small>Время: ${Math.round(course.total_time / 60)} мин</small>
-                    ${course.avg_score ? `<small>Средний балл: ${course.avg_score.toFixed(1)}</small>` : ''}
-                </div>
-            </div>
-        `).join('');
+        renderProgress(await api.getUserProgress(api.currentUser.id));
     } catch (error) {
         container.innerHTML = '<div class="alert alert-danger">Ошибка загрузки прогресса</div>';
     }
 }
 
+function renderProgress(progress) {
+    const container = document.getElementById('progressContainer');
+    if (!container) return;
+    
+    if (Object.keys(progress).length === 0) {
+        container.innerHTML = '<div class="alert alert-info">Прогресс не найден</div>';
+        return;
+    }
+    
+    container.innerHTML = Object.values(progress).map(course => `
+        <div class="progress-item">
+            <h6>${course.course_title}</h6>
+            <div class="progress mb-2">
+                <div class="progress-bar" style="width: ${course.completion_percentage}%">
+                    ${Math.round(course.completion_percentage)}%
+                </div>
+            </div>
+            <div class="d-flex justify-content-between text-muted">
+                <small>Материалов завершено: ${course.completed_materials}/${course.total_materials}</small>
+                <small>Время: ${Math.round(course.total_time / 60)} мин</small>
+                ${course.avg_score ? `<small>Средний балл: ${course.avg_score.toFixed(1)}</small>` : ''}
+            </div>
+        </div>
+    `).join('');
+}
+
 // Utility functions
 function showAlert(message, type = 'info') {
     const alertContainer = document.createElement('div');
@@ -526,6 +619,7 @@ async function handleCreateCourse(event) {
     
     try {
         await api.createCourse(courseData);
+        myCourses = null;
         bootstrap.Modal.getInstance(document.getElementById('createCourseModal')).hide();
         showAlert('Курс успешно создан!', 'success');
         loadMyCourses();
@@ -540,17 +634,46 @@ function showCreateCourseModal() {
     modal.show();
 }
 
-function viewCourse(courseId) {
-    showAlert(`Просмотр курса ${courseId}`, 'info');
+async function viewCourse(courseId) {
+    try {
+        const state = await api.getNextMaterial(courseId);
+        if (!state) {
+            showAlert(`Курс ${courseId}: изучение еще не начато`, 'info');
+            return;
+        }
+        const next = state.next_material_title ? `, следующий: ${state.next_material_title}` : ', курс пройден';
+        showAlert(`${state.course_title}: пройдено ${state.completed_count} из ${state.total_materials}${next}`, 'info');
+    } catch (error) {
+        showAlert(error.message, 'danger');
+    }
 }
 
-function startCourse(courseId) {
-    // Log activity
-    api.logActivity({
-        user_id: api.currentUser.id,
-        material_id: 1, // This should be the first material of the course
-        action: 'start_course'
-    });
-    
-    showAlert(`Начало изучения курса ${courseId}`, 'success');
+async function startCourse(courseId) {
+    try {
+        // Продолжаем с места остановки; в новом курсе - с первого материала
+        const state = await api.getNextMaterial(courseId);
+        if (state && !state.next_material_id) {
+            showAlert(`Курс «${state.course_title}» пройден`, 'success');
+            return;
+        }
+        let materialId = state && state.next_material_id;
+        let title = state && state.next_material_title;
+        if (!state) {
+            const [first] = await api.getCourseMaterials(courseId, 1);
+            if (!first) {
+                showAlert('В курсе пока нет материалов', 'warning');
+                return;
+            }
+            materialId = first.id;
+            title = first.title;
+        }
+        await api.logActivity({
+            user_id: api.currentUser.id,
+            material_id: materialId,
+            action: 'start'
+        });
+        showAlert(`${state ? 'Продолжаем' : 'Начинаем'}: ${title}`, 'success');
+    } catch (error) {
+        showAlert(error.message, 'danger');
+    }
 }
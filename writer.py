@@ -0,0 +1,413 @@
+# writer.py - Единственный процесс записи для многопроцессного режима
+#
+# SQLite допускает одного писателя: N процессов API, которые пишут сами, ждут блокировку
+# друг друга (busy_timeout) и теряют пакетную запись. В многопроцессном режиме
+# (python main.py --workers N) все записи API (активность, курсы, материалы, пользователи, пачки
+# импорта, постановка задач) выполняет один процесс: воркеры API передают их по локальному
+# unix-сокету (WRITER_SOCKET), процесс записи выполняет операцию (активность - через общую пачку
+# ActivityIngestor) и отвечает результатом.
+# Через тот же сокет процесс записи рассылает воркерам сообщения pubsub (прогресс для SSE).
+#
+# Операции регистрируются декоратором operation (обработчики API - в main.py); execute
+# выполняет операцию в этом процессе (WRITER_MODE=local) или в процессе записи (remote).
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import pickle
+import signal
+import socket
+import struct
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+import pubsub
+from ingest import IngestQueueFull
+
+WRITER_MODE = os.getenv("WRITER_MODE", "local")  # local | remote
+WRITER_SOCKET = os.getenv("WRITER_SOCKET", "./writer.sock")
+# Сколько воркер API ждет ответа процесса записи
+WRITER_TIMEOUT = float(os.getenv("WRITER_TIMEOUT", "30"))
+
+# Кадр: длина (4 байта) и pickle сообщения. Сокет доступен только владельцу (chmod 600)
+HEADER = struct.Struct("!I")
+
+logger = logging.getLogger(__name__)
+
+
+class WriterUnavailable(Exception):
+    """Процесс записи не запущен или соединение с ним потеряно"""
+
+
+class WriterError(Exception):
+    """Операция завершилась ошибкой в процессе записи"""
+
+
+# Исключения, которые воркер получает тем же типом, что и в процессе записи
+REMOTE_ERRORS = {"IngestQueueFull": IngestQueueFull}
+
+Operation = Callable[..., Awaitable[Any]]
+
+operations: Dict[str, Operation] = {}
+
+
+def operation(name: str):
+    """Регистрирует корутину как операцию записи; аргументы и результат должны сериализоваться pickle"""
+    def register(handler: Operation) -> Operation:
+        operations[name] = handler
+        return handler
+    return register
+
+
+async def execute(name: str, **kwargs) -> Any:
+    if WRITER_MODE == "remote":
+        return await get_client().call(name, kwargs)
+    return await operations[name](**kwargs)
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Any:
+    header = await reader.readexactly(HEADER.size)
+    return pickle.loads(await reader.readexactly(HEADER.unpack(header)[0]))
+
+
+def encode_frame(message: Any) -> bytes:
+    body = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    return HEADER.pack(len(body)) + body
+
+
+class _Connection:
+    """Соединение воркера API с процессом записи (на стороне процесса записи)"""
+
+    def __init__(self, stream: asyncio.StreamWriter):
+        self.stream = stream
+        self.topics: Set[str] = set()
+
+    def send(self, message: Any):
+        # write не ждет: кадры одного соединения уходят целиком и по порядку
+        if not self.stream.is_closing():
+            self.stream.write(encode_frame(message))
+
+
+class WriterServer:
+    def __init__(self, path: str = WRITER_SOCKET):
+        self.path = path
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Set[_Connection] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self.requests_total = 0
+        self.errors_total = 0
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        # Кадры - pickle, поэтому сокет доступен только владельцу с момента bind:
+        # chmod после bind оставлял окно, в которое мог подключиться другой пользователь
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o077)
+        try:
+            sock.bind(self.path)
+        except OSError:
+            sock.close()
+            raise
+        finally:
+            os.umask(umask)
+        self._server = await asyncio.start_unix_server(self._handle, sock=sock)
+
+    async def stop(self):
+        if self._server is None:
+            return
+        self._server.close()
+        await self._server.wait_closed()
+        # Операции, которые уже приняты, завершаются до остановки ingestor
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for connection in list(self._connections):
+            connection.stream.close()
+        self._server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def _handle(self, reader: asyncio.StreamReader, stream: asyncio.StreamWriter):
+        connection = _Connection(stream)
+        self._connections.add(connection)
+        try:
+            while True:
+                message = await read_frame(reader)
+                kind = message.get("op")
+                if kind == "watch":
+                    connection.topics.add(message["topic"])
+                elif kind == "unwatch":
+                    connection.topics.discard(message["topic"])
+                else:
+                    # Запросы выполняются параллельно: события разных воркеров попадают в одну пачку
+                    task = asyncio.create_task(self._dispatch(connection, message))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._connections.discard(connection)
+            stream.close()
+
+    async def _dispatch(self, connection: _Connection, message: Dict[str, Any]):
+        self.requests_total += 1
+        try:
+            result = await operations[message["op"]](**message["args"])
+        except Exception as e:
+            self.errors_total += 1
+            if type(e).__name__ not in REMOTE_ERRORS:
+                logger.exception("Writer operation %s failed", message["op"])
+            connection.send({"id": message["id"], "error": (type(e).__name__, str(e))})
+        else:
+            connection.send({"id": message["id"], "result": result})
+
+    def watching(self, topic: str) -> bool:
+        return any(topic in connection.topics for connection in self._connections)
+
+    def broadcast(self, topic: str, message: Any):
+        for connection in list(self._connections):
+            if topic in connection.topics:
+                connection.send({"topic": topic, "message": message})
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "connections": len(self._connections),
+            "in_flight": len(self._tasks),
+            "requests_total": self.requests_total,
+            "errors_total": self.errors_total,
+        }
+
+
+class WriterClient:
+    """Одно соединение воркера API с процессом записи; запросы мультиплексируются по id"""
+
+    def __init__(self, path: str = WRITER_SOCKET, timeout: float = WRITER_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self.on_message: Optional[pubsub.Deliver] = None
+        self._stream: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._connect_lock: Optional[asyncio.Lock] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+        self._topics: Set[str] = set()
+
+    @property
+    def connected(self) -> bool:
+        return self._stream is not None and not self._stream.is_closing()
+
+    async def connect(self):
+        if self.connected:
+            return
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self.connected:
+                return
+            try:
+                reader, self._stream = await asyncio.open_unix_connection(self.path)
+            except OSError as e:
+                raise WriterUnavailable(f"Writer process is not reachable at {self.path}: {e}")
+            # После переподключения процесс записи снова должен знать темы подписчиков
+            for topic in self._topics:
+                self._send({"op": "watch", "topic": topic})
+            self._reader_task = asyncio.create_task(self._read(reader))
+
+    async def close(self):
+        if self._stream is not None:
+            self._stream.close()
+        if self._reader_task is not None:
+            await asyncio.gather(self._reader_task, return_exceptions=True)
+        self._stream = self._reader_task = None
+
+    def _send(self, message: Any):
+        self._stream.write(encode_frame(message))
+
+    async def call(self, name: str, args: Dict[str, Any]) -> Any:
+        await self.connect()
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            self._send({"id": request_id, "op": name, "args": args})
+            await self._stream.drain()
+            error, result = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            raise WriterUnavailable(f"Writer process did not answer {name} in {self.timeout} s")
+        finally:
+            self._pending.pop(request_id, None)
+        if error is not None:
+            kind, message = error
+            if kind in REMOTE_ERRORS:
+                raise REMOTE_ERRORS[kind](message)
+            raise WriterError(f"{kind}: {message}")
+        return result
+
+    def watch(self, topic: str):
+        self._topics.add(topic)
+        if self.connected:
+            # Синхронно: watch уходит раньше запросов, которые подписчик сделает после подписки
+            self._send({"op": "watch", "topic": topic})
+
+    def unwatch(self, topic: str):
+        self._topics.discard(topic)
+        if self.connected:
+            self._send({"op": "unwatch", "topic": topic})
+
+    async def _read(self, reader: asyncio.StreamReader):
+        try:
+            while True:
+                message = await read_frame(reader)
+                if "topic" in message:
+                    if self.on_message is not None:
+                        self.on_message(message["topic"], message["message"])
+                    continue
+                future = self._pending.get(message["id"])
+                if future is not None and not future.done():
+                    future.set_result((message.get("error"), message.get("result")))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            logger.warning("Connection to the writer process lost")
+        finally:
+            if self._stream is not None:
+                self._stream.close()
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(WriterUnavailable("Connection to the writer process lost"))
+
+
+class ServerBroker:
+    """Брокер pubsub в процессе записи: сообщения уходят воркерам, подписанным на тему"""
+
+    def __init__(self, server: WriterServer):
+        self.server = server
+        self._deliver: Optional[pubsub.Deliver] = None
+
+    async def start(self, deliver: pubsub.Deliver):
+        self._deliver = deliver
+
+    async def publish(self, topic: str, message: Any):
+        if self._deliver is not None:
+            self._deliver(topic, message)
+        self.server.broadcast(topic, message)
+
+    async def stop(self):
+        self._deliver = None
+
+    def interested(self, topic: str) -> bool:
+        return self.server.watching(topic)
+
+    def watch(self, topic: str):
+        pass
+
+    def unwatch(self, topic: str):
+        pass
+
+
+class ClientBroker:
+    """Брокер pubsub в воркере API: сообщения приходят от процесса записи"""
+
+    def __init__(self, client: WriterClient):
+        self.client = client
+
+    async def start(self, deliver: pubsub.Deliver):
+        self.client.on_message = deliver
+        try:
+            await self.client.connect()
+        except WriterUnavailable:
+            # Подписки отправятся при первом подключении
+            logger.warning("Writer process is not running yet")
+
+    async def publish(self, topic: str, message: Any):
+        await self.client.call("publish", {"topic": topic, "message": message})
+
+    async def stop(self):
+        self.client.on_message = None
+
+    def interested(self, topic: str) -> bool:
+        # Воркер сам не считает сообщения для других процессов: их публикует процесс записи
+        return False
+
+    def watch(self, topic: str):
+        self.client.watch(topic)
+
+    def unwatch(self, topic: str):
+        self.client.unwatch(topic)
+
+
+@operation("publish")
+async def publish(topic: str, message: Any):
+    await pubsub.hub.publish(topic, message)
+
+
+_client: Optional[WriterClient] = None
+
+
+def get_client() -> WriterClient:
+    global _client
+    if _client is None:
+        _client = WriterClient()
+    return _client
+
+
+async def wait_ready(path: str = WRITER_SOCKET, timeout: float = 30.0, alive: Optional[Callable[[], bool]] = None):
+    """Ждет, пока процесс записи начнет принимать соединения"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        try:
+            _, stream = await asyncio.open_unix_connection(path)
+        except OSError:
+            if alive is not None and not alive():
+                raise WriterUnavailable("Writer process exited during startup")
+            if loop.time() > deadline:
+                raise WriterUnavailable(f"Writer process did not start in {timeout} s")
+            await asyncio.sleep(0.1)
+            continue
+        stream.close()
+        return
+
+
+async def serve(path: str = WRITER_SOCKET):
+    """Процесс записи: схема, ingestor, фоновые задачи и сервер операций до SIGTERM/SIGINT"""
+    global WRITER_MODE
+    # Операции выполняются здесь, а не пересылаются самому себе
+    WRITER_MODE = "local"
+
+    import main
+    from db import create_tables, SessionLocal
+    import catalog_summary
+
+    await create_tables()
+    async with SessionLocal() as session:
+        await catalog_summary.ensure_catalog_summary(session)
+        await session.commit()
+    server = WriterServer(path)
+    pubsub.hub.broker = ServerBroker(server)
+    await main.ingestor.start()
+    await main.jobs.runner.start()
+    await server.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    logger.info("Writer process %d listening on %s", os.getpid(), path)
+    await stop.wait()
+
+    await server.stop()
+    await main.jobs.runner.stop()
+    await main.ingestor.stop()
+    await pubsub.hub.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Single writer process for multi-worker deployments")
+    parser.add_argument("--socket", default=WRITER_SOCKET)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    # Этот файл выполняется как __main__: операции зарегистрированы в модуле writer, который импортирует main
+    from writer import serve as serve_writer
+    asyncio.run(serve_writer(args.socket))
+
+
+if __name__ == "__main__":
+    main()